@@ -0,0 +1,164 @@
+"""
+Admission control for order intake.
+
+Each worker process applies, in order:
+
+1. a per-user token bucket (429 Too Many Requests when empty),
+2. a global token bucket (503 Service Unavailable when empty),
+3. a bounded concurrency queue: at most ORDER_MAX_CONCURRENCY orders are
+   processed at once and at most ORDER_MAX_QUEUE wait for a slot. A request
+   that would wait longer than ORDER_QUEUE_TIMEOUT_MS is rejected with 503.
+
+Admitted orders are the only ones a micro-batch (app/order_batching.py) can
+collect, so ORDER_MAX_CONCURRENCY also caps the batch size. With
+ORDER_BATCHING enabled it therefore defaults to ORDER_BATCH_MAX_SIZE: an
+admitted order then only awaits its batch, and each worker writes one batch
+at a time.
+
+Every rejection carries Retry-After and increments
+admission_rejections_total{reason=...}. Keeping order processing bounded
+leaves worker threads free for read endpoints during flash sales.
+"""
+import asyncio
+import math
+import os
+import time
+from fastapi import Depends, HTTPException, status
+from app.auth import get_current_active_user
+from app.models import User
+from app.order_batching import ORDER_BATCHING, ORDER_BATCH_MAX_SIZE
+from app import metrics
+
+ORDER_RATE_PER_SECOND = float(os.getenv("ORDER_RATE_PER_SECOND", 200))
+ORDER_BURST = float(os.getenv("ORDER_BURST", 400))
+ORDER_USER_RATE_PER_SECOND = float(os.getenv("ORDER_USER_RATE_PER_SECOND", 10))
+ORDER_USER_BURST = float(os.getenv("ORDER_USER_BURST", 20))
+ORDER_MAX_CONCURRENCY = int(os.getenv("ORDER_MAX_CONCURRENCY", ORDER_BATCH_MAX_SIZE if ORDER_BATCHING else 8))
+ORDER_MAX_QUEUE = int(os.getenv("ORDER_MAX_QUEUE", 64))
+ORDER_QUEUE_TIMEOUT_MS = float(os.getenv("ORDER_QUEUE_TIMEOUT_MS", 500))
+# Idle per-user buckets are dropped once there are more than this many
+MAX_TRACKED_USERS = 10000
+
+metrics.describe("admission_admitted_total", "Order requests admitted")
+metrics.describe("admission_rejections_total", "Order requests rejected by admission control")
+metrics.describe("admission_in_flight", "Order requests being processed")
+metrics.describe("admission_queued", "Order requests waiting for a processing slot")
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> float:
+        """Take a token; returns 0 on success, otherwise seconds until one is available"""
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        if self.rate <= 0:
+            return 60.0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.burst
+
+class AdmissionController:
+    def __init__(self, name: str, rate: float, burst: float, user_rate: float, user_burst: float,
+                 max_concurrency: int, max_queue: int, queue_timeout_ms: float):
+        self.name = name
+        self.global_bucket = TokenBucket(rate, burst)
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.user_buckets = {}
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout_ms / 1000.0
+        self.in_flight = 0
+        self.queued = 0
+        self._semaphore = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def _user_bucket(self, username: str) -> TokenBucket:
+        bucket = self.user_buckets.get(username)
+        if bucket is None:
+            if len(self.user_buckets) >= MAX_TRACKED_USERS:
+                self.user_buckets = {k: v for k, v in self.user_buckets.items() if not v.is_full()}
+            bucket = TokenBucket(self.user_rate, self.user_burst)
+            self.user_buckets[username] = bucket
+        return bucket
+
+    def _reject(self, reason: str, status_code: int, retry_after: float, detail: str):
+        metrics.increment("admission_rejections_total", {"endpoint": self.name, "reason": reason})
+        raise HTTPException(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+    def _update_gauges(self):
+        metrics.set_gauge("admission_in_flight", self.in_flight, {"endpoint": self.name})
+        metrics.set_gauge("admission_queued", self.queued, {"endpoint": self.name})
+
+    async def acquire(self, username: str):
+        wait = self._user_bucket(username).try_acquire()
+        if wait:
+            self._reject("user_rate", status.HTTP_429_TOO_MANY_REQUESTS, wait,
+                         "Too many orders from this user, slow down")
+        wait = self.global_bucket.try_acquire()
+        if wait:
+            self._reject("global_rate", status.HTTP_503_SERVICE_UNAVAILABLE, wait,
+                         "Order intake is at capacity, retry shortly")
+
+        if self.semaphore.locked():
+            if self.queued >= self.max_queue:
+                self._reject("queue_full", status.HTTP_503_SERVICE_UNAVAILABLE, self.queue_timeout,
+                             "Order intake is at capacity, retry shortly")
+            self.queued += 1
+            self._update_gauges()
+            try:
+                await asyncio.wait_for(self.semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._reject("queue_timeout", status.HTTP_503_SERVICE_UNAVAILABLE, self.queue_timeout,
+                             "Order intake is at capacity, retry shortly")
+            finally:
+                self.queued -= 1
+        else:
+            await self.semaphore.acquire()
+
+        self.in_flight += 1
+        self._update_gauges()
+        metrics.increment("admission_admitted_total", {"endpoint": self.name})
+
+    def release(self):
+        self.in_flight -= 1
+        self._update_gauges()
+        self.semaphore.release()
+
+order_admission = AdmissionController(
+    "create_order",
+    ORDER_RATE_PER_SECOND, ORDER_BURST,
+    ORDER_USER_RATE_PER_SECOND, ORDER_USER_BURST,
+    ORDER_MAX_CONCURRENCY, ORDER_MAX_QUEUE, ORDER_QUEUE_TIMEOUT_MS
+)
+
+async def admit_order(current_user: User = Depends(get_current_active_user)):
+    """Dependency: holds an order-processing slot for the duration of the request"""
+    await order_admission.acquire(current_user.username)
+    try:
+        yield
+    finally:
+        order_admission.release()
@@ -0,0 +1,138 @@
+"""
+Hot/cold tiering for orders.
+
+Delivered and cancelled orders that have not been touched for
+ORDER_ARCHIVE_AFTER_DAYS are moved from `orders` into `orders_archive` in
+batches. Day-to-day paths (order list, dashboard, recent analytics) only read
+the live `orders` collection; explicit history queries go through the helpers
+below, which span both tiers. Delta sync clients of the order list see
+archived orders as deletions.
+
+Run once from the command line:
+
+    python -m app.archive --older-than-days 180
+"""
+import argparse
+import heapq
+import logging
+import os
+from datetime import datetime, timedelta
+from pymongo import ReplaceOne, DeleteOne
+from app.database import get_orders_collection, get_orders_archive_collection, run_in_transaction
+from app.change_feed import record_tombstones, ORDER
+
+logger = logging.getLogger(__name__)
+
+ARCHIVABLE_STATUSES = ["delivered", "cancelled"]
+ARCHIVE_AFTER_DAYS = int(os.getenv("ORDER_ARCHIVE_AFTER_DAYS", 180))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ORDER_ARCHIVE_BATCH_SIZE", 1000))
+ARCHIVE_INTERVAL_MINUTES = float(os.getenv("ORDER_ARCHIVE_INTERVAL_MINUTES", 0))
+
+def archive_cutoff(older_than_days: int = None) -> datetime:
+    days = ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    return datetime.utcnow() - timedelta(days=days)
+
+def archive_orders(older_than_days: int = None, batch_size: int = None) -> int:
+    """Move finished orders older than the cutoff to the archive, returns how many were moved"""
+    orders_collection = get_orders_collection()
+    archive_collection = get_orders_archive_collection()
+    batch_size = batch_size or ARCHIVE_BATCH_SIZE
+    query = {
+        "status": {"$in": ARCHIVABLE_STATUSES},
+        "updated_at": {"$lt": archive_cutoff(older_than_days)}
+    }
+    
+    moved = 0
+    while True:
+        batch = list(orders_collection.find(query).limit(batch_size))
+        if not batch:
+            break
+        
+        archived = run_in_transaction(lambda session: _archive_batch(batch, session))
+        moved += len(archived)
+        record_tombstones(ORDER, archived, reason="archived")
+        
+        if len(batch) < batch_size:
+            break
+    
+    if moved:
+        logger.info(f"Archived {moved} orders")
+    return moved
+
+def _archive_batch(batch: list, session=None) -> list:
+    """
+    Copy a batch into the archive and delete from the live tier exactly the
+    versions that were copied; returns the ids that were moved.
+
+    The copy is upserted, so a run interrupted between the two steps is
+    overwritten by the next one instead of leaving an outdated copy. An
+    order touched since it was read no longer matches its copied updated_at:
+    it stays live and its copy is removed again, so an order is only ever in
+    one tier (with transactions enabled the three steps commit together).
+    """
+    orders_collection = get_orders_collection()
+    archive_collection = get_orders_archive_collection()
+    archive_collection.bulk_write(
+        [ReplaceOne({"_id": order["_id"]}, order, upsert=True) for order in batch],
+        ordered=False, session=session
+    )
+    orders_collection.bulk_write(
+        [DeleteOne({"_id": order["_id"], "updated_at": order["updated_at"]}) for order in batch],
+        ordered=False, session=session
+    )
+    ids = [order["_id"] for order in batch]
+    remaining = {order["_id"] for order in orders_collection.find({"_id": {"$in": ids}}, {"_id": 1}, session=session)}
+    stale = [DeleteOne({"_id": order["_id"], "updated_at": order["updated_at"]}) for order in batch if order["_id"] in remaining]
+    if stale:
+        archive_collection.bulk_write(stale, ordered=False, session=session)
+    return [_id for _id in ids if _id not in remaining]
+
+def needs_archive(start_date: datetime = None) -> bool:
+    """Whether a query over orders created since `start_date` can reach archived orders"""
+    # Archived orders were last updated (and so created) before the cutoff
+    return start_date is None or start_date < archive_cutoff()
+
+def find_order_any_tier(query: dict):
+    """find_one that falls back to the archive when the order is not live"""
+    order = get_orders_collection().find_one(query)
+    if order is None:
+        order = get_orders_archive_collection().find_one(query)
+    return order
+
+def iter_orders_all_tiers(query: dict, projection: dict = None, analytics: bool = False):
+    """Iterate over matching orders from both tiers (unordered), each order once"""
+    # An order archived while the live tier is read can turn up in both;
+    # reading the live tier first means none is missed
+    seen = set()
+    for order in get_orders_collection(analytics).find(query, projection):
+        seen.add(order["_id"])
+        yield order
+    for order in get_orders_archive_collection(analytics).find(query, projection):
+        if order["_id"] not in seen:
+            yield order
+
+def find_orders_all_tiers(query: dict, skip: int = 0, limit: int = 100, projection: dict = None):
+    """Newest-first page of matching orders across both tiers"""
+    if projection and all(projection.values()):
+        # The tiers are merged on created_at
+        projection = {**projection, "created_at": 1}
+    window = skip + limit
+    cursors = [
+        collection.find(query, projection).sort("created_at", -1).limit(window)
+        for collection in (get_orders_collection(), get_orders_archive_collection())
+    ]
+    merged = heapq.merge(*cursors, key=lambda order: order["created_at"], reverse=True)
+    return list(merged)[skip:window]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move old delivered/cancelled orders to orders_archive")
+    parser.add_argument("--older-than-days", type=int, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    args = parser.parse_args(argv)
+    
+    logging.basicConfig(level=logging.INFO)
+    moved = archive_orders(args.older_than_days, args.batch_size)
+    print(f"Archived {moved} orders")
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,5 @@
 from datetime import datetime, timedelta
 from typing import Optional
-from jose import JWTError, jwt
 import hashlib
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
@@ -43,6 +42,9 @@ def authenticate_user(username: str, password: str):
     return user
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+    # jose pulls in the crypto backends; import on first use to keep startup fast
+    from jose import jwt
+    
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
@@ -52,7 +54,20 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def get_user_from_token(token: str) -> Optional[User]:
+    """The user a bearer token belongs to, or None if it is not valid"""
+    from jose import JWTError, jwt
+    
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    username = payload.get("sub")
+    return get_user(username) if username else None
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    from jose import JWTError, jwt
+    
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -83,15 +98,19 @@ def create_admin_user():
     admin_username = os.getenv("ADMIN_USERNAME", "admin")
     admin_password = os.getenv("ADMIN_PASSWORD", "admin123")
     
-    if not users_collection.find_one({"username": admin_username}):
-        admin_user = User(
-            username=admin_username,
-            hashed_password=get_password_hash(admin_password),
-            role="admin",
-            is_active=True
-        )
-        # Convert to dict and remove None id for insertion
-        user_dict = admin_user.dict(by_alias=True, exclude_none=True)
-        if "_id" in user_dict and user_dict["_id"] is None:
-            del user_dict["_id"]
-        users_collection.insert_one(user_dict)
\ No newline at end of file
+    admin_user = User(
+        username=admin_username,
+        hashed_password=get_password_hash(admin_password),
+        role="admin",
+        is_active=True
+    )
+    # Convert to dict and remove None id for insertion
+    user_dict = admin_user.dict(by_alias=True, exclude_none=True)
+    if "_id" in user_dict and user_dict["_id"] is None:
+        del user_dict["_id"]
+    # Single upsert: only inserts when the admin does not exist yet
+    users_collection.update_one(
+        {"username": admin_username},
+        {"$setOnInsert": user_dict},
+        upsert=True
+    )
\ No newline at end of file
@@ -0,0 +1,134 @@
+"""
+Delta sync for the product and order lists.
+
+A client keeps a local copy of a list and pulls only what changed:
+
+    GET /api/products/changes                 # first call: everything, paged
+    GET /api/products/changes?since=<cursor>  # afterwards: changes since then
+
+Each page returns the documents whose updated_at lies after the cursor, a
+tombstone for every document deleted after it (and for orders moved to the
+archive), a new cursor and whether more pages are waiting. Apply `changes`
+(upsert by id) and then `deleted`; the same change can be delivered twice,
+so applying must be idempotent.
+
+* entries are ordered by (timestamp, changes before tombstones, _id), so
+  pages never skip or loop even when many writes share a millisecond
+* updated_at is stamped before the write commits, so a change can become
+  visible slightly after later ones. The cursor returned with the last page
+  is therefore held CHANGES_LAG_SECONDS behind the clock, and the changes of
+  that window are sent again on the next pull.
+* tombstones are kept for TOMBSTONE_TTL_DAYS; an older cursor gets 410 and
+  the client starts over without one
+"""
+import base64
+import binascii
+import os
+from datetime import datetime, timedelta
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException, status
+from app.database import get_tombstones_collection
+
+CHANGES_LAG_SECONDS = float(os.getenv("CHANGES_LAG_SECONDS", 5))
+TOMBSTONE_TTL_DAYS = float(os.getenv("TOMBSTONE_TTL_DAYS", 7))
+MAX_CHANGES_PAGE = 1000
+
+PRODUCT = "product"
+ORDER = "order"
+
+# Position of an entry in the feed: (timestamp, source, _id)
+DOCUMENT = 0
+TOMBSTONE = 1
+EPOCH = datetime(1970, 1, 1)
+MIN_ID = ObjectId("0" * 24)
+
+def _milliseconds(moment: datetime) -> int:
+    # MongoDB stores datetimes with millisecond precision
+    return (moment - EPOCH) // timedelta(milliseconds=1)
+
+def encode_cursor(position) -> str:
+    moment, source, _id = position
+    return base64.urlsafe_b64encode(f"{_milliseconds(moment)}.{source}.{_id}".encode()).decode()
+
+def decode_cursor(cursor: str):
+    """Feed position of a cursor (the very beginning when there is none)"""
+    if not cursor:
+        return (EPOCH, DOCUMENT, MIN_ID)
+    try:
+        milliseconds, source, _id = base64.urlsafe_b64decode(cursor.encode()).decode().split(".")
+        position = (EPOCH + timedelta(milliseconds=int(milliseconds)), int(source), ObjectId(_id))
+    except (ValueError, InvalidId, binascii.Error, UnicodeDecodeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    if position[0] < datetime.utcnow() - timedelta(days=TOMBSTONE_TTL_DAYS):
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail="Cursor is older than the deletion history; sync again without one"
+        )
+    return position
+
+def _after(field: str, position, source: int) -> dict:
+    """Filter for entries of `source` that come after `position`"""
+    moment, cursor_source, cursor_id = position
+    if source > cursor_source:
+        return {field: {"$gte": moment}}
+    if source < cursor_source:
+        return {field: {"$gt": moment}}
+    return {"$or": [{field: {"$gt": moment}}, {field: moment, "_id": {"$gt": cursor_id}}]}
+
+def record_tombstones(kind: str, ids, reason: str = "deleted"):
+    """Remember that these documents left the list"""
+    ids = list(ids)
+    if not ids:
+        return
+    now = datetime.utcnow()
+    get_tombstones_collection().insert_many([
+        {
+            "kind": kind,
+            "doc_id": str(_id),
+            "reason": reason,
+            "deleted_at": now,
+            "expires_at": now + timedelta(days=TOMBSTONE_TTL_DAYS)
+        }
+        for _id in ids
+    ], ordered=False)
+
+def changes_since(kind: str, collection, cursor: str, limit: int, projection: dict = None) -> dict:
+    """
+    One page of the feed: {"changes": [documents], "deleted": [tombstones],
+    "since": start of the page, "cursor": next cursor, "has_more": bool}
+    """
+    limit = max(1, min(limit, MAX_CHANGES_PAGE))
+    position = decode_cursor(cursor)
+    floor = datetime.utcnow() - timedelta(seconds=CHANGES_LAG_SECONDS)
+
+    documents = collection.find(_after("updated_at", position, DOCUMENT), projection)
+    documents = documents.sort([("updated_at", 1), ("_id", 1)]).limit(limit + 1)
+    tombstones = get_tombstones_collection().find(
+        {"kind": kind, **_after("deleted_at", position, TOMBSTONE)}
+    ).sort([("deleted_at", 1), ("_id", 1)]).limit(limit + 1)
+    entries = sorted(
+        [((document["updated_at"], DOCUMENT, document["_id"]), document) for document in documents]
+        + [((tombstone["deleted_at"], TOMBSTONE, tombstone["_id"]), tombstone) for tombstone in tombstones],
+        key=lambda entry: entry[0]
+    )
+
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    if has_more:
+        next_position = entries[-1][0]
+    else:
+        # Everything up to now was returned; step back so that writes still
+        # committing with an earlier updated_at are picked up next time
+        next_position = (EPOCH + timedelta(milliseconds=_milliseconds(floor)), DOCUMENT, MIN_ID)
+
+    return {
+        "changes": [entry for (_, source, _), entry in entries if source == DOCUMENT],
+        "deleted": [
+            {"id": entry["doc_id"], "reason": entry["reason"], "deleted_at": entry["deleted_at"]}
+            for (_, source, _), entry in entries if source == TOMBSTONE
+        ],
+        "since": position[0],
+        "cursor": encode_cursor(next_position),
+        "has_more": has_more
+    }
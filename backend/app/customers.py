@@ -0,0 +1,237 @@
+"""
+Per-customer order history and lifetime value.
+
+Orders carry a `customer_key` (the customer email, trimmed and lowercased)
+indexed together with created_at in both order tiers, so a customer's
+history is an index range scan, paged newest first with an opaque cursor.
+
+`customers` holds one aggregate per customer key: order_count,
+lifetime_value, first_order_at / last_order_at and the latest name and
+email used. It follows the sales counters (app/sales_counters.py): placing
+an order counts it, cancelling or deleting it takes it out and un-cancelling
+counts it again, each at most once per order through the same
+`sales_reversed` claim. Cancelled orders are not counted. When the order
+that set first_order_at or last_order_at is taken out, the date is looked
+up again from the index.
+
+    python -m app.customers rebuild   # backfill customer_key and recompute all aggregates
+"""
+import argparse
+import base64
+import binascii
+import heapq
+import logging
+from datetime import datetime, timedelta
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import UpdateOne, InsertOne
+from app.database import get_database, get_customers_collection, get_orders_collection, get_orders_archive_collection
+from app.archive import iter_orders_all_tiers
+
+logger = logging.getLogger(__name__)
+
+STATE_ID = "customers"
+BATCH_SIZE = 1000
+MAX_HISTORY_PAGE = 200
+EPOCH = datetime(1970, 1, 1)
+
+class InvalidCursor(ValueError):
+    pass
+
+def customer_key(email: str) -> str:
+    return email.strip().lower()
+
+def _state_collection():
+    return get_database().customer_state
+
+def _counted_query(key: str) -> dict:
+    """Orders of the customer that count towards the aggregates"""
+    return {"customer_key": key, "status": {"$ne": "cancelled"}, "sales_reversed": {"$ne": True}}
+
+def _apply_many(orders: list, sign: int, session=None, new: bool = False):
+    """$inc (sign=1) or $dec (sign=-1) the aggregates of the orders' customers"""
+    totals = {}
+    for order in orders:
+        key = order.get("customer_key") or customer_key(order["customer_email"])
+        entry = totals.setdefault(key, {"count": 0, "value": 0.0, "first": order["created_at"], "last": order["created_at"]})
+        entry["count"] += 1
+        entry["value"] += order["total_amount"]
+        entry["first"] = min(entry["first"], order["created_at"])
+        if order["created_at"] >= entry["last"]:
+            entry["last"] = order["created_at"]
+            entry["name"] = order["customer_name"]
+            entry["email"] = order["customer_email"]
+
+    now = datetime.utcnow()
+    operations = []
+    for key, entry in totals.items():
+        update = {
+            "$inc": {"order_count": sign * entry["count"], "lifetime_value": sign * entry["value"]},
+            "$set": {"updated_at": now}
+        }
+        if sign > 0:
+            update["$max"] = {"last_order_at": entry["last"]}
+            update["$min"] = {"first_order_at": entry["first"]}
+            if new:
+                # A new order is the customer's latest, so its name and email are current
+                update["$set"].update(name=entry["name"], email=entry["email"])
+            else:
+                update["$setOnInsert"] = {"name": entry["name"], "email": entry["email"]}
+        operations.append(UpdateOne({"_id": key}, update, upsert=sign > 0))
+    if operations:
+        get_customers_collection().bulk_write(operations, ordered=False, session=session)
+    if sign < 0:
+        for key, entry in totals.items():
+            _refresh_dates(key, entry["first"], entry["last"])
+
+def _edge_order(key: str, direction: int):
+    """The customer's first (direction=1) or last (-1) counted order across both tiers"""
+    candidates = [
+        collection.find_one(_counted_query(key), {"created_at": 1}, sort=[("created_at", direction)])
+        for collection in (get_orders_collection(), get_orders_archive_collection())
+    ]
+    candidates = [order for order in candidates if order]
+    if not candidates:
+        return None
+    return (max if direction < 0 else min)(candidates, key=lambda order: order["created_at"])
+
+def _refresh_dates(key: str, first: datetime, last: datetime):
+    """Look up first/last_order_at again if the orders just taken out set them"""
+    customers_collection = get_customers_collection()
+    customer = customers_collection.find_one({"_id": key}, {"first_order_at": 1, "last_order_at": 1})
+    if not customer:
+        return
+    for field, moment, direction in (("first_order_at", first, 1), ("last_order_at", last, -1)):
+        if customer.get(field) != moment:
+            continue
+        order = _edge_order(key, direction)
+        # Conditional, so an order placed meanwhile ($max/$min) is not overwritten
+        customers_collection.update_one(
+            {"_id": key, field: moment},
+            {"$set": {field: order["created_at"]}} if order else {"$unset": {field: ""}}
+        )
+
+def record_customer_orders(orders: list, session=None):
+    """Count newly placed orders"""
+    _apply_many(orders, 1, session, new=True)
+
+def remove_customer_order(order: dict):
+    """Take a cancelled or deleted order out (the caller claimed it, see reverse_order_sales)"""
+    _apply_many([order], -1)
+
+def reinstate_customer_order(order: dict):
+    """Count an order again after it was moved out of cancelled"""
+    _apply_many([order], 1)
+
+def get_customer(email: str):
+    return get_customers_collection().find_one({"_id": customer_key(email)})
+
+def top_customers(limit: int = 20) -> list:
+    """Customers by lifetime value (an indexed sort)"""
+    return list(get_customers_collection().find({"order_count": {"$gt": 0}}).sort("lifetime_value", -1).limit(limit))
+
+def _encode_cursor(order: dict) -> str:
+    milliseconds = (order["created_at"] - EPOCH) // timedelta(milliseconds=1)
+    return base64.urlsafe_b64encode(f"{milliseconds}.{order['_id']}".encode()).decode()
+
+def _decode_cursor(cursor: str):
+    try:
+        milliseconds, _id = base64.urlsafe_b64decode(cursor.encode()).decode().split(".")
+        return EPOCH + timedelta(milliseconds=int(milliseconds)), ObjectId(_id)
+    except (ValueError, InvalidId, binascii.Error, UnicodeDecodeError):
+        raise InvalidCursor(cursor)
+
+def customer_orders(email: str, cursor: str = None, limit: int = 50, projection: dict = None):
+    """
+    A page of the customer's orders (live and archived), newest first.
+    Returns (orders, next_cursor); next_cursor is None on the last page.
+    """
+    limit = max(1, min(limit, MAX_HISTORY_PAGE))
+    query = {"customer_key": customer_key(email)}
+    if cursor:
+        created_at, _id = _decode_cursor(cursor)
+        query["$or"] = [{"created_at": {"$lt": created_at}}, {"created_at": created_at, "_id": {"$lt": _id}}]
+    cursors = [
+        collection.find(query, projection).sort([("created_at", -1), ("_id", -1)]).limit(limit + 1)
+        for collection in (get_orders_collection(), get_orders_archive_collection())
+    ]
+    orders = []
+    seen = set()
+    for order in heapq.merge(*cursors, key=lambda order: (order["created_at"], order["_id"]), reverse=True):
+        # An order being archived can briefly be in both tiers
+        if order["_id"] in seen:
+            continue
+        seen.add(order["_id"])
+        orders.append(order)
+        if len(orders) > limit:
+            break
+    if len(orders) > limit:
+        return orders[:limit], _encode_cursor(orders[limit - 1])
+    return orders, None
+
+def _backfill_keys() -> int:
+    """Set customer_key on orders placed before it existed"""
+    updated = 0
+    for collection in (get_orders_collection(), get_orders_archive_collection()):
+        operations = []
+        for order in collection.find({"customer_key": {"$exists": False}}, {"customer_email": 1}):
+            operations.append(UpdateOne(
+                {"_id": order["_id"]}, {"$set": {"customer_key": customer_key(order.get("customer_email", ""))}}
+            ))
+            if len(operations) >= BATCH_SIZE:
+                updated += collection.bulk_write(operations, ordered=False).modified_count
+                operations = []
+        if operations:
+            updated += collection.bulk_write(operations, ordered=False).modified_count
+    return updated
+
+def rebuild() -> int:
+    """
+    Backfill customer_key and recompute every aggregate from the live and
+    archived orders; returns the number of customers. Orders placed while
+    this runs may be counted twice, so run it when order intake is quiet.
+    """
+    _backfill_keys()
+    customers = {}
+    projection = {"customer_key": 1, "customer_name": 1, "customer_email": 1, "total_amount": 1, "created_at": 1}
+    for order in iter_orders_all_tiers({"status": {"$ne": "cancelled"}, "sales_reversed": {"$ne": True}}, projection):
+        customer = customers.get(order["customer_key"])
+        if customer is None:
+            customer = customers[order["customer_key"]] = {
+                "_id": order["customer_key"], "order_count": 0, "lifetime_value": 0.0,
+                "first_order_at": order["created_at"], "last_order_at": order["created_at"]
+            }
+        customer["order_count"] += 1
+        customer["lifetime_value"] += order["total_amount"]
+        customer["first_order_at"] = min(customer["first_order_at"], order["created_at"])
+        if order["created_at"] >= customer["last_order_at"]:
+            customer["last_order_at"] = order["created_at"]
+            customer["name"] = order["customer_name"]
+            customer["email"] = order["customer_email"]
+
+    customers_collection = get_customers_collection()
+    customers_collection.delete_many({})
+    now = datetime.utcnow()
+    operations = [InsertOne({**customer, "updated_at": now}) for customer in customers.values()]
+    for start in range(0, len(operations), BATCH_SIZE):
+        customers_collection.bulk_write(operations[start:start + BATCH_SIZE], ordered=False)
+    _state_collection().update_one({"_id": STATE_ID}, {"$set": {"built_at": now}}, upsert=True)
+    return len(customers)
+
+def initialize() -> int:
+    """Build the aggregates from the existing orders the first time the application runs"""
+    if _state_collection().find_one({"_id": STATE_ID}):
+        return 0
+    return rebuild()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Customer aggregates maintenance")
+    parser.add_argument("command", choices=["rebuild"])
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "rebuild":
+        print(f"Rebuilt aggregates for {rebuild()} customers")
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,8 @@
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
+from pymongo import MongoClient, ASCENDING, DESCENDING, uri_parser
+from pymongo.errors import ConfigurationError, OperationFailure
+from pymongo.read_preferences import (
+    Primary, PrimaryPreferred, Secondary, SecondaryPreferred, Nearest
+)
 import os
 from dotenv import load_dotenv
 import logging
@@ -8,39 +11,221 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Read preference for analytics/report traffic. Max staleness must be >= 90
+# seconds, or -1 for no limit.
+ANALYTICS_READ_PREFERENCE = os.getenv("ANALYTICS_READ_PREFERENCE", "secondaryPreferred")
+ANALYTICS_MAX_STALENESS_SECONDS = int(os.getenv("ANALYTICS_MAX_STALENESS_SECONDS", -1))
+
+READ_PREFERENCES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+# Storage engine: "mongo" (the server at MONGODB_URL) or "embedded" (an
+# in-process database for development and local benchmark runs, see
+# app/embedded_storage.py, only imported when selected)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mongo").lower()
+STORAGE_BACKENDS = ["mongo", "embedded"]
+EMBEDDED_SNAPSHOT_SECONDS = float(os.getenv("EMBEDDED_SNAPSHOT_SECONDS", 60))
+
+# Multi-document transactions (requires a replica set). When enabled, stock
+# changes and their ledger entries commit atomically.
+MONGODB_TRANSACTIONS = os.getenv("MONGODB_TRANSACTIONS", "false").lower() == "true"
+
+# Rolling windows (in days) kept as per-product sales counters
+SALES_COUNTER_WINDOWS = [int(days) for days in os.getenv("SALES_COUNTER_WINDOWS", "7,30,90").split(",") if days.strip()]
+
 class Database:
     client = None
     database = None
+    analytics_database = None
+    pid = None
 
 def get_database():
+    # MongoClient is not fork-safe: a worker process that inherited the
+    # parent's client drops it and lazily creates its own
+    if Database.client is not None and Database.pid != os.getpid():
+        Database.client = None
+        Database.database = None
+        Database.analytics_database = None
     if Database.client is None:
+        if STORAGE_BACKEND not in STORAGE_BACKENDS:
+            raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
         try:
             mongodb_url = os.getenv("MONGODB_URL", "mongodb://localhost:27017/inventory_db")
-            Database.client = MongoClient(mongodb_url)
-            # Test connection
-            Database.client.admin.command('ping')
+            if STORAGE_BACKEND == "embedded":
+                from app.embedded_storage import EmbeddedClient
+                # Same database name as the server would use
+                Database.client = EmbeddedClient(uri_parser.parse_uri(mongodb_url)["database"] or "inventory_db")
+            else:
+                # The client connects in the background; nothing here blocks on
+                # the server. Reachability is reported by the readiness probe.
+                # Command timing for request profiling, only when enabled
+                from app.profiling import command_listeners
+                listeners = command_listeners()
+                Database.client = MongoClient(mongodb_url, **({"event_listeners": listeners} if listeners else {}))
+            Database.pid = os.getpid()
             Database.database = Database.client.get_database()
-            logger.info("Connected to MongoDB successfully")
-        except ConnectionFailure as e:
-            logger.error(f"Failed to connect to MongoDB: {e}")
+            logger.info(f"{'Embedded database' if STORAGE_BACKEND == 'embedded' else 'MongoDB client'} created")
+        except ConfigurationError as e:
+            logger.error(f"Invalid MongoDB configuration: {e}")
             raise e
     return Database.database
 
 def close_database():
-    if Database.client:
+    # Only the process that created the client may close it
+    if Database.client and Database.pid == os.getpid():
         Database.client.close()
-        Database.client = None
-        Database.database = None
+    Database.client = None
+    Database.database = None
+    Database.analytics_database = None
+
+def maintain_embedded_storage():
+    """TTL sweep and snapshot of the embedded database (no-op for MongoDB)"""
+    if STORAGE_BACKEND == "embedded" and Database.client is not None and Database.pid == os.getpid():
+        from app.embedded_storage import maintain
+        maintain(Database.client)
+
+def run_in_transaction(func):
+    """Call func(session) inside a transaction when enabled, otherwise func(None)"""
+    # The embedded database serializes writes but has no transactions
+    if not MONGODB_TRANSACTIONS or STORAGE_BACKEND == "embedded":
+        return func(None)
+    get_database()
+    with Database.client.start_session() as session:
+        return session.with_transaction(func)
+
+def analytics_read_preference():
+    mode = READ_PREFERENCES.get(ANALYTICS_READ_PREFERENCE)
+    if mode is None:
+        raise ValueError(f"Unknown ANALYTICS_READ_PREFERENCE: {ANALYTICS_READ_PREFERENCE}")
+    if mode is Primary:
+        return Primary()
+    return mode(max_staleness=ANALYTICS_MAX_STALENESS_SECONDS)
+
+def get_analytics_database():
+    """Database handle for heavy reads that may be served by a secondary"""
+    if Database.analytics_database is None:
+        Database.analytics_database = get_database().with_options(
+            read_preference=analytics_read_preference()
+        )
+    return Database.analytics_database
 
 # Collections
-def get_products_collection():
-    db = get_database()
+# Pass analytics=True for report/export reads that tolerate replication lag;
+# writes and read-your-writes paths use the default primary handle.
+def get_products_collection(analytics: bool = False):
+    db = get_analytics_database() if analytics else get_database()
     return db.products
 
-def get_orders_collection():
-    db = get_database()
+def get_orders_collection(analytics: bool = False):
+    db = get_analytics_database() if analytics else get_database()
     return db.orders
 
+def get_orders_archive_collection(analytics: bool = False):
+    db = get_analytics_database() if analytics else get_database()
+    return db.orders_archive
+
+def get_stock_movements_collection():
+    db = get_database()
+    return db.stock_movements
+
+def get_stock_shards_collection():
+    db = get_database()
+    return db.stock_shards
+
+def get_stock_snapshots_collection():
+    db = get_database()
+    return db.stock_snapshots
+
+def get_product_sales_collection(analytics: bool = False):
+    db = get_analytics_database() if analytics else get_database()
+    return db.product_sales
+
+def get_product_sales_daily_collection(analytics: bool = False):
+    db = get_analytics_database() if analytics else get_database()
+    return db.product_sales_daily
+
+def get_reports_collection():
+    db = get_database()
+    return db.reports
+
+def get_idempotency_keys_collection():
+    db = get_database()
+    return db.idempotency_keys
+
+def get_profiles_collection():
+    db = get_database()
+    return db.profiles
+
+def get_customers_collection():
+    db = get_database()
+    return db.customers
+
+def get_tombstones_collection():
+    db = get_database()
+    return db.tombstones
+
 def get_users_collection():
     db = get_database()
-    return db.users
\ No newline at end of file
+    return db.users
+
+def ensure_indexes():
+    """Create the indexes the application relies on (idempotent)"""
+    db = get_database()
+    # Unique constraints replace the SKU / username pre-check queries
+    for collection, field in [(db.products, "sku"), (db.users, "username")]:
+        try:
+            collection.create_index([(field, ASCENDING)], unique=True)
+        except OperationFailure as e:
+            # Existing duplicates must be cleaned up before the index can be built
+            logger.error(f"Could not create unique index on {collection.name}.{field}: {e}")
+    
+    # Hot/cold order tiering: the archiver scans by status and age, history
+    # queries on the archive sort by creation date
+    db.orders.create_index([("status", ASCENDING), ("updated_at", ASCENDING)])
+    db.orders_archive.create_index([("created_at", DESCENDING)])
+    
+    # Stock ledger: per-product replay window and point-in-time snapshot lookup
+    db.stock_movements.create_index([("product_id", ASCENDING), ("created_at", ASCENDING)])
+    db.stock_movements.create_index([("created_at", ASCENDING)])
+    db.stock_snapshots.create_index([("product_id", ASCENDING), ("taken_at", DESCENDING)])
+    # Sharded stock: all shards of a product for totals and rebalancing
+    db.stock_shards.create_index([("product_id", ASCENDING), ("shard", ASCENDING)])
+    
+    # Customer history: one customer's orders newest first in either tier;
+    # customers by lifetime value
+    for collection in (db.orders, db.orders_archive):
+        collection.create_index([("customer_key", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)])
+    db.customers.create_index([("lifetime_value", DESCENDING)])
+    
+    # Delta sync: changes in (updated_at, _id) order and deletions per list
+    # (the orders one also serves the line item store's incremental refresh);
+    # tombstones expire after TOMBSTONE_TTL_DAYS
+    db.products.create_index([("updated_at", ASCENDING), ("_id", ASCENDING)])
+    db.orders.create_index([("updated_at", ASCENDING), ("_id", ASCENDING)])
+    # Its former single-field prefix is redundant
+    if "updated_at_1" in db.orders.index_information():
+        db.orders.drop_index("updated_at_1")
+    db.stock_shards.create_index([("updated_at", ASCENDING)])
+    db.tombstones.create_index([("kind", ASCENDING), ("deleted_at", ASCENDING), ("_id", ASCENDING)])
+    db.tombstones.create_index([("expires_at", ASCENDING)], expireAfterSeconds=0)
+    
+    # Sales counters: one bucket per product and day, top-N by lifetime and
+    # by each rolling window straight off an index
+    db.product_sales_daily.create_index([("product_id", ASCENDING), ("day", ASCENDING)], unique=True)
+    db.product_sales_daily.create_index([("day", ASCENDING)])
+    db.product_sales.create_index([("revenue", DESCENDING)])
+    for days in SALES_COUNTER_WINDOWS:
+        db.product_sales.create_index([(f"windows.{days}.revenue", DESCENDING)])
+    
+    # Report jobs: reuse lookup by type + parameters; expired results are
+    # removed by the TTL monitor
+    db.reports.create_index([("params_key", ASCENDING), ("created_at", DESCENDING)])
+    db.reports.create_index([("expires_at", ASCENDING)], expireAfterSeconds=0)
+    db.idempotency_keys.create_index([("expires_at", ASCENDING)], expireAfterSeconds=0)
+    db.profiles.create_index([("created_at", DESCENDING)])
+    db.profiles.create_index([("expires_at", ASCENDING)], expireAfterSeconds=0)
@@ -1,8 +1,6 @@
-import smtplib
 import os
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
 import logging
 
 load_dotenv()
@@ -17,6 +15,11 @@ class EmailService:
         self.password = os.getenv("EMAIL_PASSWORD")
 
     async def send_email(self, to_email: str, subject: str, body: str):
+        # Imported on first send, not at application startup
+        import smtplib
+        from email.mime.text import MIMEText
+        from email.mime.multipart import MIMEMultipart
+        
         try:
             msg = MIMEMultipart()
             msg['From'] = self.username
@@ -25,12 +28,8 @@ class EmailService:
 
             msg.attach(MIMEText(body, 'html'))
 
-            server = smtplib.SMTP(self.smtp_server, self.smtp_port)
-            server.starttls()
-            server.login(self.username, self.password)
-            text = msg.as_string()
-            server.sendmail(self.username, to_email, text)
-            server.quit()
+            # smtplib blocks: talk to the SMTP server from the threadpool
+            await run_in_threadpool(self._deliver, smtplib, to_email, msg.as_string())
             
             logger.info(f"Email sent successfully to {to_email}")
             return True
@@ -38,6 +37,13 @@ class EmailService:
             logger.error(f"Failed to send email: {e}")
             return False
 
+    def _deliver(self, smtplib, to_email: str, text: str):
+        server = smtplib.SMTP(self.smtp_server, self.smtp_port)
+        server.starttls()
+        server.login(self.username, self.password)
+        server.sendmail(self.username, to_email, text)
+        server.quit()
+
     async def send_low_stock_alert(self, product_name: str, current_stock: int, admin_email: str):
         subject = f"Low Stock Alert: {product_name}"
         body = f"""
@@ -0,0 +1,182 @@
+"""
+Embedded storage backend: the database runs inside the process.
+
+With STORAGE_BACKEND=embedded the application, the benchmarks and the
+stress test run without a mongod. It is meant for development, demos and
+single-machine benchmarks, not as a production store: data is only as
+durable as the last snapshot. The engine is mongomock, an in-memory
+implementation of the pymongo collection API (an optional dependency:
+pip install -r requirements-embedded.txt), so every module works unchanged
+on top of it; queries scan documents in Python and timings are not
+comparable with MongoDB ones.
+
+    cd backend
+    STORAGE_BACKEND=embedded EMBEDDED_DATA_DIR=data/embedded python -m app.server --workers 1
+
+* data lives in the process. With EMBEDDED_DATA_DIR set it is written there
+  every EMBEDDED_SNAPSHOT_SECONDS (see app/database.py) and on shutdown (one mongodump-style
+  <collection>.bson file per collection, replaced atomically) and loaded
+  back on startup; a crash loses at most one interval. Without it the
+  data is gone when the process exits.
+* every operation holds one lock, reads included (a cursor computes its
+  results under it), so conditional updates such as the stock decrement
+  stay atomic across threads and a read never sees a collection change
+  under it
+* TTL indexes are honoured by a sweep that runs with each snapshot
+* a single process only: app.server runs one worker, and
+  MONGODB_TRANSACTIONS is ignored
+"""
+import glob
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+import bson
+
+try:
+    import mongomock
+except ImportError:  # optional: only needed for STORAGE_BACKEND=embedded
+    mongomock = None
+
+logger = logging.getLogger(__name__)
+
+EMBEDDED_DATA_DIR = os.getenv("EMBEDDED_DATA_DIR", "")
+
+class EmbeddedCursor:
+    """A cursor whose results are computed under the database lock"""
+
+    def __init__(self, cursor, lock):
+        self._cursor = cursor
+        self._lock = lock
+
+    def __getattr__(self, name):
+        attribute = getattr(self._cursor, name)
+        if not callable(attribute):
+            return attribute
+
+        def locked(*args, **kwargs):
+            with self._lock:
+                result = attribute(*args, **kwargs)
+            # sort(), limit() and friends return the cursor itself
+            return self if result is self._cursor else _wrap(result, self._lock)
+        return locked
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        # The first call computes every result, later ones read them back
+        with self._lock:
+            return next(self._cursor)
+
+class EmbeddedCollection:
+    """A collection whose operations hold the database lock"""
+
+    def __init__(self, collection, lock):
+        self._collection = collection
+        self._lock = lock
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if not callable(attribute):
+            return attribute
+
+        def locked(*args, **kwargs):
+            with self._lock:
+                return _wrap(attribute(*args, **kwargs), self._lock)
+        return locked
+
+    def with_options(self, *args, **kwargs):
+        # Read preferences and write concerns mean nothing in-process
+        return self
+
+def _wrap(result, lock):
+    if isinstance(result, mongomock.collection.Cursor):
+        return EmbeddedCursor(result, lock)
+    return result
+
+class EmbeddedDatabase:
+    def __init__(self, database):
+        self._database = database
+        self.lock = threading.RLock()
+
+    def __getattr__(self, name):
+        attribute = getattr(self._database, name)
+        if isinstance(attribute, mongomock.Collection):
+            return EmbeddedCollection(attribute, self.lock)
+        return attribute
+
+    def __getitem__(self, name):
+        return EmbeddedCollection(self._database[name], self.lock)
+
+    def get_collection(self, name, *args, **kwargs):
+        return self[name]
+
+    def with_options(self, *args, **kwargs):
+        return self
+
+class EmbeddedClient:
+    def __init__(self, database_name: str, data_dir: str = EMBEDDED_DATA_DIR):
+        if mongomock is None:
+            raise RuntimeError(
+                "STORAGE_BACKEND=embedded needs mongomock: pip install -r requirements-embedded.txt"
+            )
+        self._client = mongomock.MongoClient()
+        self.database = EmbeddedDatabase(self._client.get_database(database_name))
+        self.data_dir = data_dir
+        if data_dir:
+            loaded = load_snapshot(self.database, data_dir)
+            logger.info(f"Embedded database loaded {loaded} documents from {data_dir}")
+
+    def get_database(self):
+        return self.database
+
+    def close(self):
+        if self.data_dir:
+            save_snapshot(self.database, self.data_dir)
+        self._client.close()
+
+def load_snapshot(database: EmbeddedDatabase, data_dir: str) -> int:
+    loaded = 0
+    for path in sorted(glob.glob(os.path.join(data_dir, "*.bson"))):
+        with open(path, "rb") as snapshot:
+            documents = bson.decode_all(snapshot.read())
+        if documents:
+            database[os.path.basename(path)[:-len(".bson")]].insert_many(documents)
+            loaded += len(documents)
+    return loaded
+
+def save_snapshot(database: EmbeddedDatabase, data_dir: str) -> int:
+    """Write every collection to data_dir; returns the number of documents written"""
+    os.makedirs(data_dir, exist_ok=True)
+    # Holding the lock makes the snapshot consistent across collections
+    with database.lock:
+        collections = {name: list(database[name].find()) for name in database.list_collection_names()}
+    for name, documents in collections.items():
+        path = os.path.join(data_dir, f"{name}.bson")
+        with open(f"{path}.tmp", "wb") as snapshot:
+            for document in documents:
+                snapshot.write(bson.encode(document))
+        os.replace(f"{path}.tmp", path)
+    return sum(len(documents) for documents in collections.values())
+
+def expire_documents(database: EmbeddedDatabase) -> int:
+    """Delete documents past their TTL index expiry; returns how many were deleted"""
+    now = datetime.utcnow()
+    expired = 0
+    for name in database.list_collection_names():
+        collection = database[name]
+        for index in collection.index_information().values():
+            if "expireAfterSeconds" in index:
+                field = index["key"][0][0]
+                cutoff = now - timedelta(seconds=index["expireAfterSeconds"])
+                expired += collection.delete_many({field: {"$lt": cutoff}}).deleted_count
+    return expired
+
+def maintain(client: EmbeddedClient):
+    """Periodic job: TTL sweep, then snapshot"""
+    expired = expire_documents(client.database)
+    if expired:
+        logger.info(f"Embedded database expired {expired} documents")
+    if client.data_dir:
+        save_snapshot(client.database, client.data_dir)
@@ -0,0 +1,50 @@
+"""
+Sparse field selection for list endpoints.
+
+GET /api/products/?fields=name,price,stock_quantity returns only those
+fields of each product (plus `id`), and only those fields are read from
+MongoDB: the list becomes a projection, so the documents shrink on the
+wire from the database as well as in the response.
+
+    curl -H "Authorization: Bearer $TOKEN" \\
+        "http://localhost:8000/api/orders/?fields=order_number,status,total_amount"
+
+Field names are the ones of the endpoint's response model; anything else
+is rejected with 400 so typos do not silently come back empty.
+"""
+from typing import List, Optional
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+def parse_fields(fields: Optional[str], model) -> Optional[List[str]]:
+    """Requested field names (always starting with id), or None for full documents"""
+    if not fields:
+        return None
+    names = []
+    for name in fields.split(","):
+        name = name.strip()
+        if name and name not in names:
+            names.append(name)
+    unknown = [name for name in names if name not in model.model_fields]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(unknown)} (available: {', '.join(model.model_fields)})"
+        )
+    if "id" in names:
+        names.remove("id")
+    return ["id"] + names
+
+def projection(names: List[str], *extra: str) -> dict:
+    """MongoDB projection for the requested fields (_id is always included)"""
+    return {name: 1 for name in list(names) + list(extra) if name != "id"}
+
+def select(document: dict, names: List[str]) -> dict:
+    """The requested fields of an already shaped response row"""
+    return {name: document.get(name) for name in names}
+
+def partial_response(rows: List[dict]) -> JSONResponse:
+    # Partial rows do not satisfy the endpoint's response_model, so they
+    # are encoded directly
+    return JSONResponse(jsonable_encoder(rows))
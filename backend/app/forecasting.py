@@ -0,0 +1,152 @@
+"""
+Demand forecasting and days-until-stockout.
+
+Daily unit sales per product come from the product_sales_daily buckets
+(see app/sales_counters.py), pivoted per product by an aggregation, as one
+dense (products x days) NumPy array, and every statistic is computed for
+all products at once:
+
+* moving average over the last `window` days
+* exponentially smoothed demand (weights alpha * (1 - alpha) ** age)
+* days until stockout = stock / forecast demand
+* suggested reorder quantity: enough to cover the supplier lead time plus
+  the review period at forecast demand, plus safety stock for demand
+  variability, minus the stock on hand
+"""
+import math
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING
+from app.database import get_products_collection, get_product_sales_daily_collection
+from app.stock_shards import with_shard_totals
+
+# NumPy is imported where it is used, so importing the app stays fast
+if TYPE_CHECKING:
+    import numpy as np
+
+# z-score for the safety stock service level (95%)
+SERVICE_LEVEL_Z = 1.65
+
+def _today() -> datetime:
+    now = datetime.utcnow()
+    return datetime(now.year, now.month, now.day)
+
+def load_daily_sales(product_index: dict, days: int, today: datetime = None) -> "np.ndarray":
+    """
+    Dense (len(product_index) x days) array of units sold per product and
+    day, oldest day first; the last column is today. Products without
+    sales in the range are rows of zeros.
+    """
+    import numpy as np
+    today = today or _today()
+    start_day = today - timedelta(days=days - 1)
+    # One document per product with its day offsets and units side by side,
+    # so Python touches each product once and NumPy scatters the values
+    pivot = get_product_sales_daily_collection(analytics=True).aggregate([
+        {"$match": {"day": {"$gte": start_day, "$lte": today}}},
+        {"$group": {
+            "_id": "$product_id",
+            "columns": {"$push": {"$divide": [{"$subtract": ["$day", start_day]}, 86_400_000]}},
+            "units": {"$push": "$units"}
+        }}
+    ], allowDiskUse=True)
+    rows, counts, columns, units = [], [], [], []
+    for product in pivot:
+        row = product_index.get(product["_id"])
+        if row is None:
+            continue
+        rows.append(row)
+        counts.append(len(product["columns"]))
+        columns.extend(product["columns"])
+        units.extend(product["units"])
+
+    # float32 keeps 100k products x 365 days at ~150 MB
+    sales = np.zeros((len(product_index), days), dtype=np.float32)
+    if rows:
+        np.add.at(
+            sales,
+            (np.repeat(np.array(rows), counts), np.array(columns, dtype=np.int64)),
+            np.array(units, dtype=np.float32)
+        )
+    return sales
+
+def forecast(
+    sales: "np.ndarray",
+    stock: "np.ndarray",
+    window: int = 28,
+    alpha: float = 0.3,
+    lead_time_days: float = 7,
+    review_days: float = 14
+) -> dict:
+    """Vectorized forecast for every row of `sales` (products x days, oldest first)"""
+    import numpy as np
+    window = max(1, min(window, sales.shape[1]))
+    recent = sales[:, -window:]
+    moving_average = recent.mean(axis=1)
+
+    # Normalized exponential weights, newest day weighted alpha
+    ages = np.arange(sales.shape[1] - 1, -1, -1)
+    weights = alpha * (1 - alpha) ** ages
+    smoothed = sales @ (weights / weights.sum())
+
+    # The smoothed demand drives the forecast; it reacts faster to trends
+    demand = smoothed
+    with np.errstate(divide="ignore", invalid="ignore"):
+        days_until_stockout = np.where(demand > 0, stock / demand, np.inf)
+
+    safety_stock = SERVICE_LEVEL_Z * recent.std(axis=1) * math.sqrt(lead_time_days)
+    reorder_point = demand * lead_time_days + safety_stock
+    order_up_to = demand * (lead_time_days + review_days) + safety_stock
+    reorder_quantity = np.where(stock <= reorder_point, np.ceil(np.maximum(order_up_to - stock, 0)), 0)
+
+    return {
+        "moving_average": moving_average,
+        "smoothed_demand": smoothed,
+        "days_until_stockout": np.maximum(days_until_stockout, 0),
+        "reorder_point": reorder_point,
+        "reorder_quantity": reorder_quantity.astype(np.int64)
+    }
+
+def stockout_report(
+    days: int = 90,
+    window: int = 28,
+    alpha: float = 0.3,
+    lead_time_days: float = 7,
+    review_days: float = 14,
+    limit: int = 100
+) -> dict:
+    """Forecast every product and return the ones closest to running out"""
+    import numpy as np
+    products = with_shard_totals(list(get_products_collection(analytics=True).find(
+        {}, {"name": 1, "sku": 1, "stock_quantity": 1, "stock_shards": 1}
+    )))
+    product_index = {str(product["_id"]): row for row, product in enumerate(products)}
+    stock = np.array([product.get("stock_quantity", 0) for product in products], dtype=np.float64)
+
+    sales = load_daily_sales(product_index, days)
+    result = forecast(sales, stock, window, alpha, lead_time_days, review_days)
+
+    # Products that need reordering first, soonest stockout first
+    order = np.lexsort((result["days_until_stockout"], result["reorder_quantity"] == 0))[:limit]
+    forecasts = []
+    for row in order:
+        product = products[row]
+        stockout = result["days_until_stockout"][row]
+        forecasts.append({
+            "product_id": str(product["_id"]),
+            "name": product.get("name", ""),
+            "sku": product.get("sku", ""),
+            "stock_quantity": int(stock[row]),
+            "moving_average": round(float(result["moving_average"][row]), 3),
+            "smoothed_demand": round(float(result["smoothed_demand"][row]), 3),
+            "days_until_stockout": None if np.isinf(stockout) else round(float(stockout), 1),
+            "reorder_point": round(float(result["reorder_point"][row]), 1),
+            "reorder_quantity": int(result["reorder_quantity"][row])
+        })
+
+    return {
+        "generated_at": datetime.utcnow(),
+        "history_days": days,
+        "total_products": len(products),
+        "products_to_reorder": int(np.count_nonzero(result["reorder_quantity"])),
+        "forecasts": forecasts
+    }
@@ -0,0 +1,102 @@
+"""
+Liveness and readiness state.
+
+/livez does no I/O at all. /readyz serves the result of the last dependency
+check, which a background task refreshes every READINESS_REFRESH_SECONDS, so
+probes never hit MongoDB themselves.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from starlette.concurrency import run_in_threadpool
+from app.database import get_database
+
+logger = logging.getLogger(__name__)
+
+READINESS_REFRESH_SECONDS = float(os.getenv("READINESS_REFRESH_SECONDS", 5))
+STARTUP_RETRY_SECONDS = float(os.getenv("STARTUP_RETRY_SECONDS", 2))
+
+STARTUP_STATE_ID = "startup"
+
+class HealthState:
+    process_started = time.perf_counter()  # main.py resets this to its first line
+    serving_after = None      # seconds from import to accepting requests
+    ready_after = None        # seconds from import to first successful readiness
+    startup_complete = False
+    database_ok = False
+    last_checked = None
+    error = None
+
+def mark_serving():
+    HealthState.serving_after = time.perf_counter() - HealthState.process_started
+    logger.info(f"Accepting requests {HealthState.serving_after * 1000:.0f} ms after import")
+
+def check_dependencies():
+    """Ping MongoDB and cache the outcome (runs in a worker thread)"""
+    try:
+        get_database().command("ping")
+        HealthState.database_ok = True
+        HealthState.error = None
+    except Exception as e:
+        HealthState.database_ok = False
+        HealthState.error = str(e)
+    HealthState.last_checked = datetime.utcnow()
+    if is_ready() and HealthState.ready_after is None:
+        HealthState.ready_after = time.perf_counter() - HealthState.process_started
+        logger.info(f"Ready {HealthState.ready_after * 1000:.0f} ms after import")
+
+def _startup_state():
+    return get_database().app_state
+
+def record_startup_complete():
+    """Tell the other workers (and later restarts) the database has been initialized"""
+    _startup_state().update_one(
+        {"_id": STARTUP_STATE_ID}, {"$set": {"completed_at": datetime.utcnow()}}, upsert=True
+    )
+
+def startup_recorded() -> bool:
+    return _startup_state().find_one({"_id": STARTUP_STATE_ID}) is not None
+
+async def run_startup_tasks_in_background(func):
+    """Run the one-time startup tasks without delaying the server, retrying until they succeed"""
+    while True:
+        try:
+            await run_in_threadpool(func)
+            await run_in_threadpool(record_startup_complete)
+            HealthState.startup_complete = True
+            await run_in_threadpool(check_dependencies)
+            return
+        except Exception as e:
+            logger.error(f"Startup tasks failed, retrying in {STARTUP_RETRY_SECONDS}s: {e}")
+            await asyncio.sleep(STARTUP_RETRY_SECONDS)
+
+async def wait_for_leader_startup():
+    """
+    Workers that are not the job leader skip the startup tasks and report
+    ready once the leader (of this or an earlier run) has recorded them done
+    """
+    while True:
+        try:
+            if await run_in_threadpool(startup_recorded):
+                HealthState.startup_complete = True
+                await run_in_threadpool(check_dependencies)
+                return
+        except Exception as e:
+            logger.warning(f"Startup state unavailable, retrying in {STARTUP_RETRY_SECONDS}s: {e}")
+        await asyncio.sleep(STARTUP_RETRY_SECONDS)
+
+def is_ready() -> bool:
+    return HealthState.startup_complete and HealthState.database_ok
+
+def readiness_report() -> dict:
+    return {
+        "status": "ready" if is_ready() else "not_ready",
+        "startup_complete": HealthState.startup_complete,
+        "database": "connected" if HealthState.database_ok else "unavailable",
+        "last_checked": HealthState.last_checked.isoformat() if HealthState.last_checked else None,
+        "error": HealthState.error,
+        "serving_after_ms": round(HealthState.serving_after * 1000, 1) if HealthState.serving_after else None,
+        "ready_after_ms": round(HealthState.ready_after * 1000, 1) if HealthState.ready_after else None,
+    }
@@ -0,0 +1,178 @@
+"""
+Idempotency-Key support for order creation.
+
+A client that may retry POST /orders/ sends an `Idempotency-Key` header
+(unique per logical order, e.g. a UUID). The first request with a key
+claims it in the `idempotency_keys` collection, does the work and stores
+its response; the record expires after IDEMPOTENCY_TTL_HOURS (TTL index).
+
+* a retry after completion replays the stored response (status and body)
+  with an `Idempotent-Replayed: true` header, without touching products,
+  stock or email, and without passing through admission control
+* a duplicate arriving while the first is still running waits up to
+  IDEMPOTENCY_WAIT_SECONDS for it to finish, then gets 409 + Retry-After
+* reusing a key with a different request body is rejected with 422
+* a request that fails before the order is placed releases its key so it
+  can be retried; once the order exists the key is kept, and storing the
+  response is retried (IDEMPOTENCY_COMPLETE_ATTEMPTS)
+
+Keys are scoped per user. A claim left behind by a crashed worker can be
+taken over after IDEMPOTENCY_LOCK_SECONDS.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from starlette.concurrency import run_in_threadpool
+from app.auth import get_current_active_user
+from app.database import get_idempotency_keys_collection
+from app.models import User
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", 24))
+IDEMPOTENCY_LOCK_SECONDS = float(os.getenv("IDEMPOTENCY_LOCK_SECONDS", 60))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", 10))
+IDEMPOTENCY_COMPLETE_ATTEMPTS = int(os.getenv("IDEMPOTENCY_COMPLETE_ATTEMPTS", 3))
+POLL_INTERVAL_SECONDS = 0.1
+MAX_KEY_LENGTH = 255
+
+class IdempotentReplay(Exception):
+    """Raised to answer a request with the stored response of an earlier one"""
+
+    def __init__(self, status_code: int, body):
+        self.status_code = status_code
+        self.body = body
+
+async def idempotent_replay_handler(request: Request, exc: IdempotentReplay):
+    return JSONResponse(exc.body, status_code=exc.status_code, headers={"Idempotent-Replayed": "true"})
+
+def _request_hash(body: bytes) -> str:
+    # Key order and whitespace do not make a different request
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True, separators=(",", ":")).encode()
+    except ValueError:
+        pass
+    return hashlib.sha256(body).hexdigest()
+
+def _claim_or_get(record_id: str, request_hash: str):
+    """Claim the key (returns None) or return the record of the request that holds it"""
+    collection = get_idempotency_keys_collection()
+    while True:
+        now = datetime.utcnow()
+        try:
+            collection.insert_one({
+                "_id": record_id,
+                "request_hash": request_hash,
+                "status": "in_progress",
+                "locked_until": now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS),
+                "created_at": now,
+                "expires_at": now + timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+            })
+            return None
+        except DuplicateKeyError:
+            pass
+        # Take over a claim abandoned by a request that never finished
+        taken = collection.find_one_and_update(
+            {"_id": record_id, "request_hash": request_hash, "status": "in_progress", "locked_until": {"$lt": now}},
+            {"$set": {"locked_until": now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)}},
+            return_document=ReturnDocument.AFTER
+        )
+        if taken:
+            return None
+        record = collection.find_one({"_id": record_id})
+        if record:
+            return record
+        # Released or expired in the meantime: try to claim it again
+
+class IdempotentRequest:
+    """The claim on an idempotency key held by the request doing the work"""
+
+    def __init__(self, record_id: str):
+        self.record_id = record_id
+        self.completed = False
+
+    def complete(self, response, status_code: int = 200):
+        """
+        Store the response that retries with this key will get. Called once
+        the work is committed, so from here on the key is never released:
+        a failed write is retried, and if it still fails the claim stays
+        in progress rather than letting a retry place the order again.
+        """
+        self.completed = True
+        for attempt in range(1, IDEMPOTENCY_COMPLETE_ATTEMPTS + 1):
+            try:
+                get_idempotency_keys_collection().update_one(
+                    {"_id": self.record_id, "status": "in_progress"},
+                    {"$set": {
+                        "status": "completed",
+                        "response_status": status_code,
+                        "response_body": jsonable_encoder(response),
+                        "completed_at": datetime.utcnow(),
+                        "expires_at": datetime.utcnow() + timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+                    }}
+                )
+                return
+            except PyMongoError as e:
+                if attempt == IDEMPOTENCY_COMPLETE_ATTEMPTS:
+                    logger.error(f"Could not store the response for idempotency key {self.record_id}: {e}")
+                    return
+                time.sleep(POLL_INTERVAL_SECONDS * attempt)
+
+    def release(self):
+        get_idempotency_keys_collection().delete_one({"_id": self.record_id, "status": "in_progress"})
+
+async def order_idempotency(request: Request, current_user: User = Depends(get_current_active_user)):
+    """
+    Dependency: yields None without an Idempotency-Key header, otherwise the
+    claimed IdempotentRequest. Replays and conflicts are answered before the
+    endpoint (and admission control) runs.
+    """
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if not key:
+        yield None
+        return
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters"
+        )
+
+    record_id = f"{current_user.username}:{key}"
+    request_hash = _request_hash(await request.body())
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        record = await run_in_threadpool(_claim_or_get, record_id, request_hash)
+        if record is None:
+            break
+        if record["request_hash"] != request_hash:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=f"{IDEMPOTENCY_HEADER} was already used for a different request"
+            )
+        if record["status"] == "completed":
+            raise IdempotentReplay(record["response_status"], record["response_body"])
+        if time.monotonic() >= deadline:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="A request with this Idempotency-Key is still being processed",
+                headers={"Retry-After": "1"}
+            )
+        await asyncio.sleep(POLL_INTERVAL_SECONDS)
+
+    idempotent_request = IdempotentRequest(record_id)
+    try:
+        yield idempotent_request
+    finally:
+        # Requests that failed before committing anything let the client retry
+        if not idempotent_request.completed:
+            await run_in_threadpool(idempotent_request.release)
@@ -0,0 +1,371 @@
+"""
+Memory-mapped columnar store of order line items.
+
+One row per order line item (live and archived orders), kept on local disk
+as flat little-endian column files:
+
+    created_at  int64    order creation time, epoch seconds (UTC)
+    product     int32    index into products.json (product id strings)
+    quantity    int32
+    price       float64  unit price
+    status      int8     order status code, see STATUS_CODES
+
+plus a per-order table (order_ids, order_start, order_count) used to find
+an order's rows when its status changes.
+
+The store is written by a single process (the job leader, or the CLI) and
+read by every worker through np.memmap, so all processes on the host share
+the same page cache. Writes only append rows and overwrite status bytes in
+place; meta.json, replaced atomically after each write, tells readers how
+many rows are valid. A full rebuild writes a new generation directory and
+then switches meta.json to it; the previous generation is only removed by
+the rebuild after that, so a reader that has just read the old meta.json
+can still map it.
+
+Incremental refresh picks up orders inserted or updated since the last
+watermark (by updated_at), and deleted orders from the order tombstones of
+the change feed (app/change_feed.py): their rows are marked DELETED_STATUS,
+which every query skips. A full rebuild drops them for good; it runs every
+LINE_ITEM_STORE_REBUILD_HOURS, or when the watermark is older than the
+tombstones are kept.
+
+    python -m app.line_item_store rebuild
+    python -m app.line_item_store refresh
+"""
+import argparse
+import calendar
+import json
+import logging
+import os
+import shutil
+from datetime import datetime, timedelta
+from bson import ObjectId
+from app.database import get_orders_collection, get_tombstones_collection
+from app.archive import iter_orders_all_tiers
+from app.change_feed import ORDER, TOMBSTONE_TTL_DAYS
+
+logger = logging.getLogger(__name__)
+
+STORE_DIR = os.getenv("LINE_ITEM_STORE_DIR", os.path.join("data", "line_items"))
+REFRESH_SECONDS = float(os.getenv("LINE_ITEM_STORE_REFRESH_SECONDS", 60))
+REBUILD_HOURS = float(os.getenv("LINE_ITEM_STORE_REBUILD_HOURS", 24))
+# Orders updated within this many seconds are left for the next refresh, so
+# writes still in flight when the refresh starts are not skipped
+REFRESH_LAG_SECONDS = 5
+META_FILE = "meta.json"
+PRODUCTS_FILE = "products.json"
+
+STATUS_CODES = {"pending": 0, "confirmed": 1, "shipped": 2, "delivered": 3, "cancelled": 4}
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+UNKNOWN_STATUS = -1
+DELETED_STATUS = -2
+
+ROW_COLUMNS = {
+    "created_at": "<i8",
+    "product": "<i4",
+    "quantity": "<i4",
+    "price": "<f8",
+    "status": "i1",
+}
+ORDER_COLUMNS = {
+    "order_ids": "S12",
+    "order_start": "<i8",
+    "order_count": "<i4",
+}
+
+def _epoch(moment: datetime) -> int:
+    return calendar.timegm(moment.utctimetuple())
+
+def _read_meta(directory: str):
+    try:
+        with open(os.path.join(directory, META_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def _write_json(path: str, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def _column_path(directory: str, generation: int, column: str) -> str:
+    return os.path.join(directory, f"gen-{generation}", f"{column}.bin")
+
+def _remove_generations(directory: str, keep: set):
+    for name in os.listdir(directory):
+        if name.startswith("gen-") and name[len("gen-"):].isdigit() and int(name[len("gen-"):]) not in keep:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+def _load_products(directory: str, generation: int) -> list:
+    try:
+        with open(os.path.join(directory, f"gen-{generation}", PRODUCTS_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+class _Batch:
+    """Rows and orders collected in memory before they are appended"""
+
+    def __init__(self, products: list):
+        self.products = products
+        self.product_index = {product_id: index for index, product_id in enumerate(products)}
+        self.rows = {column: [] for column in ROW_COLUMNS}
+        self.orders = {column: [] for column in ORDER_COLUMNS}
+
+    def add(self, order: dict, first_row: int):
+        start = first_row + len(self.rows["created_at"])
+        created_at = _epoch(order["created_at"])
+        status = STATUS_CODES.get(order.get("status"), UNKNOWN_STATUS)
+        for item in order["items"]:
+            index = self.product_index.get(item["product_id"])
+            if index is None:
+                index = len(self.products)
+                self.products.append(item["product_id"])
+                self.product_index[item["product_id"]] = index
+            self.rows["created_at"].append(created_at)
+            self.rows["product"].append(index)
+            self.rows["quantity"].append(item["quantity"])
+            self.rows["price"].append(item["price"])
+            self.rows["status"].append(status)
+        self.orders["order_ids"].append(order["_id"].binary)
+        self.orders["order_start"].append(start)
+        self.orders["order_count"].append(len(order["items"]))
+
+    def append_to(self, directory: str, generation: int):
+        import numpy as np
+        for columns in (self.rows, self.orders):
+            for column, values in columns.items():
+                dtype = ROW_COLUMNS.get(column, ORDER_COLUMNS.get(column))
+                with open(_column_path(directory, generation, column), "ab") as f:
+                    f.write(np.asarray(values, dtype=dtype).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+        _write_json(os.path.join(directory, f"gen-{generation}", PRODUCTS_FILE), self.products)
+
+def rebuild(directory: str = STORE_DIR, now: datetime = None) -> dict:
+    """Write a fresh generation from all live and archived orders, then switch to it"""
+    until = (now or datetime.utcnow()) - timedelta(seconds=REFRESH_LAG_SECONDS)
+    meta = _read_meta(directory)
+    generation = meta["generation"] + 1 if meta else 1
+    generation_dir = os.path.join(directory, f"gen-{generation}")
+    shutil.rmtree(generation_dir, ignore_errors=True)
+    os.makedirs(generation_dir)
+    for column in list(ROW_COLUMNS) + list(ORDER_COLUMNS):
+        open(_column_path(directory, generation, column), "wb").close()
+
+    batch = _Batch([])
+    rows = orders = 0
+    projection = {"items.product_id": 1, "items.quantity": 1, "items.price": 1, "created_at": 1, "status": 1}
+    for order in iter_orders_all_tiers({"updated_at": {"$lte": until}}, projection):
+        batch.add(order, rows)
+        if len(batch.rows["created_at"]) >= 100_000:
+            batch.append_to(directory, generation)
+            rows += len(batch.rows["created_at"])
+            orders += len(batch.orders["order_ids"])
+            batch = _Batch(batch.products)
+    batch.append_to(directory, generation)
+    rows += len(batch.rows["created_at"])
+    orders += len(batch.orders["order_ids"])
+
+    new_meta = {
+        "generation": generation,
+        "rows": rows,
+        "orders": orders,
+        "products": len(batch.products),
+        "watermark": until.isoformat(),
+        "built_at": datetime.utcnow().isoformat()
+    }
+    _write_json(os.path.join(directory, META_FILE), new_meta)
+    # The generation just replaced stays until the next rebuild, for readers
+    # that read meta.json before the switch and have not mapped it yet
+    _remove_generations(directory, {generation, meta["generation"]} if meta else {generation})
+    logger.info(f"Line item store rebuilt: {rows} rows from {orders} orders (generation {generation})")
+    return new_meta
+
+def refresh(directory: str = STORE_DIR, now: datetime = None) -> dict:
+    """Append new orders and update the status of changed and deleted ones since the last watermark"""
+    import numpy as np
+    now = now or datetime.utcnow()
+    meta = _read_meta(directory)
+    if (
+        meta is None
+        or now - datetime.fromisoformat(meta["built_at"]) > timedelta(hours=REBUILD_HOURS)
+        # Deletions older than the tombstones can no longer be replayed
+        or now - datetime.fromisoformat(meta["watermark"]) > timedelta(days=TOMBSTONE_TTL_DAYS)
+    ):
+        return rebuild(directory, now)
+
+    since = datetime.fromisoformat(meta["watermark"])
+    until = now - timedelta(seconds=REFRESH_LAG_SECONDS)
+    if until <= since:
+        return meta
+    generation = meta["generation"]
+    changed = list(get_orders_collection().find(
+        {"updated_at": {"$gt": since, "$lte": until}},
+        {"items.product_id": 1, "items.quantity": 1, "items.price": 1, "created_at": 1, "status": 1}
+    ))
+    # Archived orders stay in the store (it covers both tiers); only deletions count
+    deleted = [
+        ObjectId(tombstone["doc_id"]).binary
+        for tombstone in get_tombstones_collection().find(
+            {"kind": ORDER, "deleted_at": {"$gt": since, "$lte": until}, "reason": "deleted"},
+            {"doc_id": 1}
+        )
+    ]
+
+    known = {}
+    if (changed or deleted) and meta["orders"]:
+        order_ids = np.memmap(_column_path(directory, generation, "order_ids"), dtype="S12", mode="r", shape=(meta["orders"],))
+        lookup_ids = np.array([order["_id"].binary for order in changed] + deleted, dtype="S12")
+        positions = np.nonzero(np.isin(order_ids, lookup_ids))[0]
+        # NumPy "S" values drop trailing NUL bytes, so keys are compared stripped
+        known = {bytes(order_ids[position]): int(position) for position in positions}
+
+    batch = _Batch(_load_products(directory, generation))
+    updates = []
+    for order in changed:
+        position = known.get(order["_id"].binary.rstrip(b"\x00"))
+        if position is None:
+            batch.add(order, meta["rows"])
+        else:
+            updates.append((position, STATUS_CODES.get(order.get("status"), UNKNOWN_STATUS)))
+    for order_id in deleted:
+        position = known.get(order_id.rstrip(b"\x00"))
+        if position is not None:
+            updates.append((position, DELETED_STATUS))
+
+    if updates and meta["rows"]:
+        # Status bytes are rewritten in place; readers see them through the shared mapping
+        starts = np.memmap(_column_path(directory, generation, "order_start"), dtype="<i8", mode="r", shape=(meta["orders"],))
+        counts = np.memmap(_column_path(directory, generation, "order_count"), dtype="<i4", mode="r", shape=(meta["orders"],))
+        status = np.memmap(_column_path(directory, generation, "status"), dtype="i1", mode="r+", shape=(meta["rows"],))
+        for position, code in updates:
+            status[starts[position]:starts[position] + counts[position]] = code
+        status.flush()
+        del status
+
+    batch.append_to(directory, generation)
+    meta = {
+        **meta,
+        "rows": meta["rows"] + len(batch.rows["created_at"]),
+        "orders": meta["orders"] + len(batch.orders["order_ids"]),
+        "products": len(batch.products),
+        "watermark": until.isoformat()
+    }
+    _write_json(os.path.join(directory, META_FILE), meta)
+    return meta
+
+class LineItemStore:
+    """Read-only view of the store, remapped when the writer publishes new rows"""
+
+    def __init__(self, directory: str = STORE_DIR):
+        self.directory = directory
+        self.meta = None
+        self.meta_mtime = None
+        self.columns = {}
+        self.products = []
+
+    def load(self):
+        """Current columns as read-only arrays (empty if the store has not been built)"""
+        import numpy as np
+        meta_path = os.path.join(self.directory, META_FILE)
+        try:
+            mtime = os.stat(meta_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if mtime == self.meta_mtime:
+            return self
+        for attempt in range(3):
+            meta = _read_meta(self.directory)
+            generation = meta["generation"]
+            try:
+                columns = {
+                    column: (
+                        np.memmap(_column_path(self.directory, generation, column), dtype=dtype, mode="r", shape=(meta["rows"],))
+                        if meta["rows"] else np.empty(0, dtype=dtype)
+                    )
+                    for column, dtype in ROW_COLUMNS.items()
+                }
+                break
+            except FileNotFoundError:
+                # Rebuilt twice since meta.json was read; read it again
+                if attempt == 2:
+                    raise
+        if not self.meta or self.meta["generation"] != generation or self.meta["products"] != meta["products"]:
+            self.products = _load_products(self.directory, generation)
+        self.columns = columns
+        self.meta = meta
+        self.meta_mtime = mtime
+        return self
+
+_store = LineItemStore()
+
+def get_store():
+    return _store.load()
+
+def revenue_breakdown(group_by: str = "product", start: datetime = None, end: datetime = None,
+                      include_cancelled: bool = False, limit: int = None) -> list:
+    """
+    Units and revenue grouped by product, month or status, computed with
+    vectorized filters over the mapped columns. Returns None when the store
+    has not been built yet.
+    """
+    import numpy as np
+    store = get_store()
+    if store is None:
+        return None
+    columns = store.columns
+    mask = columns["status"] != DELETED_STATUS
+    if start is not None:
+        mask &= columns["created_at"] >= _epoch(start)
+    if end is not None:
+        mask &= columns["created_at"] < _epoch(end)
+    if not include_cancelled:
+        mask &= columns["status"] != STATUS_CODES["cancelled"]
+
+    quantity = columns["quantity"][mask]
+    revenue = quantity * columns["price"][mask]
+    if group_by == "product":
+        keys = columns["product"][mask]
+        size = len(store.products)
+        labels = store.products
+    elif group_by == "status":
+        # Codes shifted by one so UNKNOWN_STATUS lands in bucket 0
+        keys = columns["status"][mask].astype(np.int64) + 1
+        size = len(STATUS_CODES) + 1
+        labels = ["unknown"] + [STATUS_NAMES[code] for code in range(len(STATUS_CODES))]
+    elif group_by == "month":
+        months = columns["created_at"][mask].astype("datetime64[s]").astype("datetime64[M]")
+        month_values, keys = np.unique(months, return_inverse=True)
+        size = len(month_values)
+        labels = [str(month) for month in month_values]
+    else:
+        raise ValueError(f"Unknown group_by: {group_by}")
+
+    units_by_key = np.bincount(keys, weights=quantity, minlength=size)
+    revenue_by_key = np.bincount(keys, weights=revenue, minlength=size)
+    present = np.nonzero(units_by_key)[0]
+    if group_by == "product":
+        present = present[np.argsort(-revenue_by_key[present], kind="stable")]
+    if limit:
+        present = present[:limit]
+    return [
+        {"key": labels[key], "units": int(units_by_key[key]), "revenue": round(float(revenue_by_key[key]), 2)}
+        for key in present
+    ]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Columnar line item store maintenance")
+    parser.add_argument("command", choices=["rebuild", "refresh"])
+    parser.add_argument("--dir", default=STORE_DIR)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    meta = rebuild(args.dir) if args.command == "rebuild" else refresh(args.dir)
+    print(json.dumps(meta, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -1,62 +1,132 @@
-from fastapi import FastAPI, HTTPException
+import time
+IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 import os
 import logging
 from contextlib import asynccontextmanager
-from sqlalchemy.orm import Session
 from pathlib import Path
 
-from app.database import get_database, close_database
+from app.database import get_database, close_database, ensure_indexes, maintain_embedded_storage, STORAGE_BACKEND, EMBEDDED_SNAPSHOT_SECONDS
 from app.auth import create_admin_user
-from app.routers import auth, products, orders, reports, users
+from app.archive import archive_orders, ARCHIVE_INTERVAL_MINUTES
+from app.line_item_store import refresh as refresh_line_item_store, REFRESH_SECONDS as LINE_ITEM_REFRESH_SECONDS
+from app.sales_counters import expire_windows, initialize as initialize_sales_counters
+from app.customers import initialize as initialize_customers
+from app.stock_ledger import compact as compact_stock_ledger, create_opening_snapshots, SNAPSHOT_INTERVAL_MINUTES
+from app.stock_shards import rebalance_all as rebalance_stock_shards, STOCK_SHARD_REBALANCE_MINUTES
+from app.idempotency import IdempotentReplay, idempotent_replay_handler
+from app.scheduler import is_job_leader, start_periodic, start_task, stop_all
+from app.health import (
+    HealthState, READINESS_REFRESH_SECONDS, check_dependencies, is_ready, mark_serving,
+    readiness_report, run_startup_tasks_in_background, wait_for_leader_startup
+)
+from app.middleware import APIGZipMiddleware
+from app.structured_logging import configure_logging, RequestContextMiddleware
+from app.profiling import ProfilingMiddleware, PROFILING_ENABLED
+from app.metrics import render_prometheus
+from app.static_assets import PrecompressedStaticFiles, MANIFEST_NAME
+from app.routers import auth, products, orders, reports, users, profiles, customers
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+HealthState.process_started = IMPORT_STARTED
+
+# JSON logs written by a background thread (see app/structured_logging.py)
+configure_logging()
 logger = logging.getLogger(__name__)
 
+def print_banner():
+    """Display startup information"""
+    # One log record, so the banner is not interleaved with the log writer's output
+    logger.info("\n".join([
+        "",
+        "=" * 70,
+        "🚀 INVENTORY & ORDER MANAGEMENT SYSTEM",
+        "   Complete Business Operations Platform",
+        "=" * 70,
+        "📊 MAIN DASHBOARD URL:",
+        "   👉 http://localhost:8000",
+        "",
+        "📚 ADDITIONAL URLs:",
+        "   📋 API Documentation: http://localhost:8000/docs",
+        "   🔍 Health Check:      http://localhost:8000/health",
+        "   🔐 Login Page:        http://localhost:8000/login",
+        "",
+        "🔐 LOGIN CREDENTIALS:",
+        "   Username: admin",
+        "   Password: admin123",
+        "",
+        "✨ FEATURES INCLUDED:",
+        "   • Professional Dashboard with Real-time Analytics",
+        "   • Advanced Product Management with Images",
+        "   • Multi-item Order Processing",
+        "   • Business Reports with Charts & Graphs",
+        "   • User Management with Role-based Access",
+        "   • Email Notifications & Low Stock Alerts",
+        "",
+        "🎯 OPEN YOUR BROWSER AND GO TO:",
+        "   http://localhost:8000",
+        "=" * 70,
+        ""
+    ]))
+
+def run_startup_tasks():
+    """One-time setup: indexes, the default admin user, stock ledger, sales counter and customer initialization and the banner"""
+    ensure_indexes()
+    logger.info("Database indexes ensured")
+    
+    create_admin_user()
+    logger.info("Admin user initialized")
+    
+    openings = create_opening_snapshots()
+    if openings:
+        logger.info(f"Stock ledger opening snapshots created for {openings} products")
+    
+    counted = initialize_sales_counters()
+    if counted:
+        logger.info(f"Sales counters built from {counted} existing orders")
+    
+    customers = initialize_customers()
+    if customers:
+        logger.info(f"Customer aggregates built for {customers} customers")
+    
+    print_banner()
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     try:
-        # Initialize database connection
+        # Create the database client (connects in the background, no I/O here)
         get_database()
-        logger.info("Connected to MongoDB")
         
-        # Create admin user
-        create_admin_user()
-        logger.info("Admin user initialized")
+        # One-time setup runs in the background of the job leader only, so no
+        # worker waits for MongoDB to start; /readyz reports not ready until
+        # the leader has finished it
+        if is_job_leader():
+            start_task("startup", run_startup_tasks_in_background(run_startup_tasks))
+        else:
+            start_task("startup", wait_for_leader_startup())
         
-        # Display startup information
-        print("\n" + "="*70)
-        print("🚀 INVENTORY & ORDER MANAGEMENT SYSTEM")
-        print("   Complete Business Operations Platform")
-        print("="*70)
-        print("📊 MAIN DASHBOARD URL:")
-        print("   👉 http://localhost:8000")
-        print("")
-        print("📚 ADDITIONAL URLs:")
-        print("   📋 API Documentation: http://localhost:8000/docs")
-        print("   🔍 Health Check:      http://localhost:8000/health")
-        print("   🔐 Login Page:        http://localhost:8000/login")
-        print("")
-        print("🔐 LOGIN CREDENTIALS:")
-        print("   Username: admin")
-        print("   Password: admin123")
-        print("")
-        print("✨ FEATURES INCLUDED:")
-        print("   • Professional Dashboard with Real-time Analytics")
-        print("   • Advanced Product Management with Images")
-        print("   • Multi-item Order Processing")
-        print("   • Business Reports with Charts & Graphs")
-        print("   • User Management with Role-based Access")
-        print("   • Email Notifications & Low Stock Alerts")
-        print("")
-        print("🎯 OPEN YOUR BROWSER AND GO TO:")
-        print("   http://localhost:8000")
-        print("="*70)
-        print("")
+        # Cached dependency check behind /readyz (every worker)
+        start_periodic(
+            "readiness", READINESS_REFRESH_SECONDS, check_dependencies,
+            leader_only=False, run_immediately=True
+        )
+        
+        # Background jobs (only one worker per host runs them)
+        start_periodic("archive_orders", ARCHIVE_INTERVAL_MINUTES * 60, archive_orders)
+        start_periodic("compact_stock_ledger", SNAPSHOT_INTERVAL_MINUTES * 60, compact_stock_ledger)
+        start_periodic("rebalance_stock_shards", STOCK_SHARD_REBALANCE_MINUTES * 60, rebalance_stock_shards)
+        # Cheap no-op until the UTC day rolls over
+        start_periodic("expire_sales_windows", 15 * 60, expire_windows, run_immediately=True)
+        # First run one interval after startup: building the store scans every order
+        start_periodic("refresh_line_item_store", LINE_ITEM_REFRESH_SECONDS, refresh_line_item_store)
+        if STORAGE_BACKEND == "embedded":
+            start_periodic("embedded_storage", EMBEDDED_SNAPSHOT_SECONDS, maintain_embedded_storage)
+        
+        mark_serving()
         
     except Exception as e:
         logger.error(f"Failed to initialize application: {e}")
@@ -65,6 +135,7 @@ async def lifespan(app: FastAPI):
     yield
     
     # Shutdown
+    await stop_all()
     close_database()
     logger.info("Database connection closed")
 
@@ -75,6 +146,10 @@ from pathlib import Path
 current_dir = Path(__file__).parent
 frontend_dir = current_dir.parent.parent / "frontend"
 
+# Serve the fingerprinted/precompressed build when it exists
+# (python -m app.static_assets), otherwise the plain sources
+static_dir = frontend_dir / "dist" if (frontend_dir / "dist" / MANIFEST_NAME).exists() else frontend_dir
+
 app = FastAPI(
     title="Inventory & Order Management System",
     description="A complete inventory and order management system with JWT authentication",
@@ -82,6 +157,9 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Retried order requests answered from their stored outcome (Idempotency-Key)
+app.add_exception_handler(IdempotentReplay, idempotent_replay_handler)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -91,48 +169,76 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Mount static files (Frontend)
-app.mount("/static", StaticFiles(directory=str(frontend_dir)), name="static")
+# Compress larger API JSON responses for clients that accept gzip
+app.add_middleware(APIGZipMiddleware)
+
+# Admin-triggered request profiling; not installed at all unless enabled
+if PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+
+# Outermost: request id for every log record of the request, access log
+app.add_middleware(RequestContextMiddleware)
 
-# Mount uploads directory for product images
+# Mount uploads directory for product images (before /static, which would
+# otherwise match these paths first)
 uploads_dir = Path("uploads")
 uploads_dir.mkdir(exist_ok=True)
 app.mount("/static/uploads", StaticFiles(directory="uploads"), name="uploads")
 
+# Mount static files (Frontend)
+static_files = PrecompressedStaticFiles(directory=str(static_dir))
+app.mount("/static", static_files, name="static")
+
 # Include routers
 app.include_router(auth.router, prefix="/api")
 app.include_router(products.router, prefix="/api")
 app.include_router(orders.router, prefix="/api")
 app.include_router(reports.router, prefix="/api")
 app.include_router(users.router, prefix="/api")
+app.include_router(profiles.router, prefix="/api")
+app.include_router(customers.router, prefix="/api")
 
 # Serve frontend at root - redirect to dashboard
 @app.get("/")
-async def serve_frontend():
-    return FileResponse(str(frontend_dir / "dashboard.html"))
+async def serve_frontend(request: Request):
+    return static_files.negotiated_response(str(static_dir / "dashboard.html"), request.scope)
 
 @app.get("/login")
-async def serve_login():
-    return FileResponse(str(frontend_dir / "login.html"))
+async def serve_login(request: Request):
+    return static_files.negotiated_response(str(static_dir / "login.html"), request.scope)
 
 @app.get("/dashboard")
-async def serve_dashboard():
-    return FileResponse(str(frontend_dir / "dashboard.html"))
+async def serve_dashboard(request: Request):
+    return static_files.negotiated_response(str(static_dir / "dashboard.html"), request.scope)
+
+# Liveness probe: the process is up and the event loop responds (no I/O)
+@app.get("/livez")
+async def liveness_check():
+    return {"status": "alive"}
 
-# Health check endpoint
+# Readiness probe: served from the cached background dependency check
+@app.get("/readyz")
+async def readiness_check():
+    return JSONResponse(status_code=200 if is_ready() else 503, content=readiness_report())
+
+# Health check endpoint (kept for existing clients, also served from the cache)
 @app.get("/health")
 async def health_check():
-    try:
-        # Test database connection
-        db = get_database()
-        db.command("ping")
-        return {
-            "status": "healthy",
-            "database": "connected",
-            "message": "Inventory Management System is running"
-        }
-    except Exception as e:
-        raise HTTPException(status_code=503, detail=f"Service unavailable: {str(e)}")
+    if not is_ready():
+        raise HTTPException(
+            status_code=503,
+            detail=f"Service unavailable: {HealthState.error or 'starting up'}"
+        )
+    return {
+        "status": "healthy",
+        "database": "connected",
+        "message": "Inventory Management System is running"
+    }
+
+# Metrics endpoint (Prometheus text format, per worker process)
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(render_prometheus())
 
 # API info endpoint
 @app.get("/api")
@@ -142,10 +248,13 @@ async def api_info():
         "version": "1.0.0",
         "docs": "/docs",
         "health": "/health",
+        "liveness": "/livez",
+        "readiness": "/readyz",
+        "metrics": "/metrics",
         "frontend": "/",
         "dashboard": "/dashboard"
     }
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    from app.server import main
+    main()
\ No newline at end of file
@@ -0,0 +1,49 @@
+"""
+In-process metrics registry.
+
+Counters and gauges are kept per worker process and exposed in the
+Prometheus text format on /metrics.
+"""
+import threading
+
+class Metrics:
+    lock = threading.Lock()
+    counters = {}
+    gauges = {}
+    help = {}
+
+def _key(name: str, labels: dict = None):
+    return (name, tuple(sorted((labels or {}).items())))
+
+def describe(name: str, text: str):
+    Metrics.help[name] = text
+
+def increment(name: str, labels: dict = None, value: float = 1):
+    key = _key(name, labels)
+    with Metrics.lock:
+        Metrics.counters[key] = Metrics.counters.get(key, 0) + value
+
+def set_gauge(name: str, value: float, labels: dict = None):
+    with Metrics.lock:
+        Metrics.gauges[_key(name, labels)] = value
+
+def get_value(name: str, labels: dict = None) -> float:
+    key = _key(name, labels)
+    with Metrics.lock:
+        return Metrics.counters.get(key, Metrics.gauges.get(key, 0))
+
+def render_prometheus() -> str:
+    lines = []
+    with Metrics.lock:
+        samples = [("counter", Metrics.counters), ("gauge", Metrics.gauges)]
+        seen = set()
+        for metric_type, values in samples:
+            for (name, labels), value in sorted(values.items()):
+                if name not in seen:
+                    seen.add(name)
+                    if name in Metrics.help:
+                        lines.append(f"# HELP {name} {Metrics.help[name]}")
+                    lines.append(f"# TYPE {name} {metric_type}")
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    return "\n".join(lines) + "\n"
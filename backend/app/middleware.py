@@ -0,0 +1,23 @@
+import os
+from starlette.middleware.gzip import GZipMiddleware
+
+# API responses smaller than this are sent uncompressed
+API_GZIP_MIN_BYTES = int(os.getenv("API_GZIP_MIN_BYTES", 1024))
+
+class APIGZipMiddleware:
+    """
+    Gzip responses under `prefix` when the client accepts it and the body is
+    at least `minimum_size` bytes. Static files are left alone: they are
+    already served precompressed.
+    """
+
+    def __init__(self, app, prefix: str = "/api", minimum_size: int = API_GZIP_MIN_BYTES, compresslevel: int = 6):
+        self.app = app
+        self.prefix = prefix
+        self.gzip = GZipMiddleware(app, minimum_size=minimum_size, compresslevel=compresslevel)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith(self.prefix):
+            await self.gzip(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
@@ -57,10 +57,17 @@ class Order(BaseModel):
 
 class Report(BaseModel):
     id: Optional[str] = Field(default=None, alias="_id")
-    report_type: str  # "sales", "inventory", "low_stock"
-    data: dict
+    report_type: str  # "sales", "inventory", "forecast"
+    params: dict = {}
+    params_key: str = ""  # report_type + normalized params, for reuse
+    status: str = "pending"  # pending, running, completed, failed
+    data: Optional[dict] = None
+    error: Optional[str] = None
     generated_by: str
-    generated_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    generated_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
 
     class Config:
         populate_by_name = True
@@ -0,0 +1,86 @@
+"""
+Group-commit micro-batching for order intake.
+
+With ORDER_BATCHING=true, each worker collects the orders that arrive within
+ORDER_BATCH_WINDOW_MS of the first one (at most ORDER_BATCH_MAX_SIZE) and
+places them together: one product lookup, one bulk conditional stock
+decrement and one insert_many instead of several writes per order. Each
+caller awaits its own result or error.
+
+While one batch is being written the next one fills up, so under load
+batches grow on their own; when traffic is light an order waits at most
+the window before being written. The window is the latency traded for
+fewer, larger writes.
+
+A batch only collects orders that passed admission control, so it can
+never be larger than ORDER_MAX_CONCURRENCY (app/admission.py); that limit
+defaults to ORDER_BATCH_MAX_SIZE when batching is enabled. Setting it lower
+caps the batches at it.
+"""
+import asyncio
+import os
+from starlette.concurrency import run_in_threadpool
+from app import metrics
+from app.scheduler import start_task
+
+ORDER_BATCHING = os.getenv("ORDER_BATCHING", "false").lower() == "true"
+ORDER_BATCH_WINDOW_MS = float(os.getenv("ORDER_BATCH_WINDOW_MS", 5))
+ORDER_BATCH_MAX_SIZE = int(os.getenv("ORDER_BATCH_MAX_SIZE", 64))
+
+metrics.describe("order_batches_total", "Order micro-batches written")
+metrics.describe("order_batch_orders_total", "Orders written through micro-batches")
+
+class OrderBatcher:
+    """Feeds submitted items to `process_batch(items) -> results` in micro-batches"""
+
+    def __init__(self, process_batch, window_ms: float = ORDER_BATCH_WINDOW_MS, max_size: int = ORDER_BATCH_MAX_SIZE):
+        self.process_batch = process_batch
+        self.window = window_ms / 1000
+        self.max_size = max_size
+        self.queue = None
+        self.task = None
+
+    async def submit(self, item):
+        """Queue an item and wait for its result (exceptions are re-raised)"""
+        if self.task is None or self.task.done():
+            self.queue = asyncio.Queue()
+            # Tracked by the scheduler so shutdown cancels it
+            self.task = start_task("order_batcher", self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, future))
+        return await future
+
+    async def _collect(self):
+        batch = [await self.queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.window
+        while len(batch) < self.max_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            try:
+                results = await run_in_threadpool(self.process_batch, [item for item, _ in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+            metrics.increment("order_batches_total")
+            metrics.increment("order_batch_orders_total", value=len(batch))
+            for (_, future), result in zip(batch, results):
+                # The caller may have gone away (client disconnect)
+                if future.done():
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
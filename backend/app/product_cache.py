@@ -0,0 +1,147 @@
+"""
+In-process cache of product documents.
+
+Order intake and GET /products/{id} read product documents far more often
+than products change. Each worker keeps up to PRODUCT_CACHE_MAX_ENTRIES of
+them (least recently used evicted first) for PRODUCT_CACHE_TTL_SECONDS;
+a TTL of 0 turns the cache off.
+
+* stock is never served from the cache: the fields that change with every
+  order (stock_quantity, stock_shards, updated_at) are left out of cached
+  entries. get_product() reads them fresh; order intake does not need them
+  because the conditional stock decrement is the authority.
+* product updates, deletes and image uploads invalidate the entry in the
+  worker that made them; other workers see the change within the TTL
+* concurrent misses for the same product share one database read
+* product_cache_hits_total / product_cache_misses_total and
+  product_cache_hit_ratio are exported on /metrics
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from bson import ObjectId
+from app import metrics
+from app.database import get_products_collection
+from app.stock_shards import with_shard_total
+
+PRODUCT_CACHE_TTL_SECONDS = float(os.getenv("PRODUCT_CACHE_TTL_SECONDS", 30))
+PRODUCT_CACHE_MAX_ENTRIES = int(os.getenv("PRODUCT_CACHE_MAX_ENTRIES", 10000))
+
+VOLATILE_FIELDS = ["stock_quantity", "stock_shards", "updated_at"]
+
+metrics.describe("product_cache_hits_total", "Product lookups served from the in-process cache")
+metrics.describe("product_cache_misses_total", "Product lookups that read the database")
+metrics.describe("product_cache_hit_ratio", "Share of product lookups served from the cache")
+metrics.describe("product_cache_entries", "Products held in the in-process cache")
+
+class ProductCache:
+    lock = threading.Lock()
+    # product_id -> (expires_at, document without volatile fields), LRU order
+    entries = OrderedDict()
+    # product_id -> Future of the read in flight
+    loading = {}
+    hits = 0
+    misses = 0
+
+def _count(hits: int = 0, misses: int = 0):
+    if hits:
+        metrics.increment("product_cache_hits_total", value=hits)
+    if misses:
+        metrics.increment("product_cache_misses_total", value=misses)
+    with ProductCache.lock:
+        ProductCache.hits += hits
+        ProductCache.misses += misses
+        ratio = ProductCache.hits / (ProductCache.hits + ProductCache.misses)
+        entries = len(ProductCache.entries)
+    metrics.set_gauge("product_cache_hit_ratio", round(ratio, 4))
+    metrics.set_gauge("product_cache_entries", entries)
+
+def _store(product_id: str, document: dict):
+    """Caller holds the lock"""
+    ProductCache.entries[product_id] = (time.monotonic() + PRODUCT_CACHE_TTL_SECONDS, document)
+    ProductCache.entries.move_to_end(product_id)
+    while len(ProductCache.entries) > PRODUCT_CACHE_MAX_ENTRIES:
+        ProductCache.entries.popitem(last=False)
+
+def _cached(product_id: str):
+    """Caller holds the lock"""
+    entry = ProductCache.entries.get(product_id)
+    if entry is None:
+        return None
+    if entry[0] <= time.monotonic():
+        del ProductCache.entries[product_id]
+        return None
+    ProductCache.entries.move_to_end(product_id)
+    return entry[1]
+
+def _copy(document):
+    return dict(document) if document else None
+
+def _load(product_id: str):
+    return get_products_collection().find_one(
+        {"_id": ObjectId(product_id)}, {field: 0 for field in VOLATILE_FIELDS}
+    )
+
+def get_product_fields(product_id: str):
+    """The product without its volatile fields (see above), or None if it does not exist"""
+    if PRODUCT_CACHE_TTL_SECONDS <= 0:
+        return _load(product_id)
+
+    product_id = str(ObjectId(product_id))
+    with ProductCache.lock:
+        document = _cached(product_id)
+        if document is None:
+            future = ProductCache.loading.get(product_id)
+            leader = future is None
+            if leader:
+                future = ProductCache.loading[product_id] = Future()
+    if document is not None:
+        _count(hits=1)
+        return _copy(document)
+    _count(misses=1)
+    if not leader:
+        return _copy(future.result())
+
+    try:
+        document = _load(product_id)
+    except Exception as e:
+        with ProductCache.lock:
+            if ProductCache.loading.get(product_id) is future:
+                del ProductCache.loading[product_id]
+        future.set_exception(e)
+        raise
+    with ProductCache.lock:
+        # An invalidation while the read was in flight discards its result
+        if ProductCache.loading.get(product_id) is future:
+            del ProductCache.loading[product_id]
+            if document:
+                _store(product_id, document)
+    future.set_result(document)
+    return _copy(document)
+
+def get_product(product_id: str):
+    """The full product: cached fields plus stock read from the database (summed over shards)"""
+    fields = get_product_fields(product_id)
+    if fields is None:
+        return None
+    volatile = get_products_collection().find_one(
+        {"_id": ObjectId(product_id)}, {field: 1 for field in VOLATILE_FIELDS}
+    )
+    if volatile is None:
+        # Deleted through another worker
+        invalidate(product_id)
+        return None
+    return with_shard_total({**fields, **volatile})
+
+def invalidate(product_id: str):
+    product_id = str(ObjectId(product_id))
+    with ProductCache.lock:
+        ProductCache.entries.pop(product_id, None)
+        ProductCache.loading.pop(product_id, None)
+
+def clear():
+    with ProductCache.lock:
+        ProductCache.entries.clear()
+        ProductCache.loading.clear()
@@ -0,0 +1,300 @@
+"""
+On-demand profiling of single requests.
+
+With PROFILING_ENABLED=true an admin can profile one request by sending an
+`X-Profile` header or a `profile` query parameter:
+
+    curl -H "Authorization: Bearer $TOKEN" -H "X-Profile: sample" \\
+        http://localhost:8000/api/reports/sales?days=90
+
+* `sample` (or `1`) samples the stacks of every thread in the worker every
+  PROFILE_SAMPLE_INTERVAL_MS while the request runs, so work done in the
+  threadpool is included; concurrent requests show up too
+* `cprofile` runs the event loop thread under cProfile (exact call counts
+  and times, but threadpool work only appears as waiting)
+
+Every MongoDB command issued on behalf of the request is timed through a
+pymongo command listener. The report is stored in the `profiles`
+collection for PROFILE_TTL_HOURS and its id is returned in an
+`X-Profile-Id` response header (GET /api/profiles/{id}).
+
+Requests from anyone but an active admin, and requests arriving while
+another one is being profiled, run normally. When PROFILING_ENABLED is
+false neither the middleware nor the command listener is installed, so
+requests pay nothing for this.
+"""
+import contextvars
+import cProfile
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs
+from bson import ObjectId
+from pymongo import monitoring
+from starlette.concurrency import run_in_threadpool
+from app.auth import get_user_from_token
+from app.database import get_profiles_collection
+from app.structured_logging import request_id_var
+
+logger = logging.getLogger(__name__)
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", 5))
+PROFILE_TTL_HOURS = float(os.getenv("PROFILE_TTL_HOURS", 24))
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+MODES = {"1": "sample", "true": "sample", "sample": "sample", "cprofile": "cprofile"}
+TOP_ENTRIES = 50
+MAX_STACK_DEPTH = 64
+# Leaf functions of threads that are idle rather than working
+IDLE_FUNCTIONS = {"wait", "select", "poll", "_wait_for_tstate_lock", "accept", "_worker"}
+
+active_profile = contextvars.ContextVar("active_profile", default=None)
+
+class ProfilingState:
+    # One profiled request at a time per worker
+    lock = threading.Lock()
+
+class RequestProfile:
+    """Mongo command timings of one request"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = {}
+        self.commands = []
+
+    def command_started(self, event):
+        collection = event.command.get(event.command_name)
+        with self.lock:
+            self.started[event.request_id] = collection if isinstance(collection, str) else None
+
+    def command_finished(self, event, failed: bool):
+        with self.lock:
+            collection = self.started.pop(event.request_id, None)
+            self.commands.append({
+                "command": event.command_name,
+                "collection": collection,
+                "duration_ms": event.duration_micros / 1000,
+                "failed": failed
+            })
+
+    def mongo_report(self) -> dict:
+        with self.lock:
+            commands = list(self.commands)
+        by_command = {}
+        for command in commands:
+            key = (command["command"], command["collection"])
+            entry = by_command.setdefault(key, {
+                "command": command["command"], "collection": command["collection"],
+                "count": 0, "total_ms": 0.0, "max_ms": 0.0
+            })
+            entry["count"] += 1
+            entry["total_ms"] += command["duration_ms"]
+            entry["max_ms"] = max(entry["max_ms"], command["duration_ms"])
+        return {
+            "commands": len(commands),
+            "total_ms": round(sum(command["duration_ms"] for command in commands), 3),
+            "by_command": sorted(by_command.values(), key=lambda entry: -entry["total_ms"]),
+            "slowest": sorted(commands, key=lambda command: -command["duration_ms"])[:10]
+        }
+
+class CommandTimer(monitoring.CommandListener):
+    """Times the commands of the request being profiled (no-op for the rest)"""
+
+    def started(self, event):
+        profile = active_profile.get()
+        if profile is not None:
+            profile.command_started(event)
+
+    def succeeded(self, event):
+        profile = active_profile.get()
+        if profile is not None:
+            profile.command_finished(event, failed=False)
+
+    def failed(self, event):
+        profile = active_profile.get()
+        if profile is not None:
+            profile.command_finished(event, failed=True)
+
+def command_listeners() -> list:
+    """pymongo event listeners for MongoClient (none unless profiling is enabled)"""
+    return [CommandTimer()] if PROFILING_ENABLED else []
+
+class StackSampler:
+    """Samples every thread's Python stack at a fixed interval"""
+
+    def __init__(self, interval_ms: float = PROFILE_SAMPLE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.stacks = Counter()
+        self.samples = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            self.samples += 1
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or frame.f_code.co_name in IDLE_FUNCTIONS:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                self.stacks[tuple(reversed(stack))] += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def report(self) -> dict:
+        leaf = Counter()
+        inclusive = Counter()
+        for stack, count in self.stacks.items():
+            leaf[stack[-1]] += count
+            for function in set(stack):
+                inclusive[function] += count
+        total = sum(self.stacks.values()) or 1
+        return {
+            "mode": "sample",
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+            "top_self": [
+                {"function": function, "samples": count, "percent": round(100 * count / total, 1)}
+                for function, count in leaf.most_common(TOP_ENTRIES)
+            ],
+            "top_inclusive": [
+                {"function": function, "samples": count, "percent": round(100 * count / total, 1)}
+                for function, count in inclusive.most_common(TOP_ENTRIES)
+            ],
+            # Collapsed stacks (root;...;leaf count), ready for flame graph tools
+            "stacks": [
+                f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common(TOP_ENTRIES)
+            ]
+        }
+
+class DeterministicProfiler:
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def report(self) -> dict:
+        stats = pstats.Stats(self.profile)
+        entries = sorted(stats.stats.items(), key=lambda item: -item[1][3])[:TOP_ENTRIES]
+        return {
+            "mode": "cprofile",
+            "total_calls": stats.total_calls,
+            "top_cumulative": [
+                {
+                    "function": f"{os.path.basename(filename)}:{function}:{line}",
+                    "calls": calls,
+                    "total_ms": round(total_time * 1000, 3),
+                    "cumulative_ms": round(cumulative_time * 1000, 3)
+                }
+                for (filename, line, function), (_, calls, total_time, cumulative_time, _) in entries
+            ]
+        }
+
+def _requested_mode(scope):
+    for name, value in scope["headers"]:
+        if name == PROFILE_HEADER.lower().encode():
+            return MODES.get(value.decode("latin-1").lower())
+    if b"profile=" in scope.get("query_string", b""):
+        values = parse_qs(scope["query_string"].decode("latin-1")).get("profile")
+        if values:
+            return MODES.get(values[0].lower())
+    return None
+
+def _admin_from_scope(scope):
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() != "bearer":
+                return None
+            user = get_user_from_token(token)
+            if user and user.is_active and user.role == "admin":
+                return user
+    return None
+
+def _store(document: dict):
+    get_profiles_collection().insert_one(document)
+
+class ProfilingMiddleware:
+    """Profiles requests that ask for it (installed only when PROFILING_ENABLED)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        mode = _requested_mode(scope) if scope["type"] == "http" else None
+        if mode is None:
+            await self.app(scope, receive, send)
+            return
+        user = await run_in_threadpool(_admin_from_scope, scope)
+        if user is None or not ProfilingState.lock.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await self._profile(scope, receive, send, mode, user)
+        finally:
+            ProfilingState.lock.release()
+
+    async def _profile(self, scope, receive, send, mode, user):
+        profile_id = ObjectId()
+        status_code = 500
+
+        async def send_with_profile_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (PROFILE_ID_HEADER.lower().encode(), str(profile_id).encode())
+                ]
+            await send(message)
+
+        request_profile = RequestProfile()
+        profiler = StackSampler() if mode == "sample" else DeterministicProfiler()
+        token = active_profile.set(request_profile)
+        started = time.perf_counter()
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profiler.stop()
+            duration_ms = (time.perf_counter() - started) * 1000
+            active_profile.reset(token)
+            now = datetime.utcnow()
+            document = {
+                "_id": profile_id,
+                "method": scope["method"],
+                "path": scope["path"],
+                "query": scope.get("query_string", b"").decode("latin-1"),
+                "status": status_code,
+                "request_id": request_id_var.get(),
+                "profiled_by": user.username,
+                "duration_ms": round(duration_ms, 3),
+                "mongo": request_profile.mongo_report(),
+                "profile": profiler.report(),
+                "created_at": now,
+                "expires_at": now + timedelta(hours=PROFILE_TTL_HOURS)
+            }
+            try:
+                await run_in_threadpool(_store, document)
+            except Exception as e:
+                logger.error(f"Could not store profile {profile_id}: {e}")
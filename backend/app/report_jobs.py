@@ -0,0 +1,154 @@
+"""
+Asynchronous report jobs.
+
+A report is submitted as a job, computed in the background of the worker
+that accepted it and stored in the `reports` collection (see
+app.models.Report). Clients poll the job and fetch the result when it is
+completed. Jobs are keyed by report type and normalized parameters: a
+submission that matches a pending, running or still-fresh completed job
+returns that job instead of computing the report again. Every job document
+expires after REPORT_TTL_MINUTES via a TTL index.
+
+Report types are registered by the code that knows how to compute them:
+
+    @register_report("sales", {"days": 30})
+    def compute_sales(days: int) -> dict: ...
+"""
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import ReturnDocument
+from starlette.concurrency import run_in_threadpool
+from app.database import get_reports_collection
+from app.models import Report
+from app.scheduler import start_task
+
+logger = logging.getLogger(__name__)
+
+REPORT_TTL_MINUTES = float(os.getenv("REPORT_TTL_MINUTES", 60))
+# A job still running after this long is treated as lost (e.g. its worker died)
+REPORT_JOB_TIMEOUT_SECONDS = int(os.getenv("REPORT_JOB_TIMEOUT_SECONDS", 600))
+# Reports computed at the same time per worker process
+REPORT_JOB_CONCURRENCY = int(os.getenv("REPORT_JOB_CONCURRENCY", 2))
+
+ACTIVE_STATUSES = ["pending", "running"]
+
+class ReportJobError(ValueError):
+    """Unknown report type or invalid parameters"""
+
+class ReportJobs:
+    generators = {}
+    semaphore = None
+
+def register_report(report_type: str, defaults: dict, validate=None):
+    """
+    Register `func(**params) -> dict` as the generator for `report_type`.
+    `validate(params)` may raise ReportJobError to reject a submission.
+    """
+    def decorator(func):
+        ReportJobs.generators[report_type] = (func, defaults, validate)
+        return func
+    return decorator
+
+def normalize_params(report_type: str, params: dict) -> dict:
+    """Fill in defaults and coerce values to the defaults' types"""
+    if report_type not in ReportJobs.generators:
+        raise ReportJobError(f"Unknown report type: {report_type}. Must be one of: {', '.join(sorted(ReportJobs.generators))}")
+    _, defaults, validate = ReportJobs.generators[report_type]
+    unknown = set(params) - set(defaults)
+    if unknown:
+        raise ReportJobError(f"Unknown parameters for {report_type}: {', '.join(sorted(unknown))}")
+    normalized = {}
+    for name, default in defaults.items():
+        value = params.get(name, default)
+        try:
+            normalized[name] = type(default)(value)
+        except (TypeError, ValueError):
+            raise ReportJobError(f"Invalid value for {name}: {value!r}")
+    if validate:
+        validate(normalized)
+    return normalized
+
+def params_key(report_type: str, params: dict) -> str:
+    return report_type + ":" + json.dumps(params, sort_keys=True, separators=(",", ":"))
+
+def find_reusable(key: str):
+    """A job for the same report and parameters that is still in flight or fresh"""
+    now = datetime.utcnow()
+    return get_reports_collection().find_one(
+        {
+            "params_key": key,
+            "$or": [
+                {"status": "completed", "expires_at": {"$gt": now}},
+                {"status": {"$in": ACTIVE_STATUSES},
+                 "created_at": {"$gt": now - timedelta(seconds=REPORT_JOB_TIMEOUT_SECONDS)}}
+            ]
+        },
+        sort=[("created_at", -1)]
+    )
+
+def _run_job(report_id: ObjectId, report_type: str, params: dict):
+    """Compute a report and store the outcome (blocking, runs in the threadpool)"""
+    reports_collection = get_reports_collection()
+    claimed = reports_collection.find_one_and_update(
+        {"_id": report_id, "status": "pending"},
+        {"$set": {"status": "running", "started_at": datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not claimed:
+        return
+    generator = ReportJobs.generators[report_type][0]
+    try:
+        data = generator(**params)
+        update = {"status": "completed", "data": data}
+    except Exception as e:
+        logger.error(f"Report job {report_id} ({report_type}) failed: {e}")
+        update = {"status": "failed", "error": str(e)}
+    now = datetime.utcnow()
+    update["generated_at"] = now
+    update["expires_at"] = now + timedelta(minutes=REPORT_TTL_MINUTES)
+    reports_collection.update_one({"_id": report_id}, {"$set": update})
+
+async def _execute(report_id: ObjectId, report_type: str, params: dict):
+    if ReportJobs.semaphore is None:
+        ReportJobs.semaphore = asyncio.Semaphore(REPORT_JOB_CONCURRENCY)
+    async with ReportJobs.semaphore:
+        await run_in_threadpool(_run_job, report_id, report_type, params)
+
+def submit_report(report_type: str, params: dict, username: str) -> dict:
+    """
+    Create a job for the report (or return the matching existing one) and
+    start computing it in the background. Must be called from the event loop.
+    """
+    params = normalize_params(report_type, params)
+    key = params_key(report_type, params)
+    existing = find_reusable(key)
+    if existing:
+        return existing
+
+    now = datetime.utcnow()
+    report = Report(
+        report_type=report_type,
+        params=params,
+        params_key=key,
+        generated_by=username,
+        created_at=now,
+        # Removed even if the job is lost before it finishes
+        expires_at=now + timedelta(minutes=REPORT_TTL_MINUTES, seconds=REPORT_JOB_TIMEOUT_SECONDS)
+    )
+    report_data = report.dict(exclude={"id"})
+    get_reports_collection().insert_one(report_data)
+    start_task(f"report:{report_data['_id']}", _execute(report_data["_id"], report_type, params))
+    return report_data
+
+def get_report(report_id: str):
+    """The job document, with jobs lost past the timeout reported as failed"""
+    report = get_reports_collection().find_one({"_id": ObjectId(report_id)})
+    if report and report["status"] in ACTIVE_STATUSES:
+        if report["created_at"] < datetime.utcnow() - timedelta(seconds=REPORT_JOB_TIMEOUT_SECONDS):
+            report["status"] = "failed"
+            report["error"] = "Report job timed out"
+    return report
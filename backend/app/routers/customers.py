@@ -0,0 +1,66 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from typing import List, Optional
+from app.models import User
+from app.schemas import CustomerResponse, CustomerOrdersResponse, OrderResponse, OrderSummaryResponse
+from app.auth import get_current_active_user
+from app.customers import get_customer, top_customers, customer_orders, InvalidCursor
+
+router = APIRouter(prefix="/customers", tags=["customers"])
+
+def customer_response(customer: dict) -> CustomerResponse:
+    return CustomerResponse(
+        email=customer["email"],
+        name=customer["name"],
+        order_count=customer["order_count"],
+        # Undo float drift from the running increments
+        lifetime_value=round(customer["lifetime_value"], 2),
+        first_order_at=customer.get("first_order_at"),
+        last_order_at=customer.get("last_order_at")
+    )
+
+@router.get("/", response_model=List[CustomerResponse])
+async def get_top_customers(
+    limit: int = 20,
+    current_user: User = Depends(get_current_active_user)
+):
+    """Customers by lifetime value, highest first"""
+    return [customer_response(customer) for customer in top_customers(min(limit, 500))]
+
+@router.get("/{customer_email}", response_model=CustomerResponse)
+async def get_customer_stats(
+    customer_email: str,
+    current_user: User = Depends(get_current_active_user)
+):
+    """Order count, lifetime value and first/last order date (cancelled orders excluded)"""
+    customer = get_customer(customer_email)
+    if not customer:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Customer not found"
+        )
+    return customer_response(customer)
+
+@router.get("/{customer_email}/orders", response_model=CustomerOrdersResponse)
+async def get_customer_orders(
+    customer_email: str,
+    cursor: Optional[str] = None,
+    limit: int = 50,
+    summary: bool = False,
+    current_user: User = Depends(get_current_active_user)
+):
+    """The customer's orders, live and archived, newest first; pass next_cursor back for the next page"""
+    try:
+        orders, next_cursor = customer_orders(customer_email, cursor, limit, {"items": 0} if summary else None)
+    except InvalidCursor:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+    model = OrderSummaryResponse if summary else OrderResponse
+    return CustomerOrdersResponse(
+        orders=[
+            model(id=str(order["_id"]), **{k: v for k, v in order.items() if k != "_id"})
+            for order in orders
+        ],
+        next_cursor=next_cursor
+    )
@@ -1,24 +1,35 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional, Union
 from bson import ObjectId
+from pymongo import ReturnDocument
 from datetime import datetime
+import logging
 import uuid
-from app.database import get_orders_collection, get_products_collection
+from app.database import get_orders_collection, get_products_collection, get_orders_archive_collection, run_in_transaction
 from app.models import User, Order, OrderItem
-from app.schemas import OrderCreate, OrderResponse, OrderStatusUpdate
+from app.schemas import OrderCreate, OrderResponse, OrderSummaryResponse, OrderChangesResponse, OrderStatusUpdate
 from app.auth import get_current_active_user
 from app.email_service import email_service
+from app.stock import reserve_stock, reserve_stock_batch, restore_stock, release_order_stock, reinstate_order_stock
+from app.stock_ledger import RESTORE
+from app.stock_shards import with_shard_totals
+from app.product_cache import get_product, get_product_fields
+from app.sales_counters import record_order_sales, record_orders_sales, reverse_order_sales, reinstate_order_sales, reverse_deleted_order_sales
+from app.customers import customer_key, record_customer_orders, remove_customer_order, reinstate_customer_order
+from app.archive import find_order_any_tier, find_orders_all_tiers
+from app.admission import admit_order
+from app.idempotency import order_idempotency, IdempotentRequest
+from app.order_batching import OrderBatcher, ORDER_BATCHING
+from app.change_feed import changes_since, record_tombstones, ORDER
+from app.field_selection import parse_fields, select, partial_response, projection as field_projection
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/orders", tags=["orders"])
 
-@router.post("/", response_model=OrderResponse)
-async def create_order(
-    order: OrderCreate,
-    current_user: User = Depends(get_current_active_user)
-):
-    orders_collection = get_orders_collection()
-    products_collection = get_products_collection()
-    
+def build_order_items(order: OrderCreate, find_product):
+    """Validate the items against their products; returns (order_items, total_amount)"""
     order_items = []
     total_amount = 0.0
     
@@ -30,15 +41,16 @@ async def create_order(
                 detail=f"Invalid product ID: {item.product_id}"
             )
         
-        product = products_collection.find_one({"_id": ObjectId(item.product_id)})
+        product = find_product(item.product_id)
         if not product:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Product not found: {item.product_id}"
             )
         
-        # Check stock availability
-        if product["stock_quantity"] < item.quantity:
+        # Check stock availability (cached products carry no stock; the
+        # conditional decrement in reserve_stock is the authority then)
+        if "stock_quantity" in product and product["stock_quantity"] < item.quantity:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"Insufficient stock for product {product['name']}. Available: {product['stock_quantity']}, Requested: {item.quantity}"
@@ -57,46 +69,183 @@ async def create_order(
             total=item_total
         )
         order_items.append(order_item)
-        
-        # Update product stock
-        new_stock = product["stock_quantity"] - item.quantity
-        products_collection.update_one(
-            {"_id": ObjectId(item.product_id)},
-            {"$set": {"stock_quantity": new_stock, "updated_at": datetime.utcnow()}}
-        )
     
+    return order_items, total_amount
+
+def new_order_document(order: OrderCreate, order_items: List[OrderItem], total_amount: float, order_id: ObjectId) -> dict:
     # Generate order number
     order_number = f"ORD-{uuid.uuid4().hex[:8].upper()}"
     
-    # Create order
-    order_data = {
+    return {
+        "_id": order_id,
         "order_number": order_number,
         "customer_name": order.customer_name,
         "customer_email": order.customer_email,
+        "customer_key": customer_key(order.customer_email),
         "items": [item.dict() for item in order_items],
         "total_amount": total_amount,
         "status": "pending",
         "created_at": datetime.utcnow(),
         "updated_at": datetime.utcnow()
     }
+
+def place_order(order: OrderCreate) -> dict:
+    """Validate the order, reserve stock and insert it (blocking, runs in the threadpool)"""
+    orders_collection = get_orders_collection()
+    
+    # Name and price come from the product cache
+    order_items, total_amount = build_order_items(order, get_product_fields)
+    
+    # The order id is allocated up front so the ledger entries can reference it
+    order_id = ObjectId()
+    
+    # Reserve stock with conditional decrements so concurrent orders cannot oversell
+    failed = reserve_stock([(item.product_id, item.quantity) for item in order_items], str(order_id))
+    if failed:
+        failed_item = next(item for item in order_items if item.product_id == failed[0])
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Insufficient stock for product {failed_item.product_name}. Requested: {failed[1]}"
+        )
+    
+    order_data = new_order_document(order, order_items, total_amount, order_id)
+    
+    def insert(session):
+        orders_collection.insert_one(order_data, session=session)
+        record_order_sales(order_data, session)
+        record_customer_orders([order_data], session)
+    
+    run_in_transaction(insert)
+    # The document already carries its _id, so no re-read is needed
+    return order_data
+
+def place_orders_batch(orders: List[OrderCreate]) -> list:
+    """
+    Place a micro-batch of orders with one product lookup, one bulk
+    conditional stock decrement and one insert_many. Returns one entry per
+    order: the inserted order document or the exception for that order.
+    Orders that do not fit the stock seen by the batch (or lose a race with
+    another writer) are placed one by one with place_order.
+    """
+    orders_collection = get_orders_collection()
+    results = [None] * len(orders)
+    
+    product_ids = {
+        ObjectId(item.product_id)
+        for order in orders for item in order.items
+        if ObjectId.is_valid(item.product_id)
+    }
+    products = {
+        str(product["_id"]): product
+        for product in with_shard_totals(list(get_products_collection().find({"_id": {"$in": list(product_ids)}})))
+    }
+    
+    # Allocate the stock seen above in arrival order
+    available = {product_id: product["stock_quantity"] for product_id, product in products.items()}
+    accepted = []
+    individually = []
+    for index, order in enumerate(orders):
+        try:
+            order_items, total_amount = build_order_items(
+                order, lambda product_id: products.get(str(ObjectId(product_id)))
+            )
+        except HTTPException as e:
+            results[index] = e
+            continue
+        quantities = {}
+        for item in order_items:
+            quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+        if any(available[product_id] < quantity for product_id, quantity in quantities.items()):
+            individually.append(index)
+            continue
+        for product_id, quantity in quantities.items():
+            available[product_id] -= quantity
+        order_id = ObjectId()
+        accepted.append((index, order_id, order_items, total_amount, list(quantities.items())))
     
-    result = orders_collection.insert_one(order_data)
-    created_order = orders_collection.find_one({"_id": result.inserted_id})
+    failed = reserve_stock_batch([(str(order_id), quantities) for _, order_id, _, _, quantities in accepted])
+    documents = []
+    for index, order_id, order_items, total_amount, _ in accepted:
+        if str(order_id) in failed:
+            individually.append(index)
+            continue
+        documents.append((index, new_order_document(orders[index], order_items, total_amount, order_id)))
+    
+    if documents:
+        # Without transactions the steps are not atomic; the recovery below
+        # only redoes the ones that did not finish
+        completed = set()
+        
+        def insert(session):
+            completed.clear()
+            orders_collection.insert_many([document for _, document in documents], ordered=False, session=session)
+            completed.add("orders")
+            record_orders_sales([document for _, document in documents], session)
+            completed.add("sales")
+            record_customer_orders([document for _, document in documents], session)
+            completed.add("customers")
+        
+        try:
+            run_in_transaction(insert)
+        except Exception as e:
+            # Give the stock back for every order that did not make it in
+            # (all of them if a transaction was rolled back)
+            inserted = {
+                order["_id"] for order in orders_collection.find(
+                    {"_id": {"$in": [document["_id"] for _, document in documents]}}, {"_id": 1}
+                )
+            }
+            inserted_documents = [document for _, document in documents if document["_id"] in inserted]
+            if inserted_documents and "orders" not in completed:
+                # insert_many failed part way: nothing was counted yet
+                record_orders_sales(inserted_documents)
+                record_customer_orders(inserted_documents)
+            elif inserted_documents and "sales" not in completed:
+                # The counter bulk write failed part way: counting again could
+                # count some orders twice, so leave it to a rebuild
+                logger.error(f"Sales counters may be incomplete after a failed batch, run python -m app.sales_counters rebuild: {e}")
+                record_customer_orders(inserted_documents)
+            elif inserted_documents and "customers" not in completed:
+                logger.error(f"Customer aggregates may be incomplete after a failed batch, run python -m app.customers rebuild: {e}")
+            for index, document in documents:
+                if document["_id"] in inserted:
+                    results[index] = document
+                else:
+                    restore_stock(
+                        [(item["product_id"], item["quantity"]) for item in document["items"]],
+                        RESTORE, str(document["_id"])
+                    )
+                    results[index] = e
+        else:
+            for index, document in documents:
+                results[index] = document
     
+    for index in sorted(individually):
+        try:
+            results[index] = place_order(orders[index])
+        except Exception as e:
+            results[index] = e
+    return results
+
+# Collects concurrent orders into micro-batches when ORDER_BATCHING is enabled
+order_batcher = OrderBatcher(place_orders_batch)
+
+async def notify_order_placed(created_order: dict):
+    """Order confirmation and low stock alert emails"""
     # Send order confirmation email
     try:
         await email_service.send_order_confirmation(
-            order_number, 
-            order.customer_email, 
-            total_amount
+            created_order["order_number"], 
+            created_order["customer_email"], 
+            created_order["total_amount"]
         )
     except Exception as e:
-        print(f"Failed to send order confirmation email: {e}")
+        logger.error(f"Failed to send order confirmation email: {e}", extra={"order_number": created_order["order_number"]})
     
     # Check for low stock alerts
     try:
-        for item in order_items:
-            product = products_collection.find_one({"_id": ObjectId(item.product_id)})
+        for item in created_order["items"]:
+            product = get_product(item["product_id"])
             if product and product["stock_quantity"] <= product.get("low_stock_threshold", 10):
                 # Send low stock alert to admin (you can get admin email from env or database)
                 admin_email = "admin@inventory.com"  # Replace with actual admin email
@@ -106,36 +255,94 @@ async def create_order(
                     admin_email
                 )
     except Exception as e:
-        print(f"Failed to send low stock alert: {e}")
+        logger.error(f"Failed to send low stock alert: {e}", extra={"order_number": created_order["order_number"]})
+
+@router.post("/", response_model=OrderResponse)
+async def create_order(
+    order: OrderCreate,
+    current_user: User = Depends(get_current_active_user),
+    # Resolved before admission control, so replayed retries skip the queue
+    idempotency: Optional[IdempotentRequest] = Depends(order_idempotency),
+    _admission: None = Depends(admit_order)
+):
+    # Blocking database work runs in the threadpool so the event loop keeps
+    # serving reads while order intake is busy
+    if ORDER_BATCHING:
+        created_order = await order_batcher.submit(order)
+    else:
+        created_order = await run_in_threadpool(place_order, order)
     
-    return OrderResponse(
+    response = OrderResponse(
         id=str(created_order["_id"]),
         **{k: v for k, v in created_order.items() if k != "_id"}
     )
+    # Stored before the emails go out, so a retry never places the order twice
+    if idempotency:
+        await run_in_threadpool(idempotency.complete, response)
+    
+    await notify_order_placed(created_order)
+    
+    return response
 
-@router.get("/", response_model=List[OrderResponse])
+@router.get("/", response_model=List[Union[OrderResponse, OrderSummaryResponse]])
 async def get_orders(
     skip: int = 0,
     limit: int = 100,
     status: str = None,
+    include_archived: bool = False,
+    summary: bool = False,
+    fields: Optional[str] = None,
     current_user: User = Depends(get_current_active_user)
 ):
     orders_collection = get_orders_collection()
     
+    # ?summary=true leaves out the line items; ?fields=... picks exact fields
+    names = parse_fields(fields, OrderResponse)
+    projection = field_projection(names) if names else ({"items": 0} if summary else None)
+    
     query = {}
     if status:
         query["status"] = status
     
-    orders = list(orders_collection.find(query).skip(skip).limit(limit).sort("created_at", -1))
+    # Only the live tier by default; full history spans the archive as well
+    if include_archived:
+        orders = find_orders_all_tiers(query, skip, limit, projection)
+    else:
+        orders = list(orders_collection.find(query, projection).skip(skip).limit(limit).sort("created_at", -1))
     
+    if names:
+        return partial_response([
+            select({"id": str(order["_id"]), **order}, names) for order in orders
+        ])
+    model = OrderSummaryResponse if summary else OrderResponse
     return [
-        OrderResponse(
+        model(
             id=str(order["_id"]),
             **{k: v for k, v in order.items() if k != "_id"}
         )
         for order in orders
     ]
 
+@router.get("/changes", response_model=OrderChangesResponse)
+async def get_order_changes(
+    since: Optional[str] = None,
+    limit: int = 500,
+    summary: bool = False,
+    current_user: User = Depends(get_current_active_user)
+):
+    # Live orders, like the order list; archiving an order is reported as a deletion
+    page = changes_since(ORDER, get_orders_collection(), since, limit, {"items": 0} if summary else None)
+    model = OrderSummaryResponse if summary else OrderResponse
+    return OrderChangesResponse(
+        changes=[
+            model(id=str(order["_id"]), **{k: v for k, v in order.items() if k != "_id"})
+            for order in page["changes"]
+        ],
+        deleted=page["deleted"],
+        cursor=page["cursor"],
+        has_more=page["has_more"]
+    )
+
 @router.get("/{order_id}", response_model=OrderResponse)
 async def get_order(
     order_id: str,
@@ -147,8 +354,7 @@ async def get_order(
             detail="Invalid order ID"
         )
     
-    orders_collection = get_orders_collection()
-    order = orders_collection.find_one({"_id": ObjectId(order_id)})
+    order = find_order_any_tier({"_id": ObjectId(order_id)})
     
     if not order:
         raise HTTPException(
@@ -182,21 +388,56 @@ async def update_order_status(
     
     orders_collection = get_orders_collection()
     
-    # Check if order exists
-    existing_order = orders_collection.find_one({"_id": ObjectId(order_id)})
-    if not existing_order:
+    def set_status(query: dict):
+        return orders_collection.find_one_and_update(
+            query,
+            {"$set": {"status": status_update.status, "updated_at": datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER
+        )
+    
+    # Cancelling an order that still holds stock releases it in the same
+    # conditional write that changes the status, so it happens exactly once
+    if status_update.status == "cancelled":
+        updated_order = release_order_stock(order_id, {"status": "cancelled"})
+        if not updated_order:
+            updated_order = set_status({"_id": ObjectId(order_id)})
+    else:
+        # Update order status and read it back in one round trip; only a
+        # cancelled order (no match here) takes the reinstate path
+        not_cancelled = {"_id": ObjectId(order_id), "status": {"$ne": "cancelled"}}
+        updated_order = set_status(not_cancelled)
+        if not updated_order:
+            # Un-cancelling takes the stock again
+            updated_order, failed = reinstate_order_stock(order_id, status_update.status)
+            if failed:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Insufficient stock to reinstate the order for product {failed[0]}. Requested: {failed[1]}"
+                )
+            if not updated_order:
+                # Un-cancelled concurrently in between
+                updated_order = set_status(not_cancelled)
+    
+    if not updated_order:
+        if orders_collection.find_one({"_id": ObjectId(order_id)}, {"_id": 1}):
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Order was cancelled concurrently, retry"
+            )
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Order not found"
         )
     
-    # Update order status
-    orders_collection.update_one(
-        {"_id": ObjectId(order_id)},
-        {"$set": {"status": status_update.status, "updated_at": datetime.utcnow()}}
-    )
-    
-    updated_order = orders_collection.find_one({"_id": ObjectId(order_id)})
+    # Keep the sales counters and customer aggregates in line with the status (each claimed once)
+    if status_update.status == "cancelled" and not updated_order.get("sales_reversed"):
+        reversed_order = reverse_order_sales(order_id)
+        if reversed_order:
+            remove_customer_order(reversed_order)
+    elif status_update.status != "cancelled" and updated_order.get("sales_reversed"):
+        reinstated_order = reinstate_order_sales(order_id)
+        if reinstated_order:
+            reinstate_customer_order(reinstated_order)
     
     return OrderResponse(
         id=str(updated_order["_id"]),
@@ -215,34 +456,25 @@ async def delete_order(
         )
     
     orders_collection = get_orders_collection()
-    products_collection = get_products_collection()
     
-    # Get order details before deletion
-    order = orders_collection.find_one({"_id": ObjectId(order_id)})
-    if not order:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Order not found"
-        )
-    
-    # Restore stock quantities if order is being cancelled
-    if order["status"] in ["pending", "confirmed"]:
-        for item in order["items"]:
-            product = products_collection.find_one({"_id": ObjectId(item["product_id"])})
-            if product:
-                new_stock = product["stock_quantity"] + item["quantity"]
-                products_collection.update_one(
-                    {"_id": ObjectId(item["product_id"])},
-                    {"$set": {"stock_quantity": new_stock, "updated_at": datetime.utcnow()}}
-                )
+    # Restore stock quantities if the order still holds them (claimed at most once)
+    release_order_stock(order_id)
     
-    # Delete the order
-    result = orders_collection.delete_one({"_id": ObjectId(order_id)})
+    # Delete the order (archived orders can be deleted too)
+    deleted_order = orders_collection.find_one_and_delete({"_id": ObjectId(order_id)})
+    if not deleted_order:
+        deleted_order = get_orders_archive_collection().find_one_and_delete({"_id": ObjectId(order_id)})
     
-    if result.deleted_count == 0:
+    if not deleted_order:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Order not found"
         )
     
+    # Only the request that actually deleted the order gets here
+    reverse_deleted_order_sales(deleted_order)
+    if not deleted_order.get("sales_reversed"):
+        remove_customer_order(deleted_order)
+    record_tombstones(ORDER, [deleted_order["_id"]])
+    
     return {"message": "Order deleted successfully"}
\ No newline at end of file
@@ -1,13 +1,30 @@
 from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile
 from typing import List
 from bson import ObjectId
-from datetime import datetime
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timezone
+from typing import Optional
+import logging
 import os
 import uuid
-from app.database import get_products_collection
+from app.database import get_products_collection, get_stock_shards_collection, run_in_transaction
 from app.models import Product, User
-from app.schemas import ProductCreate, ProductUpdate, ProductResponse
+from app.schemas import (
+    ProductCreate, ProductUpdate, ProductResponse, StockReceipt, StockMovementResponse, StockLevelResponse,
+    StockShardsUpdate, StockShardsResponse, ProductChangesResponse
+)
 from app.auth import get_current_active_user
+from app.stock import receive_stock, update_product_fields
+from app.stock_ledger import record_movements, stock_at, list_movements, RECEIPT
+from app.stock_shards import (
+    with_shard_total, with_shard_totals, set_shard_count, rebalance, shard_levels, shard_totals_changed_since,
+    MAX_STOCK_SHARDS
+)
+from app.change_feed import changes_since, record_tombstones, PRODUCT
+from app.field_selection import parse_fields, select, partial_response, projection as field_projection
+from app import product_cache
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/products", tags=["products"])
 
@@ -19,19 +36,25 @@ async def create_product(
     try:
         products_collection = get_products_collection()
         
-        # Check if SKU already exists
-        if products_collection.find_one({"sku": product.sku}):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Product with this SKU already exists"
-            )
-        
         product_data = product.dict()
         product_data["created_at"] = datetime.utcnow()
         product_data["updated_at"] = datetime.utcnow()
         
-        result = products_collection.insert_one(product_data)
-        created_product = products_collection.find_one({"_id": result.inserted_id})
+        def insert(session):
+            products_collection.insert_one(product_data, session=session)
+            # The opening stock is the product's first ledger entry
+            record_movements([(product_data["_id"], product_data["stock_quantity"])], RECEIPT, current_user.username, session)
+        
+        # The unique index on sku rejects duplicates
+        try:
+            run_in_transaction(insert)
+        except DuplicateKeyError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Product with this SKU already exists"
+            )
+        # insert_one sets _id on the document, so no re-read is needed
+        created_product = product_data
         
         # Ensure all fields are properly formatted
         response_data = {
@@ -52,52 +75,78 @@ async def create_product(
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error creating product: {e}")
+        logger.exception(f"Error creating product: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to create product: {str(e)}"
         )
 
+def _product_data(product: dict) -> dict:
+    # Ensure all required fields exist with defaults
+    return {
+        "id": str(product["_id"]),
+        "name": product.get("name", ""),
+        "description": product.get("description"),
+        "price": float(product.get("price", 0)),
+        "stock_quantity": int(product.get("stock_quantity", 0)),
+        "category": product.get("category"),
+        "sku": product.get("sku", ""),
+        "image_url": product.get("image_url"),
+        "low_stock_threshold": int(product.get("low_stock_threshold", 10)),
+        "created_at": product.get("created_at", datetime.utcnow()),
+        "updated_at": product.get("updated_at", datetime.utcnow())
+    }
+
 @router.get("/", response_model=List[ProductResponse])
 async def get_products(
     skip: int = 0,
     limit: int = 100,
+    fields: Optional[str] = None,
     current_user: User = Depends(get_current_active_user)
 ):
+    # ?fields=name,price,... reads and returns only those fields (plus id)
+    names = parse_fields(fields, ProductResponse)
     try:
         products_collection = get_products_collection()
-        products = list(products_collection.find().skip(skip).limit(limit))
+        # Sharded stock is summed from the shards, which needs stock_shards
+        projection = None
+        if names:
+            projection = field_projection(names, *(["stock_shards"] if "stock_quantity" in names else []))
+        products = with_shard_totals(list(products_collection.find({}, projection).skip(skip).limit(limit)))
         
         result = []
         for product in products:
             try:
-                # Ensure all required fields exist with defaults
-                product_data = {
-                    "id": str(product["_id"]),
-                    "name": product.get("name", ""),
-                    "description": product.get("description"),
-                    "price": float(product.get("price", 0)),
-                    "stock_quantity": int(product.get("stock_quantity", 0)),
-                    "category": product.get("category"),
-                    "sku": product.get("sku", ""),
-                    "image_url": product.get("image_url"),
-                    "low_stock_threshold": int(product.get("low_stock_threshold", 10)),
-                    "created_at": product.get("created_at", datetime.utcnow()),
-                    "updated_at": product.get("updated_at", datetime.utcnow())
-                }
-                result.append(ProductResponse(**product_data))
+                product_data = _product_data(product)
+                result.append(select(product_data, names) if names else ProductResponse(**product_data))
             except Exception as e:
-                print(f"Error processing product {product.get('_id')}: {e}")
+                logger.warning(f"Error processing product {product.get('_id')}: {e}", extra={"product_id": str(product.get("_id"))})
                 continue
         
-        return result
+        return partial_response(result) if names else result
     except Exception as e:
-        print(f"Error in get_products: {e}")
+        logger.exception(f"Error in get_products: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to retrieve products: {str(e)}"
         )
 
+@router.get("/changes", response_model=ProductChangesResponse)
+async def get_product_changes(
+    since: Optional[str] = None,
+    limit: int = 500,
+    current_user: User = Depends(get_current_active_user)
+):
+    page = changes_since(PRODUCT, get_products_collection(), since, limit)
+    stock = shard_totals_changed_since(page["since"])
+    return ProductChangesResponse(
+        changes=[ProductResponse(**_product_data(product)) for product in with_shard_totals(page["changes"])],
+        deleted=page["deleted"],
+        stock=[{"id": product_id, "stock_quantity": quantity} for product_id, quantity in stock.items()],
+        cursor=page["cursor"],
+        has_more=page["has_more"]
+    )
+
 @router.get("/{product_id}", response_model=ProductResponse)
 async def get_product(
     product_id: str,
@@ -109,8 +158,8 @@ async def get_product(
             detail="Invalid product ID"
         )
     
-    products_collection = get_products_collection()
-    product = products_collection.find_one({"_id": ObjectId(product_id)})
+    # Cached fields, stock read fresh
+    product = product_cache.get_product(product_id)
     
     if not product:
         raise HTTPException(
@@ -137,31 +186,160 @@ async def update_product(
     
     products_collection = get_products_collection()
     
-    # Check if product exists
-    existing_product = products_collection.find_one({"_id": ObjectId(product_id)})
-    if not existing_product:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Product not found"
-        )
-    
     # Prepare update data
     update_data = {k: v for k, v in product_update.dict().items() if v is not None}
     if update_data:
         update_data["updated_at"] = datetime.utcnow()
         
-        products_collection.update_one(
-            {"_id": ObjectId(product_id)},
-            {"$set": update_data}
-        )
+        # Update and read back in one round trip; stock changes go to the ledger
+        updated_product = update_product_fields(product_id, update_data, current_user.username)
+        product_cache.invalidate(product_id)
+    else:
+        updated_product = with_shard_total(products_collection.find_one({"_id": ObjectId(product_id)}))
     
-    updated_product = products_collection.find_one({"_id": ObjectId(product_id)})
+    if not updated_product:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Product not found"
+        )
     
     return ProductResponse(
         id=str(updated_product["_id"]),
         **{k: v for k, v in updated_product.items() if k != "_id"}
     )
 
+@router.post("/{product_id}/receive", response_model=ProductResponse)
+async def receive_product_stock(
+    product_id: str,
+    receipt: StockReceipt,
+    current_user: User = Depends(get_current_active_user)
+):
+    if not ObjectId.is_valid(product_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid product ID"
+        )
+    if receipt.quantity <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Quantity must be positive"
+        )
+    
+    product = receive_stock(product_id, receipt.quantity, current_user.username)
+    if not product:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Product not found"
+        )
+    
+    return ProductResponse(
+        id=str(product["_id"]),
+        **{k: v for k, v in product.items() if k != "_id"}
+    )
+
+@router.get("/{product_id}/movements", response_model=List[StockMovementResponse])
+async def get_stock_movements(
+    product_id: str,
+    limit: int = 100,
+    current_user: User = Depends(get_current_active_user)
+):
+    if not ObjectId.is_valid(product_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid product ID"
+        )
+    
+    return [
+        StockMovementResponse(
+            id=str(movement["_id"]),
+            **{k: v for k, v in movement.items() if k != "_id"}
+        )
+        for movement in list_movements(product_id, limit)
+    ]
+
+@router.get("/{product_id}/stock-history", response_model=StockLevelResponse)
+async def get_stock_history(
+    product_id: str,
+    at: Optional[datetime] = None,
+    current_user: User = Depends(get_current_active_user)
+):
+    """Stock level of a product at a point in time (UTC), from the ledger"""
+    if not ObjectId.is_valid(product_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid product ID"
+        )
+    
+    if at is None:
+        at = datetime.utcnow()
+    elif at.tzinfo is not None:
+        at = at.astimezone(timezone.utc).replace(tzinfo=None)
+    return StockLevelResponse(product_id=product_id, at=at, stock_quantity=stock_at(product_id, at))
+
+def _stock_shards_response(product_id: str, levels) -> StockShardsResponse:
+    if levels is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Product not found"
+        )
+    if not levels:
+        # Not sharded: the product document holds the stock
+        product = get_products_collection().find_one({"_id": ObjectId(product_id)}, {"stock_quantity": 1})
+        return StockShardsResponse(product_id=product_id, stock_quantity=product.get("stock_quantity", 0), shards=[])
+    return StockShardsResponse(product_id=product_id, stock_quantity=sum(levels), shards=levels)
+
+@router.get("/{product_id}/stock-shards", response_model=StockShardsResponse)
+async def get_stock_shards(
+    product_id: str,
+    current_user: User = Depends(get_current_active_user)
+):
+    if not ObjectId.is_valid(product_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid product ID"
+        )
+    
+    if not get_products_collection().find_one({"_id": ObjectId(product_id)}, {"_id": 1}):
+        return _stock_shards_response(product_id, None)
+    return _stock_shards_response(product_id, shard_levels(product_id))
+
+@router.put("/{product_id}/stock-shards", response_model=StockShardsResponse)
+async def update_stock_shards(
+    product_id: str,
+    shards_update: StockShardsUpdate,
+    current_user: User = Depends(get_current_active_user)
+):
+    """Split a hot product's stock over several counters (1 turns sharding off)"""
+    if current_user.role not in ["admin", "manager"]:
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
+    if not ObjectId.is_valid(product_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid product ID"
+        )
+    if not 1 <= shards_update.shards <= MAX_STOCK_SHARDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Shards must be between 1 and {MAX_STOCK_SHARDS}"
+        )
+    
+    return _stock_shards_response(product_id, set_shard_count(product_id, shards_update.shards))
+
+@router.post("/{product_id}/stock-shards/rebalance", response_model=StockShardsResponse)
+async def rebalance_stock_shards(
+    product_id: str,
+    current_user: User = Depends(get_current_active_user)
+):
+    if current_user.role not in ["admin", "manager"]:
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
+    if not ObjectId.is_valid(product_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid product ID"
+        )
+    
+    return _stock_shards_response(product_id, rebalance(product_id))
+
 @router.delete("/{product_id}")
 async def delete_product(
     product_id: str,
@@ -181,6 +359,9 @@ async def delete_product(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Product not found"
         )
+    get_stock_shards_collection().delete_many({"product_id": product_id})
+    product_cache.invalidate(product_id)
+    record_tombstones(PRODUCT, [product_id])
     
     return {"message": "Product deleted successfully"}
 
@@ -233,6 +414,7 @@ async def upload_product_image(
             {"_id": ObjectId(product_id)},
             {"$set": {"image_url": image_url, "updated_at": datetime.utcnow()}}
         )
+        product_cache.invalidate(product_id)
         
         return {"message": "Image uploaded successfully", "image_url": image_url}
     
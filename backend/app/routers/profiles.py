@@ -0,0 +1,56 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from typing import List
+from bson import ObjectId
+from app.database import get_profiles_collection
+from app.models import User
+from app.schemas import ProfileSummary
+from app.auth import get_current_active_user
+
+router = APIRouter(prefix="/profiles", tags=["profiles"])
+
+@router.get("/", response_model=List[ProfileSummary])
+async def list_profiles(
+    limit: int = 50,
+    current_user: User = Depends(get_current_active_user)
+):
+    """Recent request profiles (see app/profiling.py), newest first"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can view profiles")
+    
+    profiles = get_profiles_collection().find(
+        {}, {"method": 1, "path": 1, "query": 1, "status": 1, "request_id": 1, "profiled_by": 1,
+             "duration_ms": 1, "mongo.commands": 1, "mongo.total_ms": 1, "profile.mode": 1, "created_at": 1}
+    ).sort("created_at", -1).limit(min(limit, 500))
+    return [
+        ProfileSummary(
+            id=str(profile["_id"]),
+            mode=profile["profile"]["mode"],
+            mongo_commands=profile["mongo"]["commands"],
+            mongo_ms=profile["mongo"]["total_ms"],
+            **{k: v for k, v in profile.items() if k not in ("_id", "profile", "mongo")}
+        )
+        for profile in profiles
+    ]
+
+@router.get("/{profile_id}")
+async def get_profile(
+    profile_id: str,
+    current_user: User = Depends(get_current_active_user)
+):
+    """The full report: Mongo command timings and the profiler output"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can view profiles")
+    if not ObjectId.is_valid(profile_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid profile ID"
+        )
+    
+    profile = get_profiles_collection().find_one({"_id": ObjectId(profile_id)})
+    if not profile:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Profile not found"
+        )
+    profile["id"] = str(profile.pop("_id"))
+    return profile
@@ -1,9 +1,18 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional
+from bson import ObjectId
 from datetime import datetime, timedelta
-from app.database import get_products_collection, get_orders_collection
+from app.database import get_products_collection, get_orders_collection, get_orders_archive_collection
+from app.archive import needs_archive, iter_orders_all_tiers
+from app.sales_counters import top_products as top_selling_products
+from app.forecasting import stockout_report
+from app.stock_shards import with_shard_totals
+from app.field_selection import projection as field_projection
+from app.line_item_store import revenue_breakdown
 from app.models import User
-from app.schemas import SalesAnalytics, InventoryAnalytics, ReportResponse
+from app.schemas import SalesAnalytics, InventoryAnalytics, ReportResponse, ReportJobCreate, ForecastReport
+from app.report_jobs import register_report, submit_report, get_report, ReportJobError
 from app.auth import get_current_active_user
 
 router = APIRouter(prefix="/reports", tags=["reports"])
@@ -15,62 +24,50 @@ def check_permission(user: User, permission: str):
         return True
     return permission in user.permissions
 
-@router.get("/sales", response_model=SalesAnalytics)
-async def get_sales_analytics(
-    days: int = 30,
-    current_user: User = Depends(get_current_active_user)
-):
-    if not check_permission(current_user, "view_reports"):
-        raise HTTPException(status_code=403, detail="Insufficient permissions")
-    
-    orders_collection = get_orders_collection()
+@register_report("sales", {"days": 30})
+def compute_sales_analytics(days: int = 30) -> dict:
+    # Analytics reads may be served by a secondary
+    orders_collection = get_orders_collection(analytics=True)
     
     # Get orders from last N days
     start_date = datetime.utcnow() - timedelta(days=days)
-    orders = list(orders_collection.find({
+    query = {
         "created_at": {"$gte": start_date},
         "status": {"$ne": "cancelled"}
-    }))
+    }
+    # Only the totals are needed from the orders themselves
+    projection = {"total_amount": 1}
+    # Windows reaching past the archive cutoff include archived orders
+    if needs_archive(start_date):
+        orders = iter_orders_all_tiers(query, projection, analytics=True)
+    else:
+        orders = orders_collection.find(query, projection)
     
-    total_sales = sum(order["total_amount"] for order in orders)
-    total_orders = len(orders)
-    
-    # Top products
-    product_sales = {}
+    total_sales = 0
+    total_orders = 0
     for order in orders:
-        for item in order["items"]:
-            product_name = item["product_name"]
-            if product_name in product_sales:
-                product_sales[product_name] += item["total"]
-            else:
-                product_sales[product_name] = item["total"]
-    
-    top_products = [
-        {"name": name, "sales": sales}
-        for name, sales in sorted(product_sales.items(), key=lambda x: x[1], reverse=True)[:5]
-    ]
+        total_sales += order["total_amount"]
+        total_orders += 1
+    
+    # Top products by product_id, from the incrementally maintained counters
+    top_products = top_selling_products(limit=5, days=days)
     
     # Sales by month (simplified)
     sales_by_month = [
         {"month": "Current Month", "sales": total_sales}
     ]
     
-    return SalesAnalytics(
-        total_sales=total_sales,
-        total_orders=total_orders,
-        top_products=top_products,
-        sales_by_month=sales_by_month
-    )
+    return {
+        "total_sales": total_sales,
+        "total_orders": total_orders,
+        "top_products": top_products,
+        "sales_by_month": sales_by_month
+    }
 
-@router.get("/inventory", response_model=InventoryAnalytics)
-async def get_inventory_analytics(
-    current_user: User = Depends(get_current_active_user)
-):
-    if not check_permission(current_user, "view_reports"):
-        raise HTTPException(status_code=403, detail="Insufficient permissions")
-    
-    products_collection = get_products_collection()
-    products = list(products_collection.find())
+@register_report("inventory", {})
+def compute_inventory_analytics() -> dict:
+    products_collection = get_products_collection(analytics=True)
+    products = with_shard_totals(list(products_collection.find()))
     
     total_products = len(products)
     low_stock_products = []
@@ -93,37 +90,215 @@ async def get_inventory_analytics(
                 "threshold": product.get("low_stock_threshold", 10)
             })
     
-    return InventoryAnalytics(
-        total_products=total_products,
-        low_stock_products=low_stock_products,
-        out_of_stock_products=out_of_stock_products,
-        total_inventory_value=total_inventory_value
+    return {
+        "total_products": total_products,
+        "low_stock_products": low_stock_products,
+        "out_of_stock_products": out_of_stock_products,
+        "total_inventory_value": total_inventory_value
+    }
+
+def validate_forecast_params(params: dict):
+    if (not 1 <= params["days"] <= 3650 or params["window"] < 1 or not 0 < params["alpha"] <= 1
+            or params["lead_time_days"] < 0 or params["review_days"] < 0):
+        raise ReportJobError("days must be 1-3650, window >= 1, 0 < alpha <= 1 and lead/review days >= 0")
+
+register_report(
+    "forecast",
+    {"days": 90, "window": 28, "alpha": 0.3, "lead_time_days": 7.0, "review_days": 14.0, "limit": 100},
+    validate_forecast_params
+)(stockout_report)
+
+@router.get("/sales", response_model=SalesAnalytics)
+async def get_sales_analytics(
+    days: int = 30,
+    current_user: User = Depends(get_current_active_user)
+):
+    if not check_permission(current_user, "view_reports"):
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
+    
+    return SalesAnalytics(**compute_sales_analytics(days))
+
+@router.get("/inventory", response_model=InventoryAnalytics)
+async def get_inventory_analytics(
+    current_user: User = Depends(get_current_active_user)
+):
+    if not check_permission(current_user, "view_reports"):
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
+    
+    return InventoryAnalytics(**compute_inventory_analytics())
+
+@router.get("/forecast", response_model=ForecastReport)
+async def get_demand_forecast(
+    days: int = 90,
+    window: int = 28,
+    alpha: float = 0.3,
+    lead_time_days: float = 7,
+    review_days: float = 14,
+    limit: int = 100,
+    current_user: User = Depends(get_current_active_user)
+):
+    """Demand forecast, days until stockout and reorder suggestions for every product"""
+    if not check_permission(current_user, "view_reports"):
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
+    
+    params = {
+        "days": days, "window": window, "alpha": alpha,
+        "lead_time_days": lead_time_days, "review_days": review_days, "limit": limit
+    }
+    try:
+        validate_forecast_params(params)
+    except ReportJobError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    # The batched NumPy computation is CPU-bound; keep it off the event loop
+    return await run_in_threadpool(stockout_report, **params)
+
+@router.get("/line-items/revenue")
+async def get_line_item_revenue(
+    group_by: str = "product",
+    days: Optional[int] = None,
+    include_cancelled: bool = False,
+    limit: int = 50,
+    current_user: User = Depends(get_current_active_user)
+):
+    """Full-history revenue breakdown from the local columnar line item store (no MongoDB scan)"""
+    if not check_permission(current_user, "view_reports"):
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
+    
+    if group_by not in ("product", "month", "status"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="group_by must be one of: product, month, status"
+        )
+    
+    start = datetime.utcnow() - timedelta(days=days) if days else None
+    groups = revenue_breakdown(group_by, start=start, include_cancelled=include_cancelled, limit=limit)
+    if groups is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Line item store has not been built yet"
+        )
+    
+    if group_by == "product":
+        ids = [ObjectId(group["key"]) for group in groups if ObjectId.is_valid(group["key"])]
+        names = {
+            str(product["_id"]): product["name"]
+            for product in get_products_collection(analytics=True).find({"_id": {"$in": ids}}, {"name": 1})
+        }
+        for group in groups:
+            group["name"] = names.get(group["key"])
+    
+    return {"group_by": group_by, "groups": groups}
+
+def report_response(report: dict) -> ReportResponse:
+    return ReportResponse(
+        id=str(report["_id"]),
+        **{k: v for k, v in report.items() if k in ReportResponse.model_fields and k != "id"}
     )
 
+@router.post("/jobs", response_model=ReportResponse, status_code=status.HTTP_202_ACCEPTED)
+async def submit_report_job(
+    job: ReportJobCreate,
+    current_user: User = Depends(get_current_active_user)
+):
+    """Start generating a report in the background (or reuse a fresh/in-flight identical one)"""
+    if not check_permission(current_user, "view_reports"):
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
+    
+    try:
+        report = submit_report(job.report_type, job.params, current_user.username)
+    except ReportJobError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    # Poll the job without its (possibly large) result
+    report = {**report, "data": None}
+    return report_response(report)
+
+def _get_job(report_id: str) -> dict:
+    if not ObjectId.is_valid(report_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid report ID"
+        )
+    report = get_report(report_id)
+    if not report:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Report not found"
+        )
+    return report
+
+@router.get("/jobs/{report_id}", response_model=ReportResponse)
+async def get_report_job(
+    report_id: str,
+    current_user: User = Depends(get_current_active_user)
+):
+    """Job status (without the result)"""
+    if not check_permission(current_user, "view_reports"):
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
+    
+    report = _get_job(report_id)
+    report["data"] = None
+    return report_response(report)
+
+@router.get("/jobs/{report_id}/result", response_model=ReportResponse)
+async def get_report_result(
+    report_id: str,
+    current_user: User = Depends(get_current_active_user)
+):
+    if not check_permission(current_user, "view_reports"):
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
+    
+    report = _get_job(report_id)
+    if report["status"] != "completed":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Report is {report['status']}" + (f": {report['error']}" if report.get("error") else "")
+        )
+    return report_response(report)
+
+# The columns the dashboard widgets show (?summary=true)
+RECENT_ORDER_FIELDS = ["order_number", "customer_name", "total_amount", "status", "created_at"]
+LOW_STOCK_FIELDS = ["name", "sku", "stock_quantity", "low_stock_threshold"]
+
 @router.get("/dashboard-stats")
 async def get_dashboard_stats(
+    summary: bool = False,
     current_user: User = Depends(get_current_active_user)
 ):
     if not check_permission(current_user, "view_reports"):
         raise HTTPException(status_code=403, detail="Insufficient permissions")
     
+    # The dashboard shows just-created orders, so it stays on the primary
     products_collection = get_products_collection()
     orders_collection = get_orders_collection()
     
-    # Get basic stats
-    total_products = products_collection.count_documents({})
-    total_orders = orders_collection.count_documents({})
+    # Get basic stats (collection totals come from metadata, not a scan;
+    # archiving keeps every order in exactly one tier, so the tiers add up)
+    total_products = products_collection.estimated_document_count()
+    total_orders = orders_collection.estimated_document_count() + get_orders_archive_collection().estimated_document_count()
     pending_orders = orders_collection.count_documents({"status": "pending"})
     
+    order_projection = field_projection(RECENT_ORDER_FIELDS) if summary else None
+    product_projection = field_projection(LOW_STOCK_FIELDS, "stock_shards") if summary else None
+    
     # Recent orders
-    recent_orders = list(orders_collection.find().sort("created_at", -1).limit(5))
+    recent_orders = list(orders_collection.find({}, order_projection).sort("created_at", -1).limit(5))
     for order in recent_orders:
         order["_id"] = str(order["_id"])
     
-    # Low stock alerts
+    # Low stock alerts (the stored stock of sharded products is only synced
+    # on rebalance, so they are checked against their live total)
     low_stock_products = list(products_collection.find({
-        "$expr": {"$lte": ["$stock_quantity", "$low_stock_threshold"]}
-    }).limit(5))
+        "$expr": {"$lte": ["$stock_quantity", "$low_stock_threshold"]},
+        "stock_shards": {"$exists": False}
+    }, product_projection).limit(5))
+    sharded = with_shard_totals(list(products_collection.find({"stock_shards": {"$exists": True}}, product_projection)))
+    low_stock_products += [
+        product for product in sharded
+        if product["stock_quantity"] <= product.get("low_stock_threshold", 10)
+    ]
+    low_stock_products = low_stock_products[:5]
     
     for product in low_stock_products:
         product["_id"] = str(product["_id"])
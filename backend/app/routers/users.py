@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from typing import List
+from pymongo.errors import DuplicateKeyError
 from app.database import get_users_collection
 from app.models import User
 from app.schemas import UserCreate
@@ -17,10 +18,6 @@ async def create_user(
     
     users_collection = get_users_collection()
     
-    # Check if username exists
-    if users_collection.find_one({"username": user_data.username}):
-        raise HTTPException(status_code=400, detail="Username already exists")
-    
     # Set permissions based on role
     permissions = []
     if user_data.role == "manager":
@@ -40,9 +37,15 @@ async def create_user(
     if "_id" in user_dict and user_dict["_id"] is None:
         del user_dict["_id"]
     
-    result = users_collection.insert_one(user_dict)
-    created_user = users_collection.find_one({"_id": result.inserted_id})
-    created_user["_id"] = str(created_user["_id"])
+    # The unique index on username rejects duplicates
+    try:
+        result = users_collection.insert_one(user_dict)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Username already exists")
+    
+    # Build the response from the inserted document instead of re-reading it
+    created_user = dict(user_dict)
+    created_user["_id"] = str(result.inserted_id)
     
     # Remove password from response
     del created_user["hashed_password"]
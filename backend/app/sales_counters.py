@@ -0,0 +1,275 @@
+"""
+Incrementally maintained per-product sales counters.
+
+Placing an order $incs, per product_id:
+
+* product_sales: lifetime units/revenue plus one units/revenue pair per
+  rolling window in SALES_COUNTER_WINDOWS (windows.<days>.units|revenue)
+* product_sales_daily: a units/revenue bucket per product and UTC day
+
+Cancelling or deleting an order applies the same increments negated, at most
+once per order (claimed with the order's `sales_reversed` flag, or by the
+delete itself). Un-cancelling an order counts it again.
+
+Window counters cover the last <days> UTC days including today. A daily
+leader-only job subtracts the bucket that just fell out of each window, so
+top-N for a window is an indexed sort + limit. Any other range is summed
+from the daily buckets.
+
+    python -m app.sales_counters rebuild   # recompute everything from the orders
+    python -m app.sales_counters expire    # age the window counters (normally scheduled)
+"""
+import argparse
+import logging
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import UpdateOne, ReturnDocument
+from app.database import (
+    get_database, get_orders_collection, get_orders_archive_collection, get_products_collection, get_product_sales_collection,
+    get_product_sales_daily_collection, SALES_COUNTER_WINDOWS
+)
+from app.archive import iter_orders_all_tiers
+
+logger = logging.getLogger(__name__)
+
+WINDOW_STATE_ID = "windows"
+REBUILD_BATCH_SIZE = 1000
+
+def _day(moment: datetime) -> datetime:
+    return datetime(moment.year, moment.month, moment.day)
+
+def _state_collection():
+    return get_database().sales_counter_state
+
+def _window_day() -> datetime:
+    """Last day the window counters have been aged to"""
+    state = _state_collection().find_one({"_id": WINDOW_STATE_ID})
+    return state["day"] if state else _day(datetime.utcnow())
+
+def _item_totals(order: dict) -> dict:
+    totals = {}
+    for item in order["items"]:
+        units, revenue, _name = totals.get(item["product_id"], (0, 0.0, None))
+        totals[item["product_id"]] = (units + item["quantity"], revenue + item["total"], item["product_name"])
+    return totals
+
+def _apply(order: dict, sign: int, session=None, window_day: datetime = None):
+    """$inc (sign=1) or $dec (sign=-1) every counter the order contributes to"""
+    _apply_many([order], sign, session, window_day)
+
+def _apply_many(orders: list, sign: int, session=None, window_day: datetime = None):
+    """Counter updates for several orders, merged into one bulk write per collection"""
+    lifetime = {}
+    daily = {}
+    names = {}
+    for order in orders:
+        order_day = _day(order["created_at"])
+        # Windows ending at window_day (default: the order's day) that still contain the order's day
+        windows = [
+            days for days in SALES_COUNTER_WINDOWS
+            if order_day > (window_day or order_day) - timedelta(days=days)
+        ]
+        for product_id, (units, revenue, name) in _item_totals(order).items():
+            fields = [("units", units), ("revenue", revenue)]
+            for days in windows:
+                fields += [(f"windows.{days}.units", units), (f"windows.{days}.revenue", revenue)]
+            increments = lifetime.setdefault(product_id, {})
+            for field, value in fields:
+                increments[field] = increments.get(field, 0) + sign * value
+            bucket = daily.setdefault((product_id, order_day), {"units": 0, "revenue": 0})
+            bucket["units"] += sign * units
+            bucket["revenue"] += sign * revenue
+            names[product_id] = name
+
+    now = datetime.utcnow()
+    lifetime_operations = []
+    for product_id, increments in lifetime.items():
+        fields = {"updated_at": now}
+        if sign > 0:
+            fields["product_name"] = names[product_id]
+        lifetime_operations.append(
+            UpdateOne({"_id": product_id}, {"$inc": increments, "$set": fields}, upsert=True)
+        )
+    daily_operations = [
+        UpdateOne({"product_id": product_id, "day": day}, {"$inc": increments}, upsert=True)
+        for (product_id, day), increments in daily.items()
+    ]
+    if lifetime_operations:
+        get_product_sales_collection().bulk_write(lifetime_operations, ordered=False, session=session)
+        get_product_sales_daily_collection().bulk_write(daily_operations, ordered=False, session=session)
+
+def record_order_sales(order: dict, session=None):
+    """Count a newly placed order (its day is today, so it is in every window)"""
+    _apply(order, 1, session)
+
+def record_orders_sales(orders: list, session=None):
+    """Count a batch of newly placed orders in one write per collection"""
+    _apply_many(orders, 1, session)
+
+def reverse_order_sales(order_id: str):
+    """Take a cancelled order out of the counters, at most once"""
+    # Only while it is still cancelled: an un-cancel that landed first has
+    # already skipped reinstating it
+    order = get_orders_collection().find_one_and_update(
+        {"_id": ObjectId(order_id), "sales_reversed": {"$ne": True}, "status": "cancelled"},
+        {"$set": {"sales_reversed": True}},
+        return_document=ReturnDocument.AFTER
+    )
+    if order:
+        _apply(order, -1, window_day=_window_day())
+    return order
+
+def reinstate_order_sales(order_id: str):
+    """Count an order again after it was moved out of cancelled, at most once"""
+    order = get_orders_collection().find_one_and_update(
+        {"_id": ObjectId(order_id), "sales_reversed": True, "status": {"$ne": "cancelled"}},
+        {"$set": {"sales_reversed": False}},
+        return_document=ReturnDocument.AFTER
+    )
+    if order:
+        _apply(order, 1, window_day=_window_day())
+    return order
+
+def reverse_deleted_order_sales(order: dict):
+    """Take a deleted order out of the counters (the delete itself happens once)"""
+    if not order.get("sales_reversed"):
+        _apply(order, -1, window_day=_window_day())
+
+def expire_windows(today: datetime = None) -> int:
+    """
+    Age the window counters to today: for every day since the last run,
+    subtract the daily buckets that dropped out of each window. Returns the
+    number of days processed.
+    """
+    today = _day(today or datetime.utcnow())
+    state_collection = _state_collection()
+    state = state_collection.find_one({"_id": WINDOW_STATE_ID})
+    if not state:
+        # Counters not initialized yet (see initialize)
+        return 0
+
+    daily_collection = get_product_sales_daily_collection()
+    sales_collection = get_product_sales_collection()
+    day = state["day"]
+    processed = 0
+    while day < today:
+        day += timedelta(days=1)
+        for days in SALES_COUNTER_WINDOWS:
+            expired_day = day - timedelta(days=days)
+            operations = [
+                UpdateOne(
+                    {"_id": bucket["product_id"]},
+                    {"$inc": {
+                        f"windows.{days}.units": -bucket["units"],
+                        f"windows.{days}.revenue": -bucket["revenue"]
+                    }}
+                )
+                for bucket in daily_collection.find({"day": expired_day})
+                if bucket["units"] or bucket["revenue"]
+            ]
+            if operations:
+                sales_collection.bulk_write(operations, ordered=False)
+        # Progress is saved per day so an interrupted run never subtracts twice
+        state_collection.update_one({"_id": WINDOW_STATE_ID}, {"$set": {"day": day}})
+        processed += 1
+    if processed:
+        logger.info(f"Sales window counters aged to {today.date()} ({processed} day(s))")
+    return processed
+
+def rebuild(now: datetime = None) -> int:
+    """
+    Recompute all counters from the live and archived orders; returns the
+    number of orders counted. Orders placed while this runs may be counted
+    twice, so run it when order intake is quiet.
+    """
+    today = _day(now or datetime.utcnow())
+    sales_collection = get_product_sales_collection()
+    daily_collection = get_product_sales_daily_collection()
+    sales_collection.delete_many({})
+    daily_collection.delete_many({})
+    _state_collection().update_one({"_id": WINDOW_STATE_ID}, {"$set": {"day": today}}, upsert=True)
+    
+    # Cancelled orders are not counted; flag them so a later delete or
+    # un-cancel adjusts the counters correctly
+    for collection in (get_orders_collection(), get_orders_archive_collection()):
+        collection.update_many({"status": "cancelled"}, {"$set": {"sales_reversed": True}})
+
+    counted = 0
+    batch = []
+    query = {"status": {"$ne": "cancelled"}, "sales_reversed": {"$ne": True}}
+    for order in iter_orders_all_tiers(query, projection={"items": 1, "created_at": 1}):
+        batch.append(order)
+        if len(batch) >= REBUILD_BATCH_SIZE:
+            _apply_many(batch, 1, window_day=today)
+            counted += len(batch)
+            batch = []
+    if batch:
+        _apply_many(batch, 1, window_day=today)
+        counted += len(batch)
+    return counted
+
+def initialize() -> int:
+    """Build the counters from the existing orders the first time the application runs"""
+    if _state_collection().find_one({"_id": WINDOW_STATE_ID}):
+        return 0
+    return rebuild()
+
+def _with_names(rows: list) -> list:
+    """Current product names (renames apply retroactively), falling back to the last name sold"""
+    ids = [ObjectId(row["_id"]) for row in rows if ObjectId.is_valid(row["_id"])]
+    names = {
+        str(product["_id"]): product["name"]
+        for product in get_products_collection(analytics=True).find({"_id": {"$in": ids}}, {"name": 1})
+    }
+    return [
+        {
+            "product_id": row["_id"],
+            "name": names.get(row["_id"], row.get("product_name")),
+            "units": row["units"],
+            "sales": row["revenue"]
+        }
+        for row in rows
+    ]
+
+def top_products(limit: int = 5, days: int = None) -> list:
+    """
+    Best-selling products by revenue, lifetime (days=None) or over the last
+    `days` days. Lifetime and configured windows are an indexed sort;
+    other ranges are summed from the daily buckets.
+    """
+    sales_collection = get_product_sales_collection(analytics=True)
+    if days is None:
+        rows = list(sales_collection.find({"units": {"$gt": 0}}).sort("revenue", -1).limit(limit))
+    elif days in SALES_COUNTER_WINDOWS:
+        field = f"windows.{days}"
+        rows = [
+            {"_id": row["_id"], "product_name": row.get("product_name"), **row["windows"][str(days)]}
+            for row in sales_collection
+            .find({f"{field}.units": {"$gt": 0}}, {"product_name": 1, field: 1})
+            .sort(f"{field}.revenue", -1)
+            .limit(limit)
+        ]
+    else:
+        start_day = _day(datetime.utcnow()) - timedelta(days=days - 1)
+        rows = list(get_product_sales_daily_collection(analytics=True).aggregate([
+            {"$match": {"day": {"$gte": start_day}}},
+            {"$group": {"_id": "$product_id", "units": {"$sum": "$units"}, "revenue": {"$sum": "$revenue"}}},
+            {"$match": {"units": {"$gt": 0}}},
+            {"$sort": {"revenue": -1}},
+            {"$limit": limit}
+        ]))
+    return _with_names(rows)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-product sales counter maintenance")
+    parser.add_argument("command", choices=["rebuild", "expire"])
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "rebuild":
+        print(f"Counted {rebuild()} orders")
+    else:
+        print(f"Aged window counters by {expire_windows()} day(s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import asyncio
+import logging
+import os
+import tempfile
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+# With several worker processes only the one holding this lock runs jobs
+JOB_LOCK_FILE = os.getenv("INVENTORY_JOB_LOCK", os.path.join(tempfile.gettempdir(), "inventory-jobs.lock"))
+
+class Scheduler:
+    tasks = {}
+    lock_file = None
+
+def is_job_leader() -> bool:
+    """Try to become the process that runs background jobs on this host"""
+    if Scheduler.lock_file is not None:
+        return True
+    try:
+        import fcntl
+    except ImportError:
+        # No flock (Windows): single-process deployments only
+        return True
+    lock_file = open(JOB_LOCK_FILE, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    # Held until the process exits, then the OS releases it
+    Scheduler.lock_file = lock_file
+    return True
+
+async def _run_periodic(name: str, interval_seconds: float, func, run_immediately: bool):
+    if not run_immediately:
+        await asyncio.sleep(interval_seconds)
+    while True:
+        try:
+            # Jobs use blocking pymongo calls, keep them off the event loop
+            await run_in_threadpool(func)
+        except Exception as e:
+            logger.error(f"Background job {name} failed: {e}")
+        await asyncio.sleep(interval_seconds)
+
+def start_periodic(name: str, interval_seconds: float, func, leader_only: bool = True, run_immediately: bool = False):
+    """
+    Run `func` every `interval_seconds` in the background (no-op if interval <= 0).
+    Jobs are leader_only by default; per-process jobs (e.g. health checks) pass False.
+    """
+    if interval_seconds <= 0 or name in Scheduler.tasks:
+        return
+    if leader_only and not is_job_leader():
+        logger.info(f"Background job {name} runs in another worker")
+        return
+    Scheduler.tasks[name] = asyncio.create_task(
+        _run_periodic(name, interval_seconds, func, run_immediately)
+    )
+    logger.info(f"Background job {name} scheduled every {interval_seconds}s")
+
+def start_task(name: str, coroutine):
+    """Track a one-off background coroutine so it is cancelled on shutdown"""
+    task = asyncio.create_task(coroutine)
+    Scheduler.tasks[name] = task
+    
+    def untrack(finished):
+        # Finished tasks stop being tracked (unless the name was reused)
+        if Scheduler.tasks.get(name) is finished:
+            del Scheduler.tasks[name]
+    
+    task.add_done_callback(untrack)
+    return task
+
+async def stop_all():
+    for task in Scheduler.tasks.values():
+        task.cancel()
+    await asyncio.gather(*list(Scheduler.tasks.values()), return_exceptions=True)
+    Scheduler.tasks.clear()
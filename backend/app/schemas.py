@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Union
 from datetime import datetime
 
 class Token(BaseModel):
@@ -45,6 +45,30 @@ class ProductResponse(BaseModel):
     created_at: datetime
     updated_at: datetime
 
+class StockReceipt(BaseModel):
+    quantity: int
+
+class StockMovementResponse(BaseModel):
+    id: str
+    product_id: str
+    delta: int
+    reason: str
+    reference: Optional[str] = None
+    created_at: datetime
+
+class StockLevelResponse(BaseModel):
+    product_id: str
+    at: datetime
+    stock_quantity: int
+
+class StockShardsUpdate(BaseModel):
+    shards: int
+
+class StockShardsResponse(BaseModel):
+    product_id: str
+    stock_quantity: int
+    shards: List[int]
+
 class OrderItemCreate(BaseModel):
     product_id: str
     quantity: int
@@ -72,15 +96,71 @@ class OrderResponse(BaseModel):
     created_at: datetime
     updated_at: datetime
 
+class OrderSummaryResponse(BaseModel):
+    id: str
+    order_number: str
+    customer_name: str
+    customer_email: str
+    total_amount: float
+    status: str
+    created_at: datetime
+    updated_at: datetime
+
+class TombstoneResponse(BaseModel):
+    id: str
+    reason: str
+    deleted_at: datetime
+
+class ShardStockChange(BaseModel):
+    id: str
+    stock_quantity: int
+
+class ProductChangesResponse(BaseModel):
+    changes: List[ProductResponse]
+    deleted: List[TombstoneResponse]
+    # Sharded products whose stock changed (their documents are not rewritten)
+    stock: List[ShardStockChange] = []
+    cursor: str
+    has_more: bool
+
+class OrderChangesResponse(BaseModel):
+    changes: List[Union[OrderResponse, OrderSummaryResponse]]
+    deleted: List[TombstoneResponse]
+    cursor: str
+    has_more: bool
+
 class OrderStatusUpdate(BaseModel):
     status: str
 
+class ReportJobCreate(BaseModel):
+    report_type: str
+    params: dict = {}
+
 class ReportResponse(BaseModel):
     id: str
     report_type: str
-    data: dict
+    params: dict = {}
+    status: str
+    data: Optional[dict] = None
+    error: Optional[str] = None
     generated_by: str
-    generated_at: datetime
+    created_at: datetime
+    generated_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+
+class ProfileSummary(BaseModel):
+    id: str
+    method: str
+    path: str
+    query: str = ""
+    status: int
+    mode: str
+    request_id: Optional[str] = None
+    profiled_by: str
+    duration_ms: float
+    mongo_commands: int
+    mongo_ms: float
+    created_at: datetime
 
 class SalesAnalytics(BaseModel):
     total_sales: float
@@ -94,8 +174,38 @@ class InventoryAnalytics(BaseModel):
     out_of_stock_products: List[dict]
     total_inventory_value: float
 
+class ProductForecast(BaseModel):
+    product_id: str
+    name: str
+    sku: str
+    stock_quantity: int
+    moving_average: float
+    smoothed_demand: float
+    days_until_stockout: Optional[float] = None
+    reorder_point: float
+    reorder_quantity: int
+
+class ForecastReport(BaseModel):
+    generated_at: datetime
+    history_days: int
+    total_products: int
+    products_to_reorder: int
+    forecasts: List[ProductForecast]
+
 class UserCreate(BaseModel):
     username: str
     password: str
     role: str = "staff"
-    permissions: List[str] = []
\ No newline at end of file
+    permissions: List[str] = []
+
+class CustomerResponse(BaseModel):
+    email: str
+    name: str
+    order_count: int
+    lifetime_value: float
+    first_order_at: Optional[datetime] = None
+    last_order_at: Optional[datetime] = None
+
+class CustomerOrdersResponse(BaseModel):
+    orders: List[Union[OrderResponse, OrderSummaryResponse]]
+    next_cursor: Optional[str] = None
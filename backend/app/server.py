@@ -0,0 +1,65 @@
+"""
+Production server entry point.
+
+    python -m app.server --workers 16
+
+Starts uvicorn with the requested number of worker processes; nothing here
+touches MongoDB, so the server comes up even while the database is down.
+The one-time startup tasks (indexes, default admin user, counters, banner)
+run in the background of the job-leader worker, and /readyz on every worker
+reports not ready until they have finished. Each worker creates its own
+MongoClient on first use. On SIGTERM
+uvicorn stops accepting connections and gives in-flight requests up to
+GRACEFUL_SHUTDOWN_SECONDS to finish before the workers exit.
+
+With STORAGE_BACKEND=embedded the database lives in the process, so there
+is a single worker.
+"""
+import argparse
+import logging
+import os
+import uvicorn
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+WORKERS = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", 8000))
+GRACEFUL_SHUTDOWN_SECONDS = int(os.getenv("GRACEFUL_SHUTDOWN_SECONDS", 30))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the Inventory & Order Management API")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Worker processes (default: WEB_CONCURRENCY or CPU count)")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--graceful-shutdown", type=int, default=GRACEFUL_SHUTDOWN_SECONDS,
+                        help="Seconds to let in-flight requests finish on shutdown")
+    args = parser.parse_args(argv)
+
+    from app.structured_logging import configure_logging
+    configure_logging()
+
+    from app.database import STORAGE_BACKEND
+
+    if STORAGE_BACKEND == "embedded":
+        # The data lives in the worker process
+        if args.workers != 1:
+            logger.warning("STORAGE_BACKEND=embedded runs a single worker")
+        args.workers = 1
+
+    logger.info(f"Starting {args.workers} worker(s) on {args.host}:{args.port}")
+    uvicorn.run(
+        "app.main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        # Access logs come from RequestContextMiddleware (sampled, off the event loop)
+        access_log=False,
+        timeout_graceful_shutdown=args.graceful_shutdown
+    )
+
+if __name__ == "__main__":
+    main()
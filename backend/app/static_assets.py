@@ -0,0 +1,160 @@
+"""
+Precompressed, fingerprinted frontend assets.
+
+Build step (run from backend/, e.g. in the Docker image build):
+
+    python -m app.static_assets
+
+copies every frontend asset to frontend/dist/ under a content-hash name
+(script.js -> script.3f2a9c1e4b7d.js), writes .gz (and .br when the
+`brotli` package is installed) variants next to each file, rewrites the
+/static/... references in the HTML pages and records the mapping in
+manifest.json.
+
+At runtime PrecompressedStaticFiles serves the best precompressed variant
+the client accepts. Fingerprinted files get a one-year immutable
+Cache-Control; everything else (HTML) is revalidated on each load.
+When no build exists the app serves frontend/ directly, as before.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+from pathlib import Path
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+try:
+    import brotli
+except ImportError:  # optional: only gzip variants are produced
+    brotli = None
+
+MANIFEST_NAME = "manifest.json"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+COMPRESSIBLE_SUFFIXES = {".js", ".css", ".html", ".svg", ".json", ".txt", ".map"}
+# Do not bother compressing tiny files
+MIN_COMPRESS_BYTES = 256
+ASSET_REFERENCE = re.compile(r"""(["'])/static/([\w./-]+?)(\?[^"']*)?\1""")
+
+def _fingerprint(path: Path) -> str:
+    digest = hashlib.sha256(path.read_bytes()).hexdigest()[:12]
+    return f"{path.stem}.{digest}{path.suffix}"
+
+def _write_compressed(path: Path):
+    data = path.read_bytes()
+    if path.suffix not in COMPRESSIBLE_SUFFIXES or len(data) < MIN_COMPRESS_BYTES:
+        return
+    # mtime=0 keeps the output byte-for-byte reproducible
+    with open(f"{path}.gz", "wb") as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        with open(f"{path}.br", "wb") as f:
+            f.write(brotli.compress(data, quality=11))
+
+def build(source_dir: Path, output_dir: Path) -> dict:
+    """Build fingerprinted + precompressed assets, returns the manifest"""
+    if output_dir.exists():
+        shutil.rmtree(output_dir)
+    output_dir.mkdir(parents=True)
+
+    manifest = {}
+    pages = []
+    for path in sorted(source_dir.iterdir()):
+        if not path.is_file() or path.name.startswith("."):
+            continue
+        if path.suffix == ".html":
+            pages.append(path)
+            continue
+        fingerprinted = _fingerprint(path)
+        shutil.copyfile(path, output_dir / fingerprinted)
+        _write_compressed(output_dir / fingerprinted)
+        manifest[path.name] = fingerprinted
+
+    def rewrite(match):
+        quote, name, _query = match.groups()
+        if name not in manifest:
+            return match.group(0)
+        return f"{quote}/static/{manifest[name]}{quote}"
+
+    # Pages keep their names (they are not cached) and point at the fingerprinted assets
+    for page in pages:
+        html = ASSET_REFERENCE.sub(rewrite, page.read_text(encoding="utf-8"))
+        (output_dir / page.name).write_text(html, encoding="utf-8")
+        _write_compressed(output_dir / page.name)
+
+    with open(output_dir / MANIFEST_NAME, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+def load_manifest(directory: Path) -> dict:
+    try:
+        with open(directory / MANIFEST_NAME) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def accepted_encodings(scope) -> set:
+    for key, value in scope.get("headers", []):
+        if key == b"accept-encoding":
+            return {part.split(";")[0].strip() for part in value.decode("latin-1").split(",")}
+    return set()
+
+def _media_type(path: str) -> str:
+    return mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that serves precompressed variants and long-lived caching for fingerprinted files"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.immutable_files = set(load_manifest(Path(self.directory)).values())
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        return self.negotiated_response(str(full_path), scope, status_code)
+
+    def negotiated_response(self, path: str, scope, status_code: int = 200) -> Response:
+        """
+        FileResponse for `path`, using a .br/.gz sibling when the client
+        accepts it, with the usual conditional-request (304) handling
+        """
+        name = os.path.basename(path)
+        cache_control = IMMUTABLE_CACHE_CONTROL if name in self.immutable_files else REVALIDATE_CACHE_CONTROL
+        headers = {"Vary": "Accept-Encoding", "Cache-Control": cache_control}
+        encodings = accepted_encodings(scope)
+        serve_path = path
+        for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+            if encoding in encodings and os.path.isfile(path + suffix):
+                serve_path = path + suffix
+                headers["Content-Encoding"] = encoding
+                break
+
+        # The media type always comes from the uncompressed file name
+        response = FileResponse(
+            serve_path, status_code=status_code, headers=headers,
+            media_type=_media_type(path), stat_result=os.stat(serve_path)
+        )
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+
+def main(argv=None):
+    frontend_dir = Path(__file__).parent.parent.parent / "frontend"
+    parser = argparse.ArgumentParser(description="Build fingerprinted, precompressed frontend assets")
+    parser.add_argument("--source", type=Path, default=frontend_dir)
+    parser.add_argument("--output", type=Path, default=frontend_dir / "dist")
+    args = parser.parse_args(argv)
+
+    manifest = build(args.source, args.output)
+    for name, fingerprinted in manifest.items():
+        print(f"{name} -> {fingerprinted}")
+    if brotli is None:
+        print("brotli not installed: only gzip variants were written")
+
+if __name__ == "__main__":
+    main()
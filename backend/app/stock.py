@@ -0,0 +1,260 @@
+from pymongo import UpdateOne, ReturnDocument
+from bson import ObjectId
+from datetime import datetime
+from app.database import get_products_collection, get_orders_collection, run_in_transaction
+from app.stock_ledger import record_movements, record_movement_entries, RESERVE, RESTORE, ADJUST, RECEIPT
+from app.stock_shards import sharded_products, take_from_shards, add_to_shards, set_shard_stock, with_shard_total
+
+# Orders in these states still hold reserved stock that can be put back
+RESTORABLE_STATUSES = ["pending", "confirmed"]
+
+def reserve_stock(items, reference=None):
+    """
+    Atomically decrement stock for a list of (product_id, quantity) pairs.
+
+    Each decrement is conditional on enough stock being left, so concurrent
+    orders can never oversell. If any item cannot be reserved the ones already
+    taken are put back and that (product_id, quantity) pair is returned;
+    None means every item was reserved. Successful reservations are written
+    to the stock ledger together with the decrements. Products with sharded
+    stock (see app/stock_shards.py) are reserved from their shards.
+    """
+    def reserve(session):
+        products_collection = get_products_collection()
+        reserved = []
+        for product_id, quantity in items:
+            result = products_collection.update_one(
+                {"_id": ObjectId(product_id), "stock_quantity": {"$gte": quantity}, "stock_shards": {"$exists": False}},
+                {"$inc": {"stock_quantity": -quantity}, "$set": {"updated_at": datetime.utcnow()}},
+                session=session
+            )
+            if result.modified_count == 0:
+                # Sharded products never match above; unsharded ones cost no extra read
+                shards = sharded_products([product_id], session).get(product_id)
+                if shards and take_from_shards(product_id, shards, quantity, session):
+                    reserved.append((product_id, quantity))
+                    continue
+                _increment(reserved, session)
+                return (product_id, quantity)
+            reserved.append((product_id, quantity))
+        record_movements([(product_id, -quantity) for product_id, quantity in reserved], RESERVE, reference, session)
+        return None
+    
+    return run_in_transaction(reserve)
+
+def reserve_stock_batch(reservations):
+    """
+    Reserve stock for many orders at once: reservations is a list of
+    (reference, [(product_id, quantity), ...]).
+
+    Quantities are summed per product and applied as one conditional $inc
+    per product in a single unordered bulk write. Each update also sets a
+    marker field unique to this batch, which is read back to learn which
+    products were decremented (bulk results only carry counts). Orders
+    touching a product whose decrement failed (or whose stock is sharded)
+    get their other products' stock back. Returns the set of references
+    that could not be reserved.
+    """
+    totals = {}
+    for _, items in reservations:
+        for product_id, quantity in items:
+            totals[product_id] = totals.get(product_id, 0) + quantity
+    if not totals:
+        return set()
+    marker = f"_stock_batch_{ObjectId()}"
+    
+    def reserve(session):
+        products_collection = get_products_collection()
+        now = datetime.utcnow()
+        products_collection.bulk_write([
+            UpdateOne(
+                {"_id": ObjectId(product_id), "stock_quantity": {"$gte": total}, "stock_shards": {"$exists": False}},
+                {"$inc": {"stock_quantity": -total}, "$set": {"updated_at": now, marker: True}}
+            )
+            for product_id, total in totals.items()
+        ], ordered=False, session=session)
+        reserved = {
+            str(product["_id"])
+            for product in products_collection.find(
+                {"_id": {"$in": [ObjectId(product_id) for product_id in totals]}, marker: True},
+                {"_id": 1},
+                session=session
+            )
+        }
+        if reserved:
+            products_collection.update_many(
+                {"_id": {"$in": [ObjectId(product_id) for product_id in reserved]}},
+                {"$unset": {marker: ""}},
+                session=session
+            )
+        
+        failed = {
+            reference for reference, items in reservations
+            if any(product_id not in reserved for product_id, _ in items)
+        }
+        _increment([
+            (product_id, quantity)
+            for reference, items in reservations if reference in failed
+            for product_id, quantity in items if product_id in reserved
+        ], session)
+        record_movement_entries([
+            (product_id, -quantity, reference)
+            for reference, items in reservations if reference not in failed
+            for product_id, quantity in items
+        ], RESERVE, session)
+        return failed
+    
+    return run_in_transaction(reserve)
+
+def _increment(items, session=None):
+    items = [(product_id, quantity) for product_id, quantity in items if quantity]
+    shard_counts = sharded_products([product_id for product_id, _ in items], session) if items else {}
+    add_to_shards([item for item in items if item[0] in shard_counts], shard_counts, session)
+    operations = [
+        UpdateOne(
+            {"_id": ObjectId(product_id)},
+            {"$inc": {"stock_quantity": quantity}, "$set": {"updated_at": datetime.utcnow()}}
+        )
+        for product_id, quantity in items
+        if product_id not in shard_counts
+    ]
+    if operations:
+        get_products_collection().bulk_write(operations, ordered=False, session=session)
+
+def restore_stock(items, reason=RESTORE, reference=None, session=None):
+    """Put stock back for (product_id, quantity) pairs in one unordered bulk write, with ledger entries"""
+    _increment(items, session)
+    record_movements([(product_id, quantity) for product_id, quantity in items], reason, reference, session)
+
+def receive_stock(product_id, quantity, reference=None):
+    """Book a goods receipt; returns the updated product or None if it does not exist"""
+    def receive(session):
+        products_collection = get_products_collection()
+        product = products_collection.find_one_and_update(
+            {"_id": ObjectId(product_id), "stock_shards": {"$exists": False}},
+            {"$inc": {"stock_quantity": quantity}, "$set": {"updated_at": datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        if not product:
+            product = products_collection.find_one({"_id": ObjectId(product_id)}, session=session)
+            if product:
+                add_to_shards([(product_id, quantity)], {product_id: product["stock_shards"]}, session)
+                product = with_shard_total(product, session)
+        if product:
+            record_movements([(product_id, quantity)], RECEIPT, reference, session)
+        return product
+    
+    return run_in_transaction(receive)
+
+def update_product_fields(product_id, update_data, reference=None):
+    """
+    $set product fields in one round trip. A changed stock_quantity is booked
+    as a manual adjustment (delta against the previous value) in the ledger;
+    for sharded stock the new quantity is spread over the shards.
+    Returns the updated product or None if it does not exist.
+    """
+    if "stock_quantity" not in update_data:
+        return with_shard_total(get_products_collection().find_one_and_update(
+            {"_id": ObjectId(product_id)},
+            {"$set": update_data},
+            return_document=ReturnDocument.AFTER
+        ))
+    
+    def update(session):
+        # The previous document gives the delta; the new one is derived from it
+        previous = get_products_collection().find_one_and_update(
+            {"_id": ObjectId(product_id)},
+            {"$set": update_data},
+            return_document=ReturnDocument.BEFORE,
+            session=session
+        )
+        if not previous:
+            return None
+        if previous.get("stock_shards"):
+            previous_quantity = set_shard_stock(product_id, previous["stock_shards"], update_data["stock_quantity"], session)
+        else:
+            previous_quantity = previous.get("stock_quantity", 0)
+        delta = update_data["stock_quantity"] - previous_quantity
+        record_movements([(product_id, delta)], ADJUST, reference, session)
+        return {**previous, **update_data}
+    
+    return run_in_transaction(update)
+
+def claim_stock_restoration(order_id, update=None, session=None):
+    """
+    Mark an order's reserved stock as released, at most once.
+
+    The claim is a single conditional update: it only matches orders that
+    still hold stock (pending/confirmed and not yet restored), so a retried
+    request or a cancel followed by a delete cannot restore twice. Extra
+    fields in `update` (e.g. the new status) are set in the same write.
+    Returns the updated order if this caller won the claim, otherwise None.
+    """
+    fields = {"stock_restored": True, "updated_at": datetime.utcnow()}
+    if update:
+        fields.update(update)
+    return get_orders_collection().find_one_and_update(
+        {
+            "_id": ObjectId(order_id),
+            "status": {"$in": RESTORABLE_STATUSES},
+            "stock_restored": {"$ne": True}
+        },
+        {"$set": fields},
+        return_document=ReturnDocument.AFTER,
+        session=session
+    )
+
+def reinstate_order_stock(order_id, status):
+    """
+    Move a cancelled order to `status`, taking its stock again.
+
+    The stock is reserved before the order leaves cancelled, so the order
+    never holds stock it did not take; if another request moves the order
+    first, the stock is put back. Returns (order, failed): the updated order
+    (None if it is not cancelled or does not exist) and the
+    (product_id, quantity) pair that could not be reserved, if any.
+    """
+    orders_collection = get_orders_collection()
+    order = orders_collection.find_one({"_id": ObjectId(order_id), "status": "cancelled"})
+    if not order:
+        return None, None
+    if not order.get("stock_restored"):
+        # Cancelled after it shipped: the stock already left and the order
+        # holds none, so a later cancel must not put any back
+        return orders_collection.find_one_and_update(
+            {"_id": ObjectId(order_id), "status": "cancelled", "stock_restored": {"$ne": True}},
+            {"$set": {"status": status, "stock_restored": True, "updated_at": datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER
+        ), None
+    
+    items = [(item["product_id"], item["quantity"]) for item in order["items"]]
+    failed = reserve_stock(items, str(order_id))
+    if failed:
+        return None, failed
+    
+    def claim(session):
+        updated = orders_collection.find_one_and_update(
+            {"_id": ObjectId(order_id), "status": "cancelled", "stock_restored": True},
+            {"$set": {"status": status, "stock_restored": False, "updated_at": datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        if not updated:
+            restore_stock(items, RESTORE, str(order_id), session)
+        return updated
+    
+    return run_in_transaction(claim), None
+
+def release_order_stock(order_id, update=None):
+    """Claim the restoration for an order and, if won, return its items to stock."""
+    def release(session):
+        order = claim_stock_restoration(order_id, update, session)
+        if order:
+            restore_stock(
+                [(item["product_id"], item["quantity"]) for item in order["items"]],
+                RESTORE, str(order_id), session
+            )
+        return order
+    
+    return run_in_transaction(release)
@@ -0,0 +1,174 @@
+"""
+Append-only stock movement ledger.
+
+Every change to a product's stock_quantity is recorded in `stock_movements`
+as a signed delta with a reason (order reserve/restore, manual adjustment,
+receipt) and a reference (order id or username), by the same helper in
+app/stock.py that changes the stock. With MONGODB_TRANSACTIONS=true both
+writes commit in one transaction.
+
+Periodic compaction folds movements into `stock_snapshots`, so the stock of
+a product at any point in time is one indexed snapshot lookup plus the
+movements since that snapshot, instead of a replay of the full history.
+
+    python -m app.stock_ledger init      # opening snapshots for existing products
+    python -m app.stock_ledger compact   # fold movements into snapshots
+"""
+import argparse
+import logging
+import os
+from datetime import datetime, timedelta
+from app.database import (
+    get_database, get_products_collection, get_stock_movements_collection, get_stock_snapshots_collection
+)
+from app.stock_shards import with_shard_totals
+
+logger = logging.getLogger(__name__)
+
+# Movement reasons
+RESERVE = "order_reserve"
+RESTORE = "order_restore"
+ADJUST = "manual_adjust"
+RECEIPT = "receipt"
+
+SNAPSHOT_INTERVAL_MINUTES = float(os.getenv("STOCK_SNAPSHOT_INTERVAL_MINUTES", 60))
+# Movements younger than this are left for the next compaction, so writes
+# from workers with slightly skewed clocks are never skipped
+COMPACTION_LAG_SECONDS = int(os.getenv("STOCK_COMPACTION_LAG_SECONDS", 60))
+COMPACTION_STATE_ID = "compaction"
+
+def record_movements(changes, reason: str, reference: str = None, session=None):
+    """Append one movement per (product_id, delta) pair, skipping zero deltas"""
+    record_movement_entries(
+        [(product_id, delta, reference) for product_id, delta in changes], reason, session
+    )
+
+def record_movement_entries(entries, reason: str, session=None):
+    """Append (product_id, delta, reference) movements in one insert, skipping zero deltas"""
+    now = datetime.utcnow()
+    movements = [
+        {
+            "product_id": str(product_id),
+            "delta": int(delta),
+            "reason": reason,
+            "reference": reference,
+            "created_at": now
+        }
+        for product_id, delta, reference in entries
+        if delta
+    ]
+    if movements:
+        get_stock_movements_collection().insert_many(movements, ordered=False, session=session)
+
+def _compaction_state():
+    return get_database().stock_ledger_state
+
+def compact(now: datetime = None) -> int:
+    """Write a new snapshot for every product with movements since the last compaction"""
+    state_collection = _compaction_state()
+    state = state_collection.find_one({"_id": COMPACTION_STATE_ID}) or {}
+    since = state.get("compacted_until", datetime.min)
+    until = (now or datetime.utcnow()) - timedelta(seconds=COMPACTION_LAG_SECONDS)
+    if until <= since:
+        return 0
+
+    totals = get_stock_movements_collection().aggregate([
+        {"$match": {"created_at": {"$gt": since, "$lte": until}}},
+        {"$group": {"_id": "$product_id", "delta": {"$sum": "$delta"}}}
+    ])
+    snapshots_collection = get_stock_snapshots_collection()
+    snapshots = []
+    for total in totals:
+        previous = snapshots_collection.find_one(
+            {"product_id": total["_id"], "taken_at": {"$lte": since}},
+            sort=[("taken_at", -1)]
+        )
+        base = previous["quantity"] if previous else 0
+        snapshots.append({
+            "product_id": total["_id"],
+            "taken_at": until,
+            "quantity": base + total["delta"]
+        })
+    if snapshots:
+        snapshots_collection.insert_many(snapshots, ordered=False)
+
+    state_collection.update_one(
+        {"_id": COMPACTION_STATE_ID},
+        {"$set": {"compacted_until": until}},
+        upsert=True
+    )
+    logger.info(f"Stock ledger compacted up to {until.isoformat()}: {len(snapshots)} snapshots")
+    return len(snapshots)
+
+def create_opening_snapshots() -> int:
+    """
+    Opening balance for products that have no snapshot yet (products created
+    before the ledger existed), taken at the compaction watermark so later
+    compactions build on it. The balance is the current stock minus the
+    movements booked after the watermark.
+    """
+    state_collection = _compaction_state()
+    state = state_collection.find_one({"_id": COMPACTION_STATE_ID})
+    taken_at = state["compacted_until"] if state else datetime.utcnow()
+    if not state:
+        state_collection.insert_one({"_id": COMPACTION_STATE_ID, "compacted_until": taken_at})
+
+    snapshots_collection = get_stock_snapshots_collection()
+    known = set(snapshots_collection.distinct("product_id"))
+    since_watermark = {
+        total["_id"]: total["delta"]
+        for total in get_stock_movements_collection().aggregate([
+            {"$match": {"created_at": {"$gt": taken_at}}},
+            {"$group": {"_id": "$product_id", "delta": {"$sum": "$delta"}}}
+        ])
+    }
+    openings = []
+    for product in with_shard_totals(list(get_products_collection().find({}, {"stock_quantity": 1, "stock_shards": 1}))):
+        product_id = str(product["_id"])
+        if product_id in known:
+            continue
+        openings.append({
+            "product_id": product_id,
+            "taken_at": taken_at,
+            "quantity": product.get("stock_quantity", 0) - since_watermark.get(product_id, 0)
+        })
+    if openings:
+        snapshots_collection.insert_many(openings, ordered=False)
+    return len(openings)
+
+def stock_at(product_id: str, at: datetime) -> int:
+    """Stock of a product at a point in time: latest snapshot + movements since"""
+    snapshot = get_stock_snapshots_collection().find_one(
+        {"product_id": product_id, "taken_at": {"$lte": at}},
+        sort=[("taken_at", -1)]
+    )
+    since = snapshot["taken_at"] if snapshot else datetime.min
+    replay = list(get_stock_movements_collection().aggregate([
+        {"$match": {"product_id": product_id, "created_at": {"$gt": since, "$lte": at}}},
+        {"$group": {"_id": None, "delta": {"$sum": "$delta"}}}
+    ]))
+    base = snapshot["quantity"] if snapshot else 0
+    return base + (replay[0]["delta"] if replay else 0)
+
+def list_movements(product_id: str, limit: int = 100):
+    """Most recent movements of a product"""
+    return list(
+        get_stock_movements_collection()
+        .find({"product_id": product_id})
+        .sort("created_at", -1)
+        .limit(limit)
+    )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stock ledger maintenance")
+    parser.add_argument("command", choices=["init", "compact"])
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "init":
+        print(f"Created {create_opening_snapshots()} opening snapshots")
+    else:
+        print(f"Wrote {compact()} snapshots")
+
+if __name__ == "__main__":
+    main()
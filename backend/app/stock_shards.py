@@ -0,0 +1,347 @@
+"""
+Sharded stock counters for hot products.
+
+Every order does a conditional $inc on its products' documents, so a flash
+sale on one product serializes on that one document. A product can opt in
+to having its stock split over N counters in `stock_shards`
+(_id "<product_id>:<shard>", product_id, shard, quantity); the product
+document then carries `stock_shards: N` and its own stock_quantity is no
+longer written by orders.
+
+* a reservation tries the shards in random order and takes the quantity
+  from the first one that has enough; a quantity no single shard can cover
+  is gathered from several
+* stock that is put back or received goes to a random shard
+* reads go through with_shard_totals(), which replaces stock_quantity with
+  the sum of the shards for sharded products (other products cost nothing)
+* shard writes that change the stock stamp the shard's updated_at, so the
+  products change feed can report new totals without touching the product
+* rebalance() evens the shards out, since reservations fall back to other
+  shards more often as they drift apart, and copies the total to the
+  product's stock_quantity so database-side filters stay close. It runs for
+  every sharded product every STOCK_SHARD_REBALANCE_MINUTES.
+
+Changing a product's shard count is only atomic with
+MONGODB_TRANSACTIONS=true; otherwise do it while the product is not being
+ordered.
+
+    python -m app.stock_shards set <product_id> <shards>   # 1 turns sharding off
+    python -m app.stock_shards rebalance [<product_id>]
+"""
+import argparse
+import logging
+import os
+import random
+from datetime import datetime
+from bson import ObjectId
+from pymongo import UpdateOne, ReturnDocument, DESCENDING
+from app import metrics
+from app.database import get_products_collection, get_stock_shards_collection, run_in_transaction
+
+logger = logging.getLogger(__name__)
+
+STOCK_SHARD_REBALANCE_MINUTES = float(os.getenv("STOCK_SHARD_REBALANCE_MINUTES", 5))
+MAX_STOCK_SHARDS = 64
+
+metrics.describe("stock_shard_fallbacks_total", "Sharded reservations that had to gather stock from several shards")
+
+def shard_id(product_id: str, shard: int) -> str:
+    return f"{product_id}:{shard}"
+
+def _split(total: int, shards: int) -> list:
+    """Even split of total over the shards, remainder on the first ones"""
+    return [total // shards + (1 if shard < total % shards else 0) for shard in range(shards)]
+
+def sharded_products(product_ids, session=None) -> dict:
+    """{product_id: shard count} for the given products that are sharded"""
+    return {
+        str(product["_id"]): product["stock_shards"]
+        for product in get_products_collection().find(
+            {"_id": {"$in": [ObjectId(product_id) for product_id in set(product_ids)]}, "stock_shards": {"$gt": 1}},
+            {"stock_shards": 1},
+            session=session
+        )
+    }
+
+def with_shard_totals(products: list, session=None) -> list:
+    """Set stock_quantity of the sharded products among `products` to the sum of their shards"""
+    sharded = {str(product["_id"]): product for product in products if product and product.get("stock_shards")}
+    if sharded:
+        totals = {
+            total["_id"]: total["quantity"]
+            for total in get_stock_shards_collection().aggregate([
+                {"$match": {"product_id": {"$in": list(sharded)}}},
+                {"$group": {"_id": "$product_id", "quantity": {"$sum": "$quantity"}}}
+            ], session=session)
+        }
+        for product_id, product in sharded.items():
+            product["stock_quantity"] = totals.get(product_id, 0)
+    return products
+
+def shard_totals_changed_since(since: datetime) -> dict:
+    """{product_id: summed stock} of sharded products whose shards changed at or after `since`"""
+    product_ids = get_stock_shards_collection().distinct("product_id", {"updated_at": {"$gte": since}})
+    if not product_ids:
+        return {}
+    products = get_products_collection().find(
+        {"_id": {"$in": [ObjectId(product_id) for product_id in product_ids]}, "stock_shards": {"$exists": True}},
+        {"stock_shards": 1}
+    )
+    return {str(product["_id"]): product["stock_quantity"] for product in with_shard_totals(list(products))}
+
+def with_shard_total(product, session=None):
+    """with_shard_totals() for a single product (or None)"""
+    return with_shard_totals([product], session)[0]
+
+def take_from_shards(product_id: str, shards: int, quantity: int, session=None) -> bool:
+    """Conditionally decrement `quantity` from a sharded product; False if there is not enough"""
+    shards_collection = get_stock_shards_collection()
+    for shard in random.sample(range(shards), shards):
+        result = shards_collection.update_one(
+            {"_id": shard_id(product_id, shard), "quantity": {"$gte": quantity}},
+            {"$inc": {"quantity": -quantity}, "$set": {"updated_at": datetime.utcnow()}},
+            session=session
+        )
+        if result.modified_count:
+            return True
+
+    # No single shard has enough: gather it, fullest shards first
+    metrics.increment("stock_shard_fallbacks_total")
+    taken = []
+    remaining = quantity
+    for shard in shards_collection.find({"product_id": product_id}, sort=[("quantity", DESCENDING)], session=session):
+        take = min(shard["quantity"], remaining)
+        if take <= 0:
+            break
+        result = shards_collection.update_one(
+            {"_id": shard["_id"], "quantity": {"$gte": take}},
+            {"$inc": {"quantity": -take}, "$set": {"updated_at": datetime.utcnow()}},
+            session=session
+        )
+        if result.modified_count:
+            taken.append((shard["_id"], take))
+            remaining -= take
+    if remaining:
+        if taken:
+            shards_collection.bulk_write([
+                UpdateOne({"_id": _id}, {"$inc": {"quantity": take}, "$set": {"updated_at": datetime.utcnow()}})
+                for _id, take in taken
+            ], ordered=False, session=session)
+        return False
+    return True
+
+def add_to_shards(items, shard_counts: dict, session=None):
+    """Add (product_id, quantity) pairs of sharded products to a random shard each"""
+    operations = []
+    for product_id, quantity in items:
+        shard = random.randrange(shard_counts[product_id])
+        operations.append(UpdateOne(
+            {"_id": shard_id(product_id, shard)},
+            {
+                "$inc": {"quantity": quantity},
+                "$set": {"updated_at": datetime.utcnow()},
+                "$setOnInsert": {"product_id": product_id, "shard": shard}
+            },
+            # Recreates a shard dropped by a concurrent resize; rebalance() drains it
+            upsert=True
+        ))
+    if operations:
+        get_stock_shards_collection().bulk_write(operations, ordered=False, session=session)
+
+def set_shard_stock(product_id: str, shards: int, total: int, session=None) -> int:
+    """Set a sharded product's stock to `total`, evenly split; returns the total it replaced"""
+    shards_collection = get_stock_shards_collection()
+    targets = dict(enumerate(_split(total, shards)))
+    for shard in shards_collection.find({"product_id": product_id}, {"shard": 1}, session=session):
+        targets.setdefault(shard["shard"], 0)
+    previous_total = 0
+    for shard, quantity in targets.items():
+        # Each shard is swapped atomically, so the replaced total is exact
+        previous = shards_collection.find_one_and_update(
+            {"_id": shard_id(product_id, shard)},
+            {
+                "$set": {"quantity": quantity, "updated_at": datetime.utcnow()},
+                "$setOnInsert": {"product_id": product_id, "shard": shard}
+            },
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
+            session=session
+        )
+        if previous:
+            previous_total += previous["quantity"]
+    return previous_total
+
+def shard_levels(product_id: str, session=None) -> list:
+    """Quantity per shard, by shard number"""
+    return [
+        shard["quantity"]
+        for shard in get_stock_shards_collection().find(
+            {"product_id": product_id}, {"quantity": 1}, sort=[("shard", 1)], session=session
+        )
+    ]
+
+def _drain(product_id: str, shard_filter: dict, session=None) -> int:
+    """Delete matching shards of a product and return the stock they held"""
+    shards_collection = get_stock_shards_collection()
+    drained = 0
+    for shard in list(shards_collection.find({"product_id": product_id, **shard_filter}, {"_id": 1}, session=session)):
+        deleted = shards_collection.find_one_and_delete({"_id": shard["_id"]}, session=session)
+        if deleted:
+            drained += deleted["quantity"]
+    return drained
+
+def rebalance(product_id: str):
+    """
+    Even out a product's shards and copy their total to the product's
+    stock_quantity. Stock only moves through conditional decrements and
+    increments, so orders can keep reserving while this runs. Shards left
+    over from a resize (or of a product that is no longer sharded) are
+    drained. Returns the shard levels, or None if the product does not exist.
+    """
+    products_collection = get_products_collection()
+    shards_collection = get_stock_shards_collection()
+
+    def run(session):
+        product = products_collection.find_one({"_id": ObjectId(product_id)}, {"stock_shards": 1}, session=session)
+        if not product:
+            shards_collection.delete_many({"product_id": product_id}, session=session)
+            return None
+        shards = product.get("stock_shards", 0)
+        if shards < 2:
+            drained = _drain(product_id, {}, session)
+            if drained:
+                products_collection.update_one(
+                    {"_id": ObjectId(product_id)},
+                    {"$inc": {"stock_quantity": drained}, "$set": {"updated_at": datetime.utcnow()}},
+                    session=session
+                )
+            return []
+
+        pool = _drain(product_id, {"shard": {"$gte": shards}}, session)
+        levels = {shard: 0 for shard in range(shards)}
+        for shard in shards_collection.find({"product_id": product_id}, {"shard": 1, "quantity": 1}, session=session):
+            levels[shard["shard"]] = shard["quantity"]
+        targets = _split(sum(levels.values()) + pool, shards)
+
+        for shard, quantity in levels.items():
+            excess = quantity - targets[shard]
+            if excess <= 0:
+                continue
+            result = shards_collection.update_one(
+                {"_id": shard_id(product_id, shard), "quantity": {"$gte": excess}},
+                {"$inc": {"quantity": -excess}},
+                session=session
+            )
+            if result.modified_count:
+                pool += excess
+        operations = []
+        for shard, quantity in levels.items():
+            give = min(pool, max(targets[shard] - quantity, 0))
+            # Whatever is left (shards changed under us) goes to the last shard
+            if shard == shards - 1:
+                give = pool
+            pool -= give
+            operations.append(UpdateOne(
+                {"_id": shard_id(product_id, shard)},
+                {"$inc": {"quantity": give}, "$setOnInsert": {"product_id": product_id, "shard": shard}},
+                upsert=True
+            ))
+        shards_collection.bulk_write(operations, ordered=False, session=session)
+
+        levels = shard_levels(product_id, session)
+        total = sum(levels)
+        products_collection.update_one(
+            {"_id": ObjectId(product_id), "stock_quantity": {"$ne": total}},
+            {"$set": {"stock_quantity": total, "updated_at": datetime.utcnow()}},
+            session=session
+        )
+        return levels
+
+    return run_in_transaction(run)
+
+def set_shard_count(product_id: str, shards: int):
+    """
+    Split a product's stock over `shards` counters (1 merges it back into
+    the product document). Returns the shard levels, or None if the product
+    does not exist.
+    """
+    products_collection = get_products_collection()
+    shards_collection = get_stock_shards_collection()
+
+    def run(session):
+        product = products_collection.find_one({"_id": ObjectId(product_id)}, {"stock_shards": 1}, session=session)
+        if not product:
+            return None
+        current = product.get("stock_shards", 0)
+
+        if shards < 2:
+            if current:
+                # Unsharded reservations see no stock until the shards are drained
+                products_collection.update_one(
+                    {"_id": ObjectId(product_id)},
+                    {"$set": {"stock_quantity": 0}, "$unset": {"stock_shards": ""}},
+                    session=session
+                )
+            return []
+
+        # Shards exist before reservations can pick them
+        shards_collection.bulk_write([
+            UpdateOne(
+                {"_id": shard_id(product_id, shard)},
+                {"$setOnInsert": {"product_id": product_id, "shard": shard, "quantity": 0}},
+                upsert=True
+            )
+            for shard in range(shards)
+        ], ordered=False, session=session)
+        previous = products_collection.find_one_and_update(
+            {"_id": ObjectId(product_id)},
+            {"$set": {"stock_shards": shards}},
+            return_document=ReturnDocument.BEFORE,
+            session=session
+        )
+        if previous and not previous.get("stock_shards"):
+            # Move the product's own stock into the shards
+            add_to_shards([(product_id, previous.get("stock_quantity", 0))], {product_id: 1}, session)
+        return []
+
+    if run_in_transaction(run) is None:
+        return None
+    # Drains removed shards (or all of them when unsharding) and spreads the stock
+    return rebalance(product_id)
+
+def rebalance_all() -> int:
+    """Rebalance every sharded product, and drain shards of products that are no longer sharded"""
+    product_ids = set(get_stock_shards_collection().distinct("product_id"))
+    product_ids.update(
+        str(product["_id"])
+        for product in get_products_collection().find({"stock_shards": {"$gt": 1}}, {"_id": 1})
+    )
+    for product_id in product_ids:
+        try:
+            rebalance(product_id)
+        except Exception as e:
+            logger.error(f"Rebalancing stock shards of {product_id} failed: {e}")
+    return len(product_ids)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sharded stock counters")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    set_parser = subparsers.add_parser("set", help="set the shard count of a product")
+    set_parser.add_argument("product_id")
+    set_parser.add_argument("shards", type=int)
+    rebalance_parser = subparsers.add_parser("rebalance", help="even out the shards")
+    rebalance_parser.add_argument("product_id", nargs="?")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "set":
+        if not 1 <= args.shards <= MAX_STOCK_SHARDS:
+            parser.error(f"shards must be between 1 and {MAX_STOCK_SHARDS}")
+        print(set_shard_count(args.product_id, args.shards))
+    elif args.product_id:
+        print(rebalance(args.product_id))
+    else:
+        print(f"Rebalanced {rebalance_all()} products")
+
+if __name__ == "__main__":
+    main()
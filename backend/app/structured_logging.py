@@ -0,0 +1,183 @@
+"""
+Structured logging off the request path.
+
+configure_logging() routes every log record through a bounded in-memory
+queue to one background thread that formats and writes it, so a slow
+stdout never blocks the event loop. When the queue is full new records are
+dropped and counted in log_records_dropped_total instead of waiting.
+
+* LOG_FORMAT=json (default) writes one JSON object per line with ts, level,
+  logger, message, request_id and any `extra={...}` fields; LOG_FORMAT=text
+  keeps a plain format for local development
+* RequestContextMiddleware takes the request id from an X-Request-ID header
+  (or makes one), returns it in the response and attaches it to every
+  record logged while serving the request, including work run in the
+  threadpool and background tasks started from it
+* one access log record per request: errors and requests slower than
+  ACCESS_LOG_SLOW_MS are always logged, the rest with probability
+  ACCESS_LOG_SAMPLE_RATE (the rate is included so counts can be scaled up)
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+import traceback
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from app import metrics
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+ACCESS_LOG_SAMPLE_RATE = float(os.getenv("ACCESS_LOG_SAMPLE_RATE", 0.1))
+ACCESS_LOG_SLOW_MS = float(os.getenv("ACCESS_LOG_SLOW_MS", 1000))
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+request_id_var = contextvars.ContextVar("request_id", default=None)
+access_logger = logging.getLogger("app.access")
+
+metrics.describe("log_records_dropped_total", "Log records dropped because the log queue was full")
+
+# Attributes every LogRecord has; anything else came in through `extra`
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "request_id"}
+
+class LogState:
+    listener = None
+
+class RequestIdFilter(logging.Filter):
+    """Stamps records with the id of the request being served (if any)"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Drops records instead of blocking the caller when the queue is full"""
+
+    def prepare(self, record):
+        # Only resolve the message and traceback here; formatting happens
+        # on the writer thread
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = "".join(traceback.format_exception(*record.exc_info)).rstrip()
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.increment("log_records_dropped_total")
+
+def configure_logging(level: str = LOG_LEVEL, log_format: str = LOG_FORMAT):
+    """Install the queue handler on the root logger (idempotent per process)"""
+    if LogState.listener is not None:
+        return
+    output = logging.StreamHandler(sys.stdout)
+    if log_format == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"))
+
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(RequestIdFilter())
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    # uvicorn installs its own synchronous stdout handlers; send its records
+    # through the queue too and replace its access log with ours
+    for name in ("uvicorn", "uvicorn.error"):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers = []
+        uvicorn_logger.propagate = True
+    logging.getLogger("uvicorn.access").disabled = True
+
+    LogState.listener = QueueListener(log_queue, output, respect_handler_level=True)
+    LogState.listener.start()
+    # Flush what is still queued when the process exits
+    atexit.register(stop_logging)
+
+def stop_logging():
+    if LogState.listener is not None:
+        LogState.listener.stop()
+        LogState.listener = None
+
+class RequestContextMiddleware:
+    """Request id correlation and sampled access logs (pure ASGI, no body buffering)"""
+
+    def __init__(self, app, sample_rate: float = ACCESS_LOG_SAMPLE_RATE, slow_ms: float = ACCESS_LOG_SLOW_MS):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:128]
+                break
+        request_id = request_id or uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_request_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (REQUEST_ID_HEADER.lower().encode(), request_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            if status_code >= 400 or duration_ms >= self.slow_ms or random.random() < self.sample_rate:
+                access_logger.log(
+                    logging.WARNING if status_code >= 500 else logging.INFO,
+                    f"{scope['method']} {scope['path']} {status_code}",
+                    extra={
+                        "method": scope["method"],
+                        "path": scope["path"],
+                        "status": status_code,
+                        "duration_ms": round(duration_ms, 2),
+                        "sample_rate": 1.0 if status_code >= 400 or duration_ms >= self.slow_ms else self.sample_rate
+                    }
+                )
+            request_id_var.reset(token)
@@ -0,0 +1,63 @@
+"""
+Show where each report query is routed.
+
+Records every command the report endpoints send, with the read preference
+attached and the server that answered, so the routing can be checked against
+a local replica set. A single-host replica set is enough to see the
+`$readPreference` each command carries:
+
+    mongod --replSet rs0 --dbpath /tmp/rs0 --port 27017
+    mongosh --eval "rs.initiate()"
+    cd backend
+    MONGODB_URL="mongodb://localhost:27017/inventory_db?replicaSet=rs0" \
+        python -m benchmarks.check_read_routing
+
+With secondaries present, analytics commands report a secondary's address.
+"""
+import asyncio
+import sys
+
+from pymongo import monitoring
+
+
+class RoutingListener(monitoring.CommandListener):
+    def __init__(self):
+        self.commands = []
+
+    def started(self, event):
+        if event.command_name in ("find", "aggregate", "count", "getMore"):
+            read_preference = event.command.get("$readPreference", {"mode": "primary"})
+            self.commands.append((event.command_name, read_preference, event.connection_id))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def main():
+    listener = RoutingListener()
+    # Must be registered before the application creates its MongoClient
+    monitoring.register(listener)
+
+    from app.models import User
+    from app.routers import reports
+
+    user = User(username="routing-check", hashed_password="", role="admin")
+    checks = [
+        ("get_sales_analytics", reports.get_sales_analytics(days=30, current_user=user)),
+        ("get_inventory_analytics", reports.get_inventory_analytics(current_user=user)),
+        ("get_dashboard_stats", reports.get_dashboard_stats(current_user=user)),
+    ]
+    for name, coroutine in checks:
+        listener.commands.clear()
+        asyncio.run(coroutine)
+        print(name)
+        for command_name, read_preference, server in listener.commands:
+            print(f"    {command_name:10} {read_preference} -> {server[0]}:{server[1]}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+"""
+Compare two benchmark reports produced by run_benchmarks.py.
+
+    python -m benchmarks.compare baseline.json candidate.json --threshold 10
+
+Exits with status 1 when any scenario's p99 latency or throughput regressed by
+more than the threshold (percent).
+"""
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path) as f:
+        return {result["scenario"]: result for result in json.load(f)["results"]}
+
+
+def pct_change(old, new):
+    if not old:
+        return 0.0
+    return (new - old) / old * 100.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark reports")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0)
+    args = parser.parse_args(argv)
+
+    baseline = load(args.baseline)
+    candidate = load(args.candidate)
+    regressed = False
+
+    print(f"{'scenario':32} {'rps':>18} {'p50 ms':>18} {'p99 ms':>18}")
+    for name, old in baseline.items():
+        new = candidate.get(name)
+        if new is None:
+            print(f"{name:32} missing from candidate")
+            continue
+        rps = pct_change(old["throughput_rps"], new["throughput_rps"])
+        p50 = pct_change(old["latency_ms"]["p50"], new["latency_ms"]["p50"])
+        p99 = pct_change(old["latency_ms"]["p99"], new["latency_ms"]["p99"])
+        flag = ""
+        if rps < -args.threshold or p99 > args.threshold:
+            regressed = True
+            flag = "  REGRESSION"
+        print(f"{name:32} {new['throughput_rps']:>10.1f} ({rps:+5.1f}%) "
+              f"{new['latency_ms']['p50']:>9.2f} ({p50:+5.1f}%) "
+              f"{new['latency_ms']['p99']:>9.2f} ({p99:+5.1f}%){flag}")
+
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+Synthetic data generator for benchmarking and capacity planning.
+
+Generates N products and M orders with realistic shapes:
+
+* Zipfian product popularity (a few best sellers, a long tail)
+* Seasonal order timestamps (yearly cycle, weekday and time-of-day patterns,
+  end-of-year peak)
+* An age-dependent status mix (recent orders are still pending/confirmed,
+  older ones are mostly delivered, a few are cancelled)
+* Multi-line orders
+
+Orders are written with batched, unordered `insert_many` calls from parallel
+worker processes. A given --seed and --workers always produce the same
+documents, including their ObjectIds. Orders bypass the API, so rebuild the
+derived sales counters and customer aggregates afterwards
+(python -m app.sales_counters rebuild, python -m app.customers rebuild).
+
+    cd backend
+    MONGODB_URL=mongodb://localhost:27017/inventory_bench \
+        python -m benchmarks.generate_data --products 100000 --orders 5000000 --workers 16 --seed 7
+"""
+import argparse
+import calendar
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import MongoClient
+
+CATEGORIES = ["Electronics", "Clothing", "Home", "Garden", "Toys", "Sports", "Books", "Beauty", "Grocery", "Office"]
+FIRST_NAMES = ["Aisha", "Ben", "Carlos", "Divya", "Elena", "Farid", "Grace", "Hiro", "Ines", "Jamal", "Kavya", "Liam"]
+LAST_NAMES = ["Khan", "Smith", "Garcia", "Iyer", "Rossi", "Haddad", "Chen", "Tanaka", "Silva", "Brown", "Nair", "Okafor"]
+ITEM_COUNT_WEIGHTS = [40, 22, 13, 8, 6, 4, 3, 2, 1, 1]  # 1..10 line items per order
+HOUR_WEIGHTS = [1, 1, 1, 1, 1, 2, 3, 5, 7, 8, 9, 10, 11, 10, 9, 9, 10, 11, 12, 12, 10, 7, 4, 2]
+WEEKDAY_WEIGHTS = [1.0, 0.95, 0.95, 1.0, 1.15, 1.3, 1.2]  # Monday..Sunday
+
+
+def make_object_id(timestamp, worker, sequence):
+    """Deterministic ObjectId whose embedded time matches the document."""
+    return ObjectId(
+        int(timestamp).to_bytes(4, "big") + worker.to_bytes(2, "big") + sequence.to_bytes(6, "big")
+    )
+
+
+def zipf_cum_weights(count, exponent):
+    cum_weights = []
+    total = 0.0
+    for rank in range(1, count + 1):
+        total += 1.0 / rank ** exponent
+        cum_weights.append(total)
+    return cum_weights
+
+
+def seasonal_day_cum_weights(end, days):
+    """Cumulative weights for each day in [end - days, end)."""
+    cum_weights = []
+    total = 0.0
+    start = end - timedelta(days=days)
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        yearly = 1.0 + 0.25 * math.sin(2 * math.pi * (day.timetuple().tm_yday - 100) / 365.0)
+        holiday = 1.8 if (day.month == 11 and day.day >= 20) or day.month == 12 else 1.0
+        growth = 0.7 + 0.3 * offset / max(days - 1, 1)
+        total += yearly * holiday * growth * WEEKDAY_WEIGHTS[day.weekday()]
+        cum_weights.append(total)
+    return start, cum_weights
+
+
+def pick_status(rng, age_days):
+    if age_days < 2:
+        return rng.choices(["pending", "confirmed", "cancelled"], [60, 37, 3])[0]
+    if age_days < 7:
+        return rng.choices(["pending", "confirmed", "shipped", "cancelled"], [10, 30, 55, 5])[0]
+    if age_days < 14:
+        return rng.choices(["shipped", "delivered", "cancelled"], [35, 59, 6])[0]
+    return rng.choices(["delivered", "cancelled", "shipped"], [91, 7, 2])[0]
+
+
+def build_products(count, seed, now, extra_fields=None):
+    rng = random.Random(seed)
+    products = []
+    created_base = calendar.timegm((now - timedelta(days=730)).utctimetuple())
+    for i in range(count):
+        category = rng.choice(CATEGORIES)
+        created_ts = created_base + rng.randint(0, 700 * 86400)
+        created_at = datetime.utcfromtimestamp(created_ts)
+        product = {
+            "_id": make_object_id(created_ts, 0xFFFF, i),
+            "name": f"{category} Item {i:07d}",
+            "description": f"Synthetic {category.lower()} product",
+            "price": round(rng.lognormvariate(3.2, 0.9), 2),
+            "stock_quantity": int(rng.paretovariate(1.5) * 20),
+            "category": category,
+            "sku": f"SYN-{i:08d}",
+            "image_url": None,
+            "low_stock_threshold": rng.choice([5, 10, 10, 20, 50]),
+            "created_at": created_at,
+            "updated_at": created_at,
+        }
+        if extra_fields:
+            product.update(extra_fields)
+        products.append(product)
+    return products
+
+
+def _order_worker(task):
+    # Each worker opens its own MongoClient; clients are not fork-safe.
+    client = MongoClient(task[3])
+    try:
+        return _write_orders(client.get_database().orders, task)
+    finally:
+        client.close()
+
+
+def _write_orders(orders_collection, task):
+    (worker, count, seed, _, catalog, end_ts, days,
+     zipf_exponent, batch_size, extra_fields) = task
+
+    rng = random.Random(seed * 1_000_003 + worker)
+    end = datetime.utcfromtimestamp(end_ts)
+    # Popularity rank is a seeded shuffle of the catalog, so best sellers are
+    # spread over categories and price points.
+    popularity = list(range(len(catalog)))
+    random.Random(seed).shuffle(popularity)
+    product_cum_weights = zipf_cum_weights(len(catalog), zipf_exponent)
+    start, day_cum_weights = seasonal_day_cum_weights(end, days)
+    start_ts = calendar.timegm(start.utctimetuple())
+    hour_cum_weights = list(itertools.accumulate(HOUR_WEIGHTS))
+    item_counts = list(range(1, len(ITEM_COUNT_WEIGHTS) + 1))
+    item_cum_weights = list(itertools.accumulate(ITEM_COUNT_WEIGHTS))
+    day_range = range(days)
+
+    written = 0
+    while written < count:
+        batch = []
+        size = min(batch_size, count - written)
+        days_picked = rng.choices(day_range, cum_weights=day_cum_weights, k=size)
+        hours_picked = rng.choices(range(24), cum_weights=hour_cum_weights, k=size)
+        lines_picked = rng.choices(item_counts, cum_weights=item_cum_weights, k=size)
+        for n in range(size):
+            sequence = written + n
+            created_ts = (start_ts + days_picked[n] * 86400 + hours_picked[n] * 3600
+                          + rng.randrange(3600))
+            ranks = rng.choices(popularity, cum_weights=product_cum_weights, k=lines_picked[n])
+            items = []
+            total_amount = 0.0
+            for index in dict.fromkeys(ranks):
+                product_id, name, price = catalog[index]
+                quantity = 1 if rng.random() < 0.7 else rng.randint(2, 6)
+                total = price * quantity
+                total_amount += total
+                items.append({
+                    "product_id": product_id,
+                    "product_name": name,
+                    "quantity": quantity,
+                    "price": price,
+                    "total": total,
+                })
+            created_at = datetime.utcfromtimestamp(created_ts)
+            status = pick_status(rng, (end_ts - created_ts) / 86400.0)
+            updated_at = created_at if status == "pending" else created_at + timedelta(
+                hours=rng.randint(1, 72)
+            )
+            # Same draw order as always, so a seed keeps producing the same data
+            name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+            email = f"customer{rng.randrange(count * 4 + 1000)}@example.com"
+            order = {
+                "_id": make_object_id(created_ts, worker, sequence),
+                "order_number": f"ORD-{worker:02X}{sequence:07X}",
+                "customer_name": name,
+                "customer_email": email,
+                # Lowercase already, as app.customers.customer_key would make it
+                "customer_key": email,
+                "items": items,
+                "total_amount": total_amount,
+                "status": status,
+                "created_at": created_at,
+                "updated_at": min(updated_at, end),
+            }
+            if extra_fields:
+                order.update(extra_fields)
+            batch.append(order)
+        orders_collection.insert_many(batch, ordered=False, bypass_document_validation=True)
+        written += size
+    return written
+
+
+def generate(mongodb_url, products, orders, seed=0, workers=None, batch_size=5000,
+             days=365, zipf_exponent=1.1, extra_fields=None, now=None, database=None):
+    """
+    Insert the synthetic data set and return a summary dict.
+
+    With `database` (a database handle, e.g. the in-process one of
+    STORAGE_BACKEND=embedded) everything is written through it in this
+    process instead of connecting to mongodb_url; the data is the same.
+    """
+    workers = workers or os.cpu_count() or 1
+    now = now or datetime.utcnow().replace(microsecond=0)
+    started = time.perf_counter()
+
+    product_docs = build_products(products, seed, now, extra_fields)
+    client = MongoClient(mongodb_url) if database is None else None
+    try:
+        products_collection = (database if client is None else client.get_database()).products
+        for offset in range(0, len(product_docs), batch_size):
+            products_collection.insert_many(product_docs[offset:offset + batch_size], ordered=False)
+    finally:
+        if client is not None:
+            client.close()
+
+    catalog = [(str(p["_id"]), p["name"], p["price"]) for p in product_docs]
+    per_worker = [orders // workers + (1 if i < orders % workers else 0) for i in range(workers)]
+    tasks = [
+        (worker, count, seed, mongodb_url, catalog, calendar.timegm(now.utctimetuple()), days,
+         zipf_exponent, batch_size, extra_fields)
+        for worker, count in enumerate(per_worker) if count
+    ]
+
+    written = 0
+    if tasks and database is not None:
+        written = sum(_write_orders(database.orders, task) for task in tasks)
+    elif tasks:
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(len(tasks)) as pool:
+            written = sum(pool.map(_order_worker, tasks))
+
+    elapsed = time.perf_counter() - started
+    return {
+        "products": len(product_docs),
+        "orders": written,
+        "product_ids": [p[0] for p in catalog],
+        "seed": seed,
+        "workers": workers,
+        "elapsed_s": round(elapsed, 2),
+        "documents_per_minute": int((len(product_docs) + written) / elapsed * 60) if elapsed else 0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic products and orders")
+    parser.add_argument("--products", type=int, default=10_000)
+    parser.add_argument("--orders", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--days", type=int, default=365, help="History span for order timestamps")
+    parser.add_argument("--zipf-exponent", type=float, default=1.1)
+    parser.add_argument("--end-date", help="Newest order date (YYYY-MM-DD); pin it for reproducible runs")
+    parser.add_argument("--mongodb-url", default=os.getenv("MONGODB_URL", "mongodb://localhost:27017/inventory_db"))
+    parser.add_argument("--drop", action="store_true", help="Drop the products and orders collections first")
+    args = parser.parse_args(argv)
+
+    if args.products < 1:
+        parser.error("--products must be at least 1")
+
+    if args.drop:
+        client = MongoClient(args.mongodb_url)
+        client.get_database().products.drop()
+        client.get_database().orders.drop()
+        client.close()
+
+    now = datetime.strptime(args.end_date, "%Y-%m-%d") if args.end_date else None
+    summary = generate(
+        args.mongodb_url, args.products, args.orders, seed=args.seed, workers=args.workers,
+        batch_size=args.batch_size, days=args.days, zipf_exponent=args.zipf_exponent, now=now,
+    )
+    summary.pop("product_ids")
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""
+Measure cold-start time of the API in a fresh interpreter.
+
+Reports how long it takes from interpreter start until the app accepts
+requests (imports plus lifespan startup). MongoDB does not need to be
+reachable: startup no longer waits for it.
+
+    cd backend
+    python -m benchmarks.measure_startup --runs 5
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+CHILD = """
+import asyncio, time
+started = time.perf_counter()
+from app.main import app
+imported = time.perf_counter()
+
+async def main():
+    async with app.router.lifespan_context(app):
+        serving = time.perf_counter()
+        print(f"{imported - started} {serving - started}")
+
+asyncio.run(main())
+"""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure API cold-start time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--mongodb-url", default="mongodb://localhost:27017/inventory_startup",
+                        help="Does not need to be reachable")
+    args = parser.parse_args(argv)
+
+    totals, imports, serving = [], [], []
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, "-c", CHILD],
+            capture_output=True, text=True, check=True,
+            env={"MONGODB_URL": args.mongodb_url, "PATH": ""},
+        ).stdout.strip().splitlines()[-1]
+        totals.append((time.perf_counter() - started) * 1000)
+        import_s, serving_s = (float(value) for value in output.split())
+        imports.append(import_s * 1000)
+        serving.append(serving_s * 1000)
+
+    print(json.dumps({
+        "runs": args.runs,
+        "process_wall_ms_median": round(statistics.median(totals), 1),
+        "import_ms_median": round(statistics.median(imports), 1),
+        "import_to_serving_ms_median": round(statistics.median(serving), 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
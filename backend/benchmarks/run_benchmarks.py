@@ -0,0 +1,302 @@
+"""
+Load and latency benchmarks for the Inventory & Order Management API.
+
+Runs each scenario against either the in-process FastAPI app (default) or a
+running server (--base-url) and prints the results as JSON so two versions can
+be compared with a plain diff or a script.
+
+The in-process mode still talks to the MongoDB configured by MONGODB_URL, so
+point it at a throwaway database:
+
+    cd backend
+    MONGODB_URL=mongodb://localhost:27017/inventory_bench \
+        python -m benchmarks.run_benchmarks --analytics-orders 1000000 --output bench.json
+
+or, for quick local runs without a mongod, use the in-process database
+(timings are not comparable with MongoDB ones):
+
+    STORAGE_BACKEND=embedded python -m benchmarks.run_benchmarks --output bench.json
+
+Every order is placed by the one benchmark user, so the in-process app is
+started with order admission control (app/admission.py) opened up: no rate
+limits, and a queue that holds every client for as long as --timeout.
+Against --base-url, start the server with the same ORDER_* settings (see
+bench_admission_env). Each scenario reports its responses per status code,
+and the run fails (exit status 1) if any scenario has more than
+--max-error-rate of its requests rejected or failed, instead of reporting
+the latency of the few that got through.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import httpx
+
+from benchmarks import generate_data
+
+BENCH_TAG = "_bench"
+
+
+def bench_admission_env(args):
+    """Admission settings that never reject a benchmark request (read when app.admission is imported)."""
+    return {
+        "ORDER_USER_RATE_PER_SECOND": "1e9",
+        "ORDER_USER_BURST": "1e9",
+        "ORDER_RATE_PER_SECOND": "1e9",
+        "ORDER_BURST": "1e9",
+        "ORDER_MAX_QUEUE": str(args.concurrency),
+        "ORDER_QUEUE_TIMEOUT_MS": str(args.timeout * 1000),
+    }
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(name, latencies, status_codes, elapsed, concurrency, max_error_rate):
+    latencies = sorted(latencies)
+    ms = [value * 1000 for value in latencies]
+    requests = sum(status_codes.values())
+    errors = sum(count for code, count in status_codes.items() if code >= 400)
+    result = {
+        "scenario": name,
+        "requests": requests,
+        "errors": errors,
+        "status_codes": {str(code): count for code, count in sorted(status_codes.items())},
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 4),
+    }
+    if requests and errors / requests > max_error_rate:
+        # The latency of the few requests that got through says nothing
+        result["failed"] = True
+        return result
+    result.update({
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        "latency_ms": {
+            "mean": round(statistics.fmean(ms), 3) if ms else 0.0,
+            "p50": round(percentile(ms, 50), 3),
+            "p99": round(percentile(ms, 99), 3),
+            "max": round(ms[-1], 3) if ms else 0.0,
+        },
+    })
+    return result
+
+
+async def run_scenario(client, name, make_request, requests, concurrency, max_error_rate):
+    """Issue `requests` calls of `make_request` with `concurrency` workers."""
+    latencies = []
+    status_codes = collections.Counter()
+    counter = iter(range(requests))
+
+    async def worker():
+        for i in counter:
+            method, url, body = make_request(i)
+            start = time.perf_counter()
+            response = await client.request(method, url, json=body)
+            duration = time.perf_counter() - start
+            status_codes[response.status_code] += 1
+            if response.status_code < 400:
+                latencies.append(duration)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(name, latencies, status_codes, time.perf_counter() - start, concurrency, max_error_rate)
+
+
+def seed(args):
+    """Generate the benchmark catalog and order history; returns product ids."""
+    from app.database import get_database, STORAGE_BACKEND
+
+    # The embedded database only exists inside this process
+    summary = generate_data.generate(
+        os.getenv("MONGODB_URL", "mongodb://localhost:27017/inventory_db"),
+        args.products,
+        args.analytics_orders,
+        seed=args.seed,
+        workers=args.workers,
+        days=30,
+        extra_fields={BENCH_TAG: True},
+        database=get_database() if STORAGE_BACKEND == "embedded" else None,
+    )
+    print(f"Seeded {summary['products']} products and {summary['orders']} orders "
+          f"in {summary['elapsed_s']}s", file=sys.stderr)
+    # The generator writes orders directly, so the sales counters and
+    # customer aggregates are rebuilt
+    from app import sales_counters, customers
+    sales_counters.rebuild()
+    customers.rebuild()
+    return summary["product_ids"]
+
+
+def cleanup(db):
+    from app import sales_counters, customers
+
+    db.products.delete_many({BENCH_TAG: True})
+    db.orders.delete_many({BENCH_TAG: True})
+    db.orders.delete_many({"customer_email": "bench@example.com"})
+    sales_counters.rebuild()
+    customers.rebuild()
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+async def wait_until_ready(client, timeout):
+    """The app creates the admin user and indexes in the background after start."""
+    deadline = time.perf_counter() + timeout
+    while (await client.get("/readyz")).status_code != 200:
+        if time.perf_counter() > deadline:
+            raise RuntimeError("API did not become ready")
+        await asyncio.sleep(0.1)
+
+
+async def login(client, username, password):
+    response = await client.post("/api/auth/login", json={"username": username, "password": password})
+    response.raise_for_status()
+    client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+
+
+async def run_all(args, client, db):
+    random.seed(args.seed)
+    results = []
+
+    product_ids = seed(args)
+    # Order scenarios must never fail on stock.
+    db.products.update_many({BENCH_TAG: True}, {"$set": {"stock_quantity": 10_000_000}})
+
+    await wait_until_ready(client, args.timeout)
+    await login(client, args.username, args.password)
+
+    for item_count in (1, 10, 100):
+        def make_order(i, item_count=item_count):
+            items = [
+                {"product_id": product_ids[(i + n) % len(product_ids)], "quantity": 1}
+                for n in range(item_count)
+            ]
+            body = {"customer_name": "Bench Customer", "customer_email": "bench@example.com", "items": items}
+            return "POST", "/api/orders/", body
+
+        results.append(await run_scenario(
+            client, f"create_order_{item_count}_items", make_order, args.requests, args.concurrency,
+            args.max_error_rate
+        ))
+
+    results.append(await run_scenario(
+        client, "list_products", lambda i: ("GET", "/api/products/?limit=100", None),
+        args.requests, args.concurrency, args.max_error_rate
+    ))
+    results.append(await run_scenario(
+        client, "get_sales_analytics", lambda i: ("GET", "/api/reports/sales?days=30", None),
+        args.analytics_requests, 1, args.max_error_rate
+    ))
+    results.append(await run_scenario(
+        client, "get_dashboard_stats", lambda i: ("GET", "/api/reports/dashboard-stats", None),
+        args.requests, args.concurrency, args.max_error_rate
+    ))
+    return results
+
+
+async def main_async(args):
+    from app.database import get_database
+
+    db = get_database()
+    cleanup(db)
+    try:
+        if args.base_url:
+            async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout) as client:
+                results = await run_all(args, client, db)
+        else:
+            from app.main import app
+
+            async with app.router.lifespan_context(app):
+                transport = httpx.ASGITransport(app=app)
+                async with httpx.AsyncClient(
+                    transport=transport, base_url="http://bench", timeout=args.timeout
+                ) as client:
+                    results = await run_all(args, client, db)
+    finally:
+        if not args.keep_data:
+            cleanup(db)
+
+    return {
+        "generated_at": datetime.utcnow().isoformat() + "Z",
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "target": args.base_url or "in-process",
+        "parameters": {
+            "products": args.products,
+            "analytics_orders": args.analytics_orders,
+            "requests": args.requests,
+            "analytics_requests": args.analytics_requests,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the inventory API")
+    parser.add_argument("--base-url", help="Benchmark a running server instead of the in-process app")
+    parser.add_argument("--username", default=os.getenv("ADMIN_USERNAME", "admin"))
+    parser.add_argument("--password", default=os.getenv("ADMIN_PASSWORD", "admin123"))
+    parser.add_argument("--products", type=int, default=200, help="Products to seed (>= 100)")
+    parser.add_argument("--analytics-orders", type=int, default=1_000_000,
+                        help="Historical orders to seed for the analytics scenario")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per scenario")
+    parser.add_argument("--analytics-requests", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Data generator processes")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    parser.add_argument("--keep-data", action="store_true", help="Do not delete seeded documents")
+    parser.add_argument("--max-error-rate", type=float, default=0.01,
+                        help="Fail when a scenario has a larger share of 4xx/5xx responses")
+    args = parser.parse_args(argv)
+    args.products = max(args.products, 100)
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.base_url:
+        # Before the app is imported; explicit settings still win
+        for name, value in bench_admission_env(args).items():
+            os.environ.setdefault(name, value)
+    report = asyncio.run(main_async(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    failed = [result for result in report["results"] if result.get("failed")]
+    for result in failed:
+        print(f"Scenario {result['scenario']} failed: {result['errors']} of {result['requests']} "
+              f"requests rejected or failed, by status {result['status_codes']}", file=sys.stderr)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Concurrency stress test for stock reservation and restoration.
+
+Many threads create orders against a few products and then cancel, delete,
+cancel-then-delete, un-cancel (and cancel again) or retry those operations,
+all racing each other. At the
+end every product's stock must equal its starting stock minus the quantities
+held by orders that still exist and are not cancelled, and must never have
+gone negative, and the stock ledger must account for every change. With
+--shards the products' stock is split over that many shard counters.
+
+Runs against the MongoDB configured by MONGODB_URL (use a throwaway
+database), or in-process with STORAGE_BACKEND=embedded. Email sending is
+disabled for the run.
+
+    cd backend
+    MONGODB_URL=mongodb://localhost:27017/inventory_stress python -m benchmarks.stress_stock
+    STORAGE_BACKEND=embedded python -m benchmarks.stress_stock
+"""
+import argparse
+import asyncio
+import random
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from fastapi import HTTPException
+
+from app.database import (
+    get_products_collection, get_orders_collection, get_stock_movements_collection, get_stock_shards_collection
+)
+from app.email_service import email_service
+from app.models import User
+from app.routers import orders as orders_router
+from app.schemas import OrderCreate, OrderItemCreate, OrderStatusUpdate
+from app.stock_shards import set_shard_count, with_shard_totals
+
+STRESS_TAG = "_stress"
+STRESS_EMAIL = "stress@example.com"
+
+
+async def _no_email(*args, **kwargs):
+    return False
+
+
+def call(coroutine):
+    try:
+        return asyncio.run(coroutine)
+    except HTTPException as e:
+        if e.status_code >= 500:
+            raise
+        return None
+
+
+def worker(seed, product_ids, operations, user, errors):
+    """Returns the stock that left with shipped-then-deleted orders."""
+    rng = random.Random(seed)
+    shipped = {product_id: 0 for product_id in product_ids}
+    for _ in range(operations):
+        items = [
+            OrderItemCreate(product_id=product_id, quantity=rng.randint(1, 3))
+            for product_id in rng.sample(product_ids, rng.randint(1, len(product_ids)))
+        ]
+        order = OrderCreate(customer_name="Stress", customer_email=STRESS_EMAIL, items=items)
+        created = call(orders_router.create_order(order, idempotency=None, _admission=None, current_user=user))
+        if created is None:
+            continue
+
+        action = rng.choice([
+            "keep", "cancel", "delete", "cancel_delete", "retry_cancel", "retry_delete", "ship_delete",
+            "uncancel", "uncancel_cancel"
+        ])
+        try:
+            if action in ("cancel", "cancel_delete", "retry_cancel", "uncancel", "uncancel_cancel"):
+                call(orders_router.update_order_status(created.id, OrderStatusUpdate(status="cancelled"), current_user=user))
+            if action == "retry_cancel":
+                call(orders_router.update_order_status(created.id, OrderStatusUpdate(status="cancelled"), current_user=user))
+            if action in ("uncancel", "uncancel_cancel"):
+                # Takes the stock again (or fails when there is not enough left)
+                call(orders_router.update_order_status(created.id, OrderStatusUpdate(status="pending"), current_user=user))
+            if action == "uncancel_cancel":
+                call(orders_router.update_order_status(created.id, OrderStatusUpdate(status="cancelled"), current_user=user))
+            if action == "ship_delete":
+                call(orders_router.update_order_status(created.id, OrderStatusUpdate(status="shipped"), current_user=user))
+                for item in created.items:
+                    shipped[item.product_id] += item.quantity
+            if action in ("delete", "cancel_delete", "retry_delete", "ship_delete"):
+                call(orders_router.delete_order(created.id, current_user=user))
+            if action == "retry_delete":
+                call(orders_router.delete_order(created.id, current_user=user))
+        except Exception as e:
+            errors.append(repr(e))
+    return shipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stress stock reservation and restoration")
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--operations", type=int, default=50, help="Orders per thread")
+    parser.add_argument("--products", type=int, default=3)
+    parser.add_argument("--stock", type=int, default=500, help="Starting stock per product")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--shards", type=int, default=1, help="Stock shards per product")
+    args = parser.parse_args(argv)
+
+    email_service.send_email = _no_email
+    products_collection = get_products_collection()
+    orders_collection = get_orders_collection()
+    products_collection.delete_many({STRESS_TAG: True})
+    orders_collection.delete_many({"customer_email": STRESS_EMAIL})
+
+    now = datetime.utcnow()
+    result = products_collection.insert_many([
+        {
+            "name": f"Stress Product {i}", "price": 1.0, "stock_quantity": args.stock,
+            "sku": f"STRESS-{i}", "low_stock_threshold": -1,
+            "created_at": now, "updated_at": now, STRESS_TAG: True
+        }
+        for i in range(args.products)
+    ])
+    product_ids = [str(product_id) for product_id in result.inserted_ids]
+    if args.shards > 1:
+        for product_id in product_ids:
+            set_shard_count(product_id, args.shards)
+    user = User(username="stress", hashed_password="", role="admin")
+
+    errors = []
+    held = {product_id: 0 for product_id in product_ids}
+    with ThreadPoolExecutor(args.threads) as pool:
+        futures = [
+            pool.submit(worker, args.seed * 1000 + i, product_ids, args.operations, user, errors)
+            for i in range(args.threads)
+        ]
+        for future in futures:
+            for product_id, quantity in future.result().items():
+                held[product_id] += quantity
+
+    for order in orders_collection.find({"customer_email": STRESS_EMAIL}):
+        if order["status"] == "cancelled" or order.get("stock_restored"):
+            continue
+        for item in order["items"]:
+            held[item["product_id"]] += item["quantity"]
+
+    ledger = {
+        total["_id"]: total["delta"]
+        for total in get_stock_movements_collection().aggregate([
+            {"$match": {"product_id": {"$in": product_ids}}},
+            {"$group": {"_id": "$product_id", "delta": {"$sum": "$delta"}}}
+        ])
+    }
+
+    failed = bool(errors)
+    for error in errors[:10]:
+        print(f"worker error: {error}")
+    negative_shards = {shard["product_id"] for shard in get_stock_shards_collection().find({"quantity": {"$lt": 0}})}
+    for product in with_shard_totals(list(products_collection.find({STRESS_TAG: True}))):
+        product_id = str(product["_id"])
+        expected = args.stock - held[product_id]
+        booked = args.stock + ledger.get(product_id, 0)
+        ok = product["stock_quantity"] == expected == booked and product["stock_quantity"] >= 0
+        ok = ok and product_id not in negative_shards
+        failed = failed or not ok
+        print(f"{product['sku']}: stock={product['stock_quantity']} expected={expected} ledger={booked} {'OK' if ok else 'MISMATCH'}")
+
+    get_stock_movements_collection().delete_many({"product_id": {"$in": product_ids}})
+    get_stock_shards_collection().delete_many({"product_id": {"$in": product_ids}})
+    products_collection.delete_many({STRESS_TAG: True})
+    orders_collection.delete_many({"customer_email": STRESS_EMAIL})
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
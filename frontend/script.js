@@ -11,6 +11,10 @@ let salesTrendChart = null;
 let categoryChart = null;
 let inventoryChart = null;
 let topProductsChart = null;
+// Local copies of the product and order lists, kept current through the
+// delta sync endpoints (only what changed since `cursor` is fetched)
+const productSync = { cursor: null, items: new Map() };
+const orderSync = { cursor: null, items: new Map() };
 
 // Check authentication and get user info
 async function checkAuth() {
@@ -371,7 +375,7 @@ function setupModals() {
 async function loadDashboardStats() {
     try {
         console.log('Loading dashboard stats...');
-        const stats = await apiCall('/reports/dashboard-stats');
+        const stats = await apiCall('/reports/dashboard-stats?summary=true');
         console.log('Dashboard stats received:', stats);
         
         if (stats) {
@@ -518,11 +522,35 @@ async function loadTopProducts() {
     }
 }
 
+// Pull the changes of a list since the last sync into its local copy
+async function syncList(endpoint, state) {
+    let page;
+    do {
+        const separator = endpoint.includes('?') ? '&' : '?';
+        const since = state.cursor ? `&since=${encodeURIComponent(state.cursor)}` : '';
+        page = await apiCall(`${endpoint}${separator}limit=500${since}`);
+        if (!page) {
+            // Start over with a full sync next time
+            state.cursor = null;
+            state.items.clear();
+            return false;
+        }
+        page.changes.forEach(item => state.items.set(item.id, item));
+        page.deleted.forEach(tombstone => state.items.delete(tombstone.id));
+        (page.stock || []).forEach(level => {
+            const item = state.items.get(level.id);
+            if (item) item.stock_quantity = level.stock_quantity;
+        });
+        state.cursor = page.cursor;
+    } while (page.has_more);
+    return true;
+}
+
 // Products functionality
 async function loadProducts() {
-    const data = await apiCall('/products');
-    if (data) {
-        products = data;
+    if (await syncList('/products/changes', productSync)) {
+        // Ids grow with creation time, which is the order the list endpoint uses
+        products = [...productSync.items.values()].sort((a, b) => a.id.localeCompare(b.id));
         renderProductsTable();
     }
 }
@@ -662,9 +690,8 @@ async function deleteProduct(productId) {
 
 // Orders functionality
 async function loadOrders() {
-    const data = await apiCall('/orders');
-    if (data) {
-        orders = data;
+    if (await syncList('/orders/changes?summary=true', orderSync)) {
+        orders = [...orderSync.items.values()].sort((a, b) => new Date(b.created_at) - new Date(a.created_at));
         renderOrdersTable();
     }
 }
@@ -759,6 +786,21 @@ function removeOrderItem(button) {
     }
 }
 
+let pendingOrder = null;
+
+// crypto.randomUUID only exists in secure contexts (https or localhost),
+// so pages served over plain http build the key from getRandomValues
+function newIdempotencyKey() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
+    }
+    if (window.crypto && crypto.getRandomValues) {
+        const bytes = crypto.getRandomValues(new Uint8Array(16));
+        return Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+    }
+    return `${Date.now().toString(16)}-${Math.random().toString(16).slice(2)}${Math.random().toString(16).slice(2)}`;
+}
+
 async function handleOrderSubmit(e) {
     e.preventDefault();
     
@@ -787,13 +829,22 @@ async function handleOrderSubmit(e) {
         customer_email: customerEmail,
         items
     };
+    const body = JSON.stringify(orderData);
+    
+    // Resubmitting the same order (double click, retry after a timeout)
+    // reuses its Idempotency-Key so the server places it only once
+    if (!pendingOrder || pendingOrder.body !== body) {
+        pendingOrder = { body, key: newIdempotencyKey() };
+    }
     
     const result = await apiCall('/orders', {
         method: 'POST',
-        body: JSON.stringify(orderData)
+        headers: { 'Idempotency-Key': pendingOrder.key },
+        body
     });
     
     if (result) {
+        pendingOrder = null;
         document.getElementById('orderModal').style.display = 'none';
         loadOrders();
         loadProducts();
@@ -950,7 +1001,7 @@ function loadSalesTrendChart(salesData) {
 
 // Load category distribution chart
 async function loadCategoryChart() {
-    const products = await apiCall('/products');
+    const products = await apiCall('/products?fields=category,price,stock_quantity');
     if (products) {
         const categoryData = {};
         products.forEach(product => {